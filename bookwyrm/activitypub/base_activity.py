@@ -1,4 +1,5 @@
 """ basics for an activitypub serializer """
+from collections import namedtuple
 from dataclasses import dataclass, fields, MISSING
 from json import JSONEncoder
 import logging
@@ -8,7 +9,7 @@ from django.apps import apps
 from django.db import IntegrityError, transaction
 from django.utils.http import http_date
 
-from bookwyrm import models
+from bookwyrm import http_client, models
 from bookwyrm.connectors import ConnectorException, get_data
 from bookwyrm.signatures import make_signature
 from bookwyrm.settings import DOMAIN, INSTANCE_ACTOR_USERNAME
@@ -16,6 +17,13 @@ from bookwyrm.tasks import app, MISC
 
 logger = logging.getLogger(__name__)
 
+# what ActivityObject.__init__ needs to know about each field of a dataclass
+FieldPlan = namedtuple(
+    "FieldPlan", ("name", "type", "default", "required", "is_activity")
+)
+# values of these types are never models or activities, and are set as they are
+PLAIN_TYPES = (str, int, float, bool, list)
+
 
 class ActivitySerializerError(ValueError):
     """routine problems serializing activitypub json"""
@@ -69,35 +77,49 @@ class ActivityObject:
         """this lets you pass in an object with fields that aren't in the
         dataclass, which it ignores. Any field in the dataclass is required or
         has a default value"""
-        for field in fields(self):
-            try:
-                value = kwargs[field.name]
-                if value in (None, MISSING, {}):
-                    raise KeyError("Missing required field", field.name)
-                try:
-                    is_subclass = issubclass(field.type, ActivityObject)
-                except TypeError:
-                    is_subclass = False
+        for field in self.get_field_plan():
+            value = kwargs.get(field.name, MISSING)
+            if value is None or value is MISSING or value == {}:
+                if field.required:
+                    raise ActivitySerializerError(
+                        f"Missing required field: {field.name}"
+                    )
+                value = field.default
+            elif type(value) not in PLAIN_TYPES:
                 # serialize a model obj
                 if hasattr(value, "to_activity"):
                     value = value.to_activity()
                 # parse a dict into the appropriate activity
-                elif is_subclass and isinstance(value, dict):
+                elif field.is_activity and isinstance(value, dict):
                     if activity_objects:
                         value = naive_parse(activity_objects, value)
                     else:
                         value = naive_parse(
                             activity_objects, value, serializer=field.type
                         )
-
-            except KeyError:
-                if field.default == MISSING and field.default_factory == MISSING:
-                    raise ActivitySerializerError(
-                        f"Missing required field: {field.name}"
-                    )
-                value = field.default
             setattr(self, field.name, value)
 
+    @classmethod
+    def get_field_plan(cls):
+        """the fields of the dataclass, which are only inspected the first time an
+        activity of this type is created"""
+        # looked up on the class itself, since subclasses have their own fields
+        plan = cls.__dict__.get("_field_plan")
+        if plan is None:
+            plan = tuple(
+                FieldPlan(
+                    field.name,
+                    field.type,
+                    field.default,
+                    field.default == MISSING and field.default_factory == MISSING,
+                    isinstance(field.type, type)
+                    and issubclass(field.type, ActivityObject),
+                )
+                for field in fields(cls)
+            )
+            cls._field_plan = plan
+        return plan
+
     # pylint: disable=too-many-locals,too-many-branches,too-many-arguments
     def to_model(
         self,
@@ -222,20 +244,16 @@ class ActivityObject:
     def serialize(self, **kwargs):
         """convert to dictionary with context attr"""
         omit = kwargs.get("omit", ())
-        data = self.__dict__.copy()
-        # recursively serialize
-        for (k, v) in data.items():
-            try:
-                if issubclass(type(v), ActivityObject):
-                    data[k] = v.serialize()
-                elif isinstance(v, list):
-                    data[k] = [
-                        e.serialize() if issubclass(type(e), ActivityObject) else e
-                        for e in v
-                    ]
-            except TypeError:
-                pass
-        data = {k: v for (k, v) in data.items() if v is not None and k not in omit}
+        data = {}
+        for (k, v) in self.__dict__.items():
+            if v is None or k in omit:
+                continue
+            # recursively serialize
+            if isinstance(v, ActivityObject):
+                v = v.serialize()
+            elif isinstance(v, list):
+                v = [e.serialize() if isinstance(e, ActivityObject) else e for e in v]
+            data[k] = v
         if "@context" not in omit:
             data["@context"] = "https://www.w3.org/ns/activitystreams"
         return data
@@ -381,7 +399,7 @@ def get_activitypub_data(url):
         # this shouldn't happen. it would be bad if it happened.
         raise ValueError("No private key found for sender")
     try:
-        resp = requests.get(
+        resp = http_client.get(
             url,
             headers={
                 # pylint: disable=line-too-long
@@ -1,23 +1,40 @@
 """ access the activity streams stored in redis """
 from datetime import timedelta
+from functools import cached_property
+from django.core.cache import cache
 from django.dispatch import receiver
 from django.db import transaction
 from django.db.models import signals, Q
 from django.utils import timezone
 from opentelemetry import trace
 
-from bookwyrm import models
+from bookwyrm import models, settings
+from bookwyrm.models.user import get_feed_filter_choices
 from bookwyrm.redis_store import RedisStore, r
+from bookwyrm.settings import PAGE_LENGTH
+from bookwyrm.status_cache import (
+    STATUS_CACHE_TIMEOUT,
+    get_status_cache_key,
+    statuses_from_cache,
+    status_to_cache,
+)
 from bookwyrm.tasks import app, STREAMS, IMPORT_TRIGGERED
 from bookwyrm.telemetry import open_telemetry
 
 
 tracer = open_telemetry.tracer()
 
+# a filtered stream only needs to last as long as someone is paging through it
+FILTERED_STORE_TIMEOUT = 60 * 5
+
 
 class ActivityStream(RedisStore):
     """a category of activity stream (like home, local, books)"""
 
+    # each stream is also split up by the status types users can filter their feeds
+    # by, plus everything that can't be filtered out
+    index_keys = get_feed_filter_choices() + ["other"]
+
     def stream_id(self, user_id):
         """the redis key for this user's instance of this stream"""
         return f"{user_id}-{self.key}"
@@ -36,12 +53,46 @@ class ActivityStream(RedisStore):
         """statuses are sorted by date published"""
         return obj.published_date.timestamp()
 
-    def add_status(self, status, increment_unread=False):
+    def get_index_keys(self, objs):
+        """the status type store that each status also goes in, loading the
+        statuses that were boosted in one query"""
+        boosted_ids = [s.boosted_status_id for s in objs if isinstance(s, models.Boost)]
+        boosted = {}
+        if boosted_ids:
+            boosted = {
+                s.id: s
+                for s in models.Status.objects.select_subclasses().filter(
+                    id__in=boosted_ids
+                )
+            }
+        return {
+            status.id: get_feed_filter_type(
+                boosted.get(status.boosted_status_id)
+                if isinstance(status, models.Boost)
+                else status
+            )
+            for status in objs
+        }
+
+    # pylint: disable=too-many-arguments
+    def add_status(
+        self,
+        status,
+        increment_unread=False,
+        audience=None,
+        pipeline=None,
+        index_keys=None,
+    ):
         """add a status to users' feeds"""
-        audience = self.get_audience(status)
+        audience = self.get_audience(status, audience=audience)
         # the pipeline contains all the add-to-stream activities
+        execute = pipeline is None
         pipeline = self.add_object_to_stores(
-            status, self.get_stores_for_users(audience), execute=False
+            status,
+            self.get_stores_for_users(audience),
+            execute=False,
+            pipeline=pipeline,
+            index_keys=index_keys,
         )
 
         if increment_unread:
@@ -53,8 +104,9 @@ class ActivityStream(RedisStore):
                     self.unread_by_status_type_id(user_id), get_status_type(status), 1
                 )
 
-        # and go!
-        pipeline.execute()
+        # and go! (unless the caller is batching up more statuses)
+        if execute:
+            pipeline.execute()
 
     def add_user_statuses(self, viewer, user):
         """add a user's statuses to another user's feed"""
@@ -75,9 +127,139 @@ class ActivityStream(RedisStore):
         r.delete(self.unread_by_status_type_id(user.id))
 
         statuses = self.get_store(self.stream_id(user.id))
+        return self.get_statuses_by_id(statuses)
+
+    # pylint: disable=too-many-arguments
+    def get_activity_page(
+        self,
+        user,
+        cursor=None,
+        page_length=PAGE_LENGTH,
+        allowed_types=None,
+        status_filter=None,
+    ):
+        """load a page of statuses older than the cursor, reading only as much of
+        the stream out of redis as it takes to fill the page"""
+        # clear unreads for this feed
+        r.set(self.unread_id(user.id), 0)
+        r.delete(self.unread_by_status_type_id(user.id))
+
+        store = self.stream_id(user.id)
+        if allowed_types is not None:
+            # only the first page builds the filtered stream, later pages use it
+            filtered_store = self.get_filtered_store(
+                user.id, allowed_types, reuse=cursor is not None
+            )
+            if filtered_store:
+                # redis has already done the filtering, no need for the database to
+                store, status_filter = filtered_store, None
+        # one extra status tells us whether there is a next page
+        page = self._read_stream(store, cursor, page_length + 1, status_filter)
+
+        next_cursor = page[page_length - 1][1] if len(page) > page_length else None
+        return StreamPage(
+            [status for status, _ in page[:page_length]],
+            cursor=cursor,
+            next_cursor=next_cursor,
+        )
+
+    def _read_stream(self, store, cursor, wanted, status_filter):
+        """statuses after the cursor that aren't filtered out, each with the
+        position in the stream after it"""
+        page = []
+        # statuses can share a rank, so the position in the stream is a rank and
+        # how many statuses with that rank have already been read
+        position = cursor or (None, 0)
+        while len(page) < wanted:
+            values = self.get_store_page(
+                store, max_score=position[0], offset=position[1], count=wanted
+            )
+            if not values:
+                break
+            status_ids = [int(v) for v, _ in values]
+            if status_filter:
+                statuses = status_filter(self.get_statuses_by_id(status_ids))
+                statuses = {s.id: s for s in statuses}
+            else:
+                statuses = self.get_cached_statuses(status_ids)
+            # keep the order from redis, skipping anything filtered out
+            for value, score in values:
+                if score == position[0]:
+                    position = (score, position[1] + 1)
+                else:
+                    position = (score, 1)
+                if int(value) in statuses:
+                    page.append((statuses[int(value)], position))
+            if len(values) < wanted:
+                break
+        return page
+
+    def get_filtered_store(self, user_id, allowed_types, reuse=False):
+        """combine the status type stores a user wants to see into one store, or
+        None if the stream was populated before there were type stores. With reuse,
+        a store that's already been combined is used as it is"""
+        stream_id = self.stream_id(user_id)
+        index_keys = [k for k in self.index_keys if k in allowed_types or k == "other"]
+        if len(index_keys) == len(self.index_keys):
+            # nothing is filtered out
+            return stream_id
+
+        store = self.index_store_id(stream_id, "-".join(["filtered"] + index_keys))
+        if reuse:
+            pipeline = r.pipeline()
+            pipeline.exists(self.index_complete_id(stream_id))
+            # this is only true if the store is still there
+            pipeline.expire(store, FILTERED_STORE_TIMEOUT)
+            indexed, existing = pipeline.execute()
+            if not indexed:
+                return None
+            if existing:
+                return store
+
+        pipeline = r.pipeline()
+        pipeline.exists(self.index_complete_id(stream_id))
+        pipeline.zunionstore(
+            store, [self.index_store_id(stream_id, k) for k in index_keys]
+        )
+        pipeline.expire(store, FILTERED_STORE_TIMEOUT)
+        indexed, _, _ = pipeline.execute()
+        if not indexed:
+            return None
+        return store
+
+    def get_cached_statuses(self, status_ids):
+        """load statuses ready to display from the cache shared by every feed,
+        only going to the database for the ones that aren't in it"""
+        # statuses that have been edited since they were cached will miss
+        keys = {
+            get_status_cache_key(status_id, updated_date): status_id
+            for status_id, updated_date in models.Status.objects.filter(
+                id__in=status_ids
+            ).values_list("id", "updated_date")
+        }
+        cached = cache.get_many(keys).values()
+        statuses = {status.id: status for status in statuses_from_cache(cached)}
+
+        missing = [status_id for status_id in status_ids if status_id not in statuses]
+        if missing:
+            loaded = {s.id: s for s in self.get_statuses_by_id(missing)}
+            cache.set_many(
+                {
+                    get_status_cache_key(i, status.updated_date): status_to_cache(
+                        status
+                    )
+                    for i, status in loaded.items()
+                },
+                timeout=STATUS_CACHE_TIMEOUT,
+            )
+            statuses.update(loaded)
+        return statuses
+
+    def get_statuses_by_id(self, status_ids):  # pylint: disable=no-self-use
+        """the statuses in a stream, with everything needed to display them"""
         return (
             models.Status.objects.select_subclasses()
-            .filter(id__in=statuses)
+            .filter(id__in=status_ids)
             .select_related(
                 "user",
                 "reply_parent",
@@ -101,12 +283,12 @@ class ActivityStream(RedisStore):
             for key, value in status_types.items()
         }
 
-    def populate_streams(self, user):
+    def populate_streams(self, user, pipeline=None):
         """go from zero to a timeline"""
-        self.populate_store(self.stream_id(user.id))
+        return self.populate_store(self.stream_id(user.id), pipeline=pipeline)
 
     @tracer.start_as_current_span("ActivityStream._get_audience")
-    def _get_audience(self, status):  # pylint: disable=no-self-use
+    def _get_audience(self, status, audience):  # pylint: disable=no-self-use
         """given a status, what users should see it, excluding the author"""
         trace.get_current_span().set_attribute("status_type", status.status_type)
         trace.get_current_span().set_attribute("status_privacy", status.privacy)
@@ -114,49 +296,14 @@ class ActivityStream(RedisStore):
             "status_reply_parent_privacy",
             status.reply_parent.privacy if status.reply_parent else None,
         )
-        # direct messages don't appear in feeds, direct comments/reviews/etc do
-        if status.privacy == "direct" and status.status_type == "Note":
-            return models.User.objects.none()
-
-        # everybody who could plausibly see this status
-        audience = models.User.objects.filter(
-            is_active=True,
-            local=True,  # we only create feeds for users of this instance
-        ).exclude(
-            Q(id__in=status.user.blocks.all()) | Q(blocks=status.user)  # not blocked
-        )
-
-        # only visible to the poster and mentioned users
-        if status.privacy == "direct":
-            audience = audience.filter(
-                Q(id__in=status.mention_users.all())  # if the user is mentioned
-            )
-
-        # don't show replies to statuses the user can't see
-        elif status.reply_parent and status.reply_parent.privacy == "followers":
-            audience = audience.filter(
-                Q(id=status.reply_parent.user.id)  # if the user is the OG author
-                | (
-                    Q(following=status.user) & Q(following=status.reply_parent.user)
-                )  # if the user is following both authors
-            ).distinct()
-
-        # only visible to the poster's followers and tagged users
-        elif status.privacy == "followers":
-            audience = audience.filter(
-                Q(following=status.user)  # if the user is following the author
-            )
-        return audience.distinct()
+        return audience.visible
 
     @tracer.start_as_current_span("ActivityStream.get_audience")
-    def get_audience(self, status):
+    def get_audience(self, status, audience=None):
         """given a status, what users should see it"""
         trace.get_current_span().set_attribute("stream_id", self.key)
-        audience = self._get_audience(status).values_list("id", flat=True)
-        status_author = models.User.objects.filter(
-            is_active=True, local=True, id=status.user.id
-        ).values_list("id", flat=True)
-        return list(set(list(audience) + list(status_author)))
+        audience = audience or StatusAudience(status)
+        return list(self._get_audience(status, audience) | audience.author)
 
     def get_stores_for_users(self, user_ids):
         """convert a list of user ids into redis store ids"""
@@ -174,24 +321,46 @@ class ActivityStream(RedisStore):
         return self.get_statuses_for_user(user)
 
 
+class StreamPage:
+    """a page of statuses in a stream, and where in the stream the next page starts"""
+
+    def __init__(self, object_list, cursor=None, next_cursor=None):
+        self.object_list = object_list
+        self.cursor = cursor
+        self.next_cursor = format_cursor(next_cursor) if next_cursor else None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_previous(self):
+        """only the first page is loaded without a cursor"""
+        return self.cursor is not None
+
+    def has_next(self):
+        """there was more in the stream after this page"""
+        return self.next_cursor is not None
+
+
 class HomeStream(ActivityStream):
     """users you follow"""
 
     key = "home"
 
     @tracer.start_as_current_span("HomeStream.get_audience")
-    def get_audience(self, status):
+    def get_audience(self, status, audience=None):
         trace.get_current_span().set_attribute("stream_id", self.key)
-        audience = super()._get_audience(status)
-        if not audience:
+        audience = audience or StatusAudience(status)
+        visible = super()._get_audience(status, audience)
+        if not visible:
             return []
-        # if the user is following the author
-        audience = audience.filter(following=status.user).values_list("id", flat=True)
-        # if the user is the post's author
-        status_author = models.User.objects.filter(
-            is_active=True, local=True, id=status.user.id
-        ).values_list("id", flat=True)
-        return list(set(list(audience) + list(status_author)))
+        # if the user is following the author, or is the post's author
+        return list((visible & audience.followers) | audience.author)
 
     def get_statuses_for_user(self, user):
         return models.Status.privacy_filter(
@@ -211,11 +380,11 @@ class LocalStream(ActivityStream):
 
     key = "local"
 
-    def get_audience(self, status):
+    def get_audience(self, status, audience=None):
         # this stream wants no part in non-public statuses
         if status.privacy != "public" or not status.user.local:
             return []
-        return super().get_audience(status)
+        return super().get_audience(status, audience=audience)
 
     def get_statuses_for_user(self, user):
         # all public statuses by a local user
@@ -230,7 +399,7 @@ class BooksStream(ActivityStream):
 
     key = "books"
 
-    def _get_audience(self, status):
+    def _get_audience(self, status, audience):
         """anyone with the mentioned book on their shelves"""
         work = (
             status.book.parent_work
@@ -238,12 +407,15 @@ class BooksStream(ActivityStream):
             else status.mention_books.first().parent_work
         )
 
-        audience = super()._get_audience(status)
-        if not audience:
-            return models.User.objects.none()
-        return audience.filter(shelfbook__book__parent_work=work).distinct()
+        visible = super()._get_audience(status, audience)
+        if not visible:
+            return set()
+        shelvers = models.ShelfBook.objects.filter(
+            book__parent_work=work, user_id__in=visible
+        ).values_list("user_id", flat=True)
+        return set(shelvers)
 
-    def get_audience(self, status):
+    def get_audience(self, status, audience=None):
         # only show public statuses on the books feed,
         # and only statuses that mention books
         if status.privacy != "public" or not (
@@ -251,7 +423,7 @@ class BooksStream(ActivityStream):
         ):
             return []
 
-        return super().get_audience(status)
+        return super().get_audience(status, audience=audience)
 
     def get_statuses_for_user(self, user):
         """any public status that mentions the user's books"""
@@ -309,6 +481,106 @@ class BooksStream(ActivityStream):
         self.bulk_remove_objects_from_store(book_mentions, self.stream_id(user.id))
 
 
+class StatusAudience:
+    """everyone who could plausibly see a status, loaded once and shared by all
+    the streams so that each stream's audience is just set algebra"""
+
+    def __init__(self, status, local_users=None):
+        self.status = status
+        self.user = status.user
+        # a batch of statuses can share the same set of local users
+        self.shared_local_users = local_users
+
+    @cached_property
+    def author(self):
+        """the post's author, if they have feeds on this instance"""
+        if self.user.local and self.user.is_active:
+            return {self.user.id}
+        return set()
+
+    @cached_property
+    def local_users(self):
+        """we only create feeds for active users of this instance"""
+        if self.shared_local_users is not None:
+            return self.shared_local_users
+        return set(
+            models.User.objects.filter(is_active=True, local=True).values_list(
+                "id", flat=True
+            )
+        )
+
+    @cached_property
+    def blocked(self):
+        """users who have blocked the author, or who the author has blocked"""
+        blocks = models.UserBlocks.objects.filter(
+            Q(user_subject=self.user) | Q(user_object=self.user)
+        ).values_list("user_subject", "user_object")
+        return {user_id for block in blocks for user_id in block} - {self.user.id}
+
+    @cached_property
+    def followers(self):
+        """users following the author"""
+        return get_followers(self.user)
+
+    @cached_property
+    def visible(self):
+        """local users allowed to see the status, not counting the author"""
+        status = self.status
+        # direct messages don't appear in feeds, direct comments/reviews/etc do
+        if status.privacy == "direct" and status.status_type == "Note":
+            return set()
+
+        # everybody who could plausibly see this status
+        audience = self.local_users - self.blocked
+
+        # only visible to the poster and mentioned users
+        if status.privacy == "direct":
+            mentions = status.mention_users.values_list("id", flat=True)
+            return audience & set(mentions)
+
+        # don't show replies to statuses the user can't see
+        if status.reply_parent and status.reply_parent.privacy == "followers":
+            parent_author = status.reply_parent.user
+            return audience & (
+                {parent_author.id}  # if the user is the OG author
+                # if the user is following both authors
+                | (self.followers & get_followers(parent_author))
+            )
+
+        # only visible to the poster's followers and tagged users
+        if status.privacy == "followers":
+            return audience & self.followers
+        return audience
+
+
+def get_followers(user):
+    """users following a given user"""
+    return set(
+        models.UserFollows.objects.filter(user_object=user).values_list(
+            "user_subject", flat=True
+        )
+    )
+
+
+def format_cursor(cursor):
+    """a position in a stream, for the query string"""
+    score, offset = cursor
+    return f"{score!r}:{offset}"
+
+
+def parse_cursor(value):
+    """a position in a stream, from the query string, or None if it's invalid"""
+    try:
+        score, offset = value.split(":")
+        return float(score), int(offset)
+    except (AttributeError, ValueError):
+        return None
+
+
+# redis keys for statuses waiting to be added to streams in a batch
+BATCH_QUEUE_KEY = "add-status-batch"
+BATCH_SCHEDULED_KEY = "add-status-batch-scheduled"
+
 # determine which streams are enabled in settings.py
 streams = {
     "home": HomeStream(),
@@ -355,11 +627,14 @@ def add_status_on_create_command(sender, instance, created):
         # an out of date remote status is a low priority but should be added
         priority = IMPORT_TRIGGERED
 
-    add_status_task.apply_async(
-        args=(instance.id,),
-        kwargs={"increment_unread": created},
-        queue=priority,
-    )
+    if settings.STREAM_BATCH_SIZE and priority == STREAMS:
+        queue_status_for_batch(instance.id, increment_unread=created)
+    else:
+        add_status_task.apply_async(
+            args=(instance.id,),
+            kwargs={"increment_unread": created},
+            queue=priority,
+        )
 
     if sender == models.Boost:
         handle_boost_task.delay(instance.id)
@@ -529,10 +804,14 @@ def remove_status_task(status_ids):
         status_ids = [status_ids]
     statuses = models.Status.objects.filter(id__in=status_ids)
 
-    for stream in streams.values():
-        for status in statuses:
+    for status in statuses:
+        audience = StatusAudience(status)
+        for stream in streams.values():
             stream.remove_object_from_stores(
-                status, stream.get_stores_for_users(stream.get_audience(status))
+                status,
+                stream.get_stores_for_users(
+                    stream.get_audience(status, audience=audience)
+                ),
             )
 
 
@@ -544,8 +823,81 @@ def add_status_task(status_id, increment_unread=False):
     # to check than just to see if the states is more than a few days old
     if status.created_date < timezone.now() - timedelta(days=2):
         increment_unread = False
+    # the candidate audience and status type are worked out once and shared by
+    # every stream
+    audience = StatusAudience(status)
+    index_keys = streams["home"].get_index_keys([status])
     for stream in streams.values():
-        stream.add_status(status, increment_unread=increment_unread)
+        stream.add_status(
+            status,
+            increment_unread=increment_unread,
+            audience=audience,
+            index_keys=index_keys,
+        )
+
+
+def queue_status_for_batch(status_id, increment_unread=False):
+    """hold a status until the next batch is added to streams"""
+    length = r.rpush(BATCH_QUEUE_KEY, f"{status_id}:{int(increment_unread)}")
+    if length % settings.STREAM_BATCH_SIZE == 0:
+        # the batch is full, don't wait for the window to close
+        r.delete(BATCH_SCHEDULED_KEY)
+        add_status_batch_task.delay()
+    # only one batch is scheduled per window, the lock expires in case it gets lost
+    elif r.set(BATCH_SCHEDULED_KEY, 1, nx=True, ex=settings.STREAM_BATCH_WINDOW * 5):
+        add_status_batch_task.apply_async(countdown=settings.STREAM_BATCH_WINDOW)
+
+
+@app.task(queue=STREAMS)
+def add_status_batch_task():
+    """add a batch of queued statuses to streams in a single pipeline"""
+    # anything queued from now on needs a new batch scheduled
+    r.delete(BATCH_SCHEDULED_KEY)
+    pipeline = r.pipeline()
+    pipeline.lrange(BATCH_QUEUE_KEY, 0, settings.STREAM_BATCH_SIZE - 1)
+    pipeline.ltrim(BATCH_QUEUE_KEY, settings.STREAM_BATCH_SIZE, -1)
+    entries, _ = pipeline.execute()
+
+    # a status can be queued more than once, it only needs to be added once
+    increment_unread = {}
+    for entry in entries:
+        status_id, increment = map(int, entry.decode("utf-8").split(":"))
+        increment_unread[status_id] = increment_unread.get(status_id) or bool(increment)
+
+    add_statuses(increment_unread)
+
+    # the batch was full, so there may be more waiting
+    if r.llen(BATCH_QUEUE_KEY):
+        add_status_batch_task.delay()
+
+
+def add_statuses(increment_unread):
+    """add statuses to every stream they belong in, given a dict of status ids
+    and whether to tick the unread count for each"""
+    statuses = models.Status.objects.select_subclasses().filter(
+        id__in=increment_unread.keys()
+    )
+    # the candidate audiences all start from the same set of local users
+    local_users = None
+    # every stream has the same status type stores
+    index_keys = streams["home"].get_index_keys(statuses)
+    pipeline = r.pipeline()
+    for status in statuses:
+        audience = StatusAudience(status, local_users=local_users)
+        local_users = audience.local_users
+        # statuses more than a few days old are imports, don't tick the unread count
+        increment = increment_unread[status.id] and not (
+            status.created_date < timezone.now() - timedelta(days=2)
+        )
+        for stream in streams.values():
+            stream.add_status(
+                status,
+                increment_unread=increment,
+                audience=audience,
+                pipeline=pipeline,
+                index_keys=index_keys,
+            )
+    pipeline.execute()
 
 
 @app.task(queue=STREAMS)
@@ -580,14 +932,32 @@ def handle_boost_task(boost_id):
         created_date__lt=instance.created_date,
     )
 
+    boost_audience = StatusAudience(instance)
     for stream in streams.values():
         # people who should see the boost (not people who see the original status)
-        audience = stream.get_stores_for_users(stream.get_audience(instance))
+        audience = stream.get_stores_for_users(
+            stream.get_audience(instance, audience=boost_audience)
+        )
         stream.remove_object_from_stores(boosted, audience)
         for status in old_versions:
             stream.remove_object_from_stores(status, audience)
 
 
+def get_feed_filter_type(status):
+    """which of the feed_status_types filters a status falls under, or "other"
+    for statuses that can't be filtered out. Boosts should be passed the status
+    they boosted"""
+    if isinstance(status, models.Review):
+        return "review"
+    if isinstance(status, models.Comment):
+        return "comment"
+    if isinstance(status, models.Quotation):
+        return "quotation"
+    if isinstance(status, models.GeneratedNote):
+        return "everything"
+    return "other"
+
+
 def get_status_type(status):
     """return status type even for boosted statuses"""
     status_type = status.status_type.lower()
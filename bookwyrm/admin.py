@@ -1,7 +1,49 @@
 """ models that will show up in django admin for superuser """
 from django.contrib import admin
 from bookwyrm import models
+from bookwyrm.connectors.connector_health import get_health
 
 admin.site.register(models.User)
 admin.site.register(models.FederatedServer)
-admin.site.register(models.Connector)
+
+
+@admin.register(models.Connector)
+class ConnectorAdmin(admin.ModelAdmin):
+    """book data sources, with how well their searches have been going"""
+
+    list_display = (
+        "identifier",
+        "priority",
+        "active",
+        "recent_searches",
+        "error_rate",
+        "latency",
+        "timeout",
+    )
+
+    def get_health(self, obj):  # pylint: disable=no-self-use
+        """stats for the connector, loaded once for each row"""
+        if not hasattr(obj, "health"):
+            obj.health = get_health([obj.identifier])[obj.identifier]
+        return obj.health
+
+    @admin.display(description="Recent searches")
+    def recent_searches(self, obj):
+        """how many searches the stats are based on"""
+        return self.get_health(obj).searches
+
+    @admin.display(description="Error rate")
+    def error_rate(self, obj):
+        """failed searches"""
+        return f"{self.get_health(obj).error_rate:.0%}"
+
+    @admin.display(description="Response time (90th percentile)")
+    def latency(self, obj):
+        """how long most searches take"""
+        latency = self.get_health(obj).latency
+        return f"{latency:.2f}s" if latency is not None else None
+
+    @admin.display(description="Timeout")
+    def timeout(self, obj):
+        """how long searches will wait for this connector"""
+        return f"{self.get_health(obj).timeout:.2f}s"
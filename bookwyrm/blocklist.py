@@ -0,0 +1,93 @@
+""" blocked domains and ip addresses, held in memory """
+from collections import defaultdict
+import ipaddress
+import logging
+from urllib.parse import urlparse
+
+from django.apps import apps
+import redis
+
+from bookwyrm.redis_store import r
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = "blocklist-version"
+
+
+class BlocklistIndex:
+    """the blocked domains and ip addresses, loaded once per process and loaded
+    again when the version in redis is bumped by a change to the blocklist"""
+
+    def __init__(self):
+        self.loaded = False
+        self.version = None
+        self.domains = set()
+        # network addresses by ip version and prefix length, so that an address
+        # can be checked against every range with one lookup per prefix length
+        self.networks = defaultdict(set)
+        # anything that isn't a valid address or range is matched exactly
+        self.addresses = set()
+
+    def refresh(self):
+        """load the blocklist if it has changed since it was last loaded"""
+        try:
+            version = r.get(VERSION_KEY)
+        except redis.exceptions.RedisError as err:
+            # there's no way to know if it's changed, so it has to be loaded again
+            logger.warning("Unable to check the blocklist version: %s", err)
+            version = self.loaded = None
+        if self.loaded and version == self.version:
+            return
+
+        server_model = apps.get_model("bookwyrm.FederatedServer", require_ready=True)
+        ip_model = apps.get_model("bookwyrm.IPBlocklist", require_ready=True)
+
+        domains = set(
+            server_model.objects.filter(status="blocked").values_list(
+                "server_name", flat=True
+            )
+        )
+        networks = defaultdict(set)
+        addresses = set()
+        for address in ip_model.objects.values_list("address", flat=True):
+            try:
+                network = ipaddress.ip_network(address, strict=False)
+            except ValueError:
+                addresses.add(address)
+                continue
+            networks[(network.version, network.prefixlen)].add(network.network_address)
+
+        self.domains, self.networks, self.addresses = domains, networks, addresses
+        self.version = version
+        self.loaded = True
+
+    def is_domain_blocked(self, url):
+        """is the server this url is on blocked"""
+        self.refresh()
+        return urlparse(url).netloc in self.domains
+
+    def is_ip_blocked(self, address):
+        """is this ip address blocked, on its own or as part of a range"""
+        self.refresh()
+        try:
+            ip_address = ipaddress.ip_address(address)
+        except ValueError:
+            return address in self.addresses
+        for (version, prefixlen), networks in self.networks.items():
+            if version != ip_address.version:
+                continue
+            network = ipaddress.ip_network((ip_address, prefixlen), strict=False)
+            if network.network_address in networks:
+                return True
+        return False
+
+
+def bump_version():
+    """let every process know the blocklist has changed"""
+    try:
+        r.incr(VERSION_KEY)
+    except redis.exceptions.RedisError as err:
+        logger.warning("Unable to update the blocklist version: %s", err)
+
+
+blocklist = BlocklistIndex()
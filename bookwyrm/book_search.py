@@ -4,7 +4,7 @@ from functools import reduce
 import operator
 
 from django.contrib.postgres.search import SearchRank, SearchQuery
-from django.db.models import F, Q
+from django.db.models import F, Q, Subquery
 
 from bookwyrm import models
 from bookwyrm import connectors
@@ -97,22 +97,22 @@ def search_title_author(query, min_confidence, *filters, return_first=False):
         .order_by("-rank")
     )
 
-    # when there are multiple editions of the same work, pick the closest
-    editions_of_work = results.values_list("parent_work__id", flat=True).distinct()
-
-    # filter out multiple editions of the same work
-    list_results = []
-    for work_id in set(editions_of_work[:30]):
-        result = (
-            results.filter(parent_work=work_id)
-            .order_by("-rank", "-edition_rank")
-            .first()
-        )
+    # when there are multiple editions of the same work, pick the closest, all in
+    # one query: postgres keeps the first row for each work in the inner ordering
+    best_editions = (
+        results.order_by("parent_work_id", "-rank", "-edition_rank")
+        .distinct("parent_work_id")
+        .values("id")
+    )
+    list_results = (
+        models.Edition.objects.filter(id__in=Subquery(best_editions))
+        .annotate(rank=SearchRank(F("search_vector"), query))
+        .order_by("-rank", "-edition_rank")[:30]
+    )
 
-        if return_first:
-            return result
-        list_results.append(result)
-    return list_results
+    if return_first:
+        return list_results.first()
+    return list(list_results)
 
 
 @dataclass
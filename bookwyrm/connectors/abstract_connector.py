@@ -2,17 +2,17 @@
 from abc import ABC, abstractmethod
 from urllib.parse import quote_plus
 import imghdr
+import json
 import logging
 import re
 import asyncio
-import requests
 from requests.exceptions import RequestException
 import aiohttp
 
 from django.core.files.base import ContentFile
 from django.db import transaction
 
-from bookwyrm import activitypub, models, settings
+from bookwyrm import activitypub, http_client, models, settings
 from bookwyrm.settings import USER_AGENT
 from .connector_manager import load_more_data, ConnectorException, raise_not_valid_url
 from .format_mappings import format_mappings
@@ -264,8 +264,10 @@ def get_data(url, params=None, timeout=settings.QUERY_TIMEOUT):
     # check if the url is blocked
     raise_not_valid_url(url)
 
+    # only download the data again if it's changed since last time
+    cached = http_client.get_cached_response(url, params=params)
     try:
-        resp = requests.get(
+        resp = http_client.get(
             url,
             params=params,
             headers={  # pylint: disable=line-too-long
@@ -273,6 +275,7 @@ def get_data(url, params=None, timeout=settings.QUERY_TIMEOUT):
                     'application/json, application/activity+json, application/ld+json; profile="https://www.w3.org/ns/activitystreams"; charset=utf-8'
                 ),
                 "User-Agent": settings.USER_AGENT,
+                **http_client.get_conditional_headers(cached),
             },
             timeout=timeout,
         )
@@ -280,14 +283,21 @@ def get_data(url, params=None, timeout=settings.QUERY_TIMEOUT):
         logger.info(err)
         raise ConnectorException(err)
 
-    if not resp.ok:
+    if resp.status_code == 304 and cached:
+        content = cached.content
+        http_client.touch_cached_response(url, params=params)
+    elif not resp.ok:
         if resp.status_code == 401:
             # this is probably an AUTHORIZED_FETCH issue
             resp.raise_for_status()
         else:
             raise ConnectorException()
+    else:
+        content = resp.content
+        http_client.cache_response(url, resp, params=params)
+
     try:
-        data = resp.json()
+        data = json.loads(content)
     except ValueError as err:
         logger.info(err)
         raise ConnectorException(err)
@@ -299,7 +309,7 @@ def get_image(url, timeout=10):
     """wrapper for requesting an image"""
     raise_not_valid_url(url)
     try:
-        resp = requests.get(
+        resp = http_client.get(
             url,
             headers={
                 "User-Agent": settings.USER_AGENT,
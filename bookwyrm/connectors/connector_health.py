@@ -0,0 +1,95 @@
+""" how well each connector has been responding to searches """
+from collections import namedtuple
+import logging
+import statistics
+
+import redis
+
+from bookwyrm.redis_store import r
+from bookwyrm.settings import SEARCH_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+HEALTH_KEY = "connector-health"
+# how many of the most recent searches the stats are based on
+HEALTH_WINDOW = 50
+# stats are forgotten if a connector hasn't been searched in this long
+HEALTH_TIMEOUT = 60 * 60 * 24
+# below this many searches, there isn't enough to go on
+MIN_SEARCHES = 5
+
+# a connector gets this many times its usual response time before giving up
+TIMEOUT_FACTOR = 3
+MIN_TIMEOUT = 2
+# connectors failing this often are skipped, except for one search every
+# RETRY_INTERVAL seconds to see if they've recovered
+MAX_ERROR_RATE = 0.8
+RETRY_INTERVAL = 60
+
+ConnectorHealth = namedtuple(
+    "ConnectorHealth", ("searches", "error_rate", "latency", "timeout")
+)
+
+
+def record_searches(searches):
+    """note how searches went, given the connector identifier, whether it
+    worked and how long it took for each"""
+    if not searches:
+        return
+    try:
+        pipeline = r.pipeline(transaction=False)
+        for identifier, success, elapsed in searches:
+            key = f"{HEALTH_KEY}-{identifier}"
+            pipeline.lpush(key, f"{int(success)}:{int(elapsed * 1000)}")
+            pipeline.ltrim(key, 0, HEALTH_WINDOW - 1)
+            pipeline.expire(key, HEALTH_TIMEOUT)
+        pipeline.execute()
+    except redis.exceptions.RedisError as err:
+        logger.warning("Unable to save connector health: %s", err)
+
+
+def get_health(identifiers):
+    """recent error rate and 90th percentile response time in seconds for each
+    connector, and the timeout that gives it"""
+    try:
+        pipeline = r.pipeline(transaction=False)
+        for identifier in identifiers:
+            pipeline.lrange(f"{HEALTH_KEY}-{identifier}", 0, -1)
+        searches = pipeline.execute()
+    except redis.exceptions.RedisError as err:
+        logger.warning("Unable to load connector health: %s", err)
+        searches = [[] for _ in identifiers]
+
+    health = {}
+    for identifier, outcomes in zip(identifiers, searches):
+        outcomes = [o.decode("utf-8").split(":") for o in outcomes]
+        latencies = [int(ms) / 1000 for ok, ms in outcomes if ok == "1"]
+        failures = len(outcomes) - len(latencies)
+        error_rate = failures / len(outcomes) if outcomes else 0
+        latency = None
+        if len(latencies) > 1:
+            latency = statistics.quantiles(latencies, n=10)[-1]
+        elif latencies:
+            latency = latencies[0]
+
+        timeout = SEARCH_TIMEOUT
+        if len(outcomes) >= MIN_SEARCHES and latency is not None:
+            timeout = min(max(latency * TIMEOUT_FACTOR, MIN_TIMEOUT), SEARCH_TIMEOUT)
+        health[identifier] = ConnectorHealth(
+            len(outcomes), error_rate, latency, timeout
+        )
+    return health
+
+
+def is_healthy(identifier, health):
+    """should this connector be searched"""
+    if health.searches < MIN_SEARCHES or health.error_rate < MAX_ERROR_RATE:
+        return True
+    try:
+        # let one search through now and then to see if it's working again
+        return bool(
+            r.set(f"{HEALTH_KEY}-{identifier}-retry", 1, nx=True, ex=RETRY_INTERVAL)
+        )
+    except redis.exceptions.RedisError as err:
+        logger.warning("Unable to check connector health: %s", err)
+        return True
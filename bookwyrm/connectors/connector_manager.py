@@ -1,49 +1,198 @@
 """ interface with whatever connectors the app has """
 import asyncio
+from collections import namedtuple
+import hashlib
 import importlib
 import ipaddress
+import json
 import logging
+import time
 from urllib.parse import urlparse
+import uuid
 
 import aiohttp
+import redis
+from django.core.cache import cache
 from django.dispatch import receiver
+from django.db import transaction
 from django.db.models import signals
 
 from requests import HTTPError
 
-from bookwyrm import book_search, models
+from bookwyrm import book_search, http_client, models, settings
+from bookwyrm.redis_store import r
 from bookwyrm.settings import SEARCH_TIMEOUT
 from bookwyrm.tasks import app, CONNECTORS
+from . import connector_health
 
 logger = logging.getLogger(__name__)
 
+SEARCH_CACHE_KEY = "search-cache"
+CONNECTOR_REGISTRY_KEY = "connector-registry"
+
 
 class ConnectorException(HTTPError):
     """when the connector can't do what was asked"""
 
 
+# how one connector's search went
+SearchOutcome = namedtuple("SearchOutcome", ("identifier", "result", "elapsed"))
+
+
 async def async_connector_search(query, items, min_confidence):
     """Try a number of requests simultaneously"""
     timeout = aiohttp.ClientTimeout(total=SEARCH_TIMEOUT)
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        tasks = []
-        for url, connector in items:
-            tasks.append(
-                asyncio.ensure_future(
-                    connector.get_results(session, url, min_confidence, query)
-                )
-            )
+    async with http_client.async_session(timeout=timeout) as session:
+        tasks = [
+            asyncio.ensure_future(search)
+            for search in get_connector_searches(session, query, items, min_confidence)
+        ]
 
         results = await asyncio.gather(*tasks)
         return results
 
 
+def run_connector_search(query, items, min_confidence):
+    """search the connectors that have been working, and keep track of how it
+    went once they're all done"""
+    outcomes = asyncio.run(
+        async_connector_search(query, get_healthy_items(items), min_confidence)
+    )
+    record_outcomes(outcomes)
+    # failed requests will return None, so filter those out
+    return [outcome.result for outcome in outcomes if outcome.result]
+
+
+def get_healthy_items(items):
+    """the connectors that have been working, each with a timeout based on how
+    long that connector usually takes. This uses redis, so it happens before
+    the searches start rather than in the event loop"""
+    health = connector_health.get_health([c.identifier for _, c in items])
+    return [
+        (url, connector, health[connector.identifier].timeout)
+        for url, connector in items
+        if connector_health.is_healthy(
+            connector.identifier, health[connector.identifier]
+        )
+    ]
+
+
+def get_connector_searches(session, query, items, min_confidence):
+    """a search for each connector, with its timeout"""
+    return [
+        search_connector(connector, session, url, min_confidence, query, timeout)
+        for url, connector, timeout in items
+    ]
+
+
+# pylint: disable=too-many-arguments
+async def search_connector(connector, session, url, min_confidence, query, timeout):
+    """search one connector, timing how long it takes"""
+    start = time.monotonic()
+    try:
+        result = await asyncio.wait_for(
+            connector.get_results(session, url, min_confidence, query), timeout
+        )
+    except asyncio.TimeoutError:
+        logger.info("Connection timed out for url: %s", url)
+        result = None
+    return SearchOutcome(connector.identifier, result, time.monotonic() - start)
+
+
+def record_outcomes(outcomes):
+    """save how each connector did, all at once"""
+    connector_health.record_searches(
+        [
+            (outcome.identifier, bool(outcome.result), outcome.elapsed)
+            for outcome in outcomes
+        ]
+    )
+
+
 def search(query, min_confidence=0.1, return_first=False):
     """find books based on arbitrary keywords"""
     if not query:
         return []
-    results = []
 
+    items = get_search_items(query)
+
+    # use saved results where there are any
+    connectors = [connector for _, connector in items]
+    cached_results = get_cached_search(connectors, query, min_confidence)
+    results = list(cached_results.values())
+    items = [i for i in items if i[1].identifier not in cached_results]
+
+    # load as many results as we can
+    if items:
+        new_results = run_connector_search(query, items, min_confidence)
+        cache_search(new_results, query, min_confidence)
+        results += new_results
+    # keep the results in the order of the connectors' priority
+    priority = [connector.identifier for connector in connectors]
+    results.sort(key=lambda result: priority.index(result["connector"].identifier))
+
+    if return_first:
+        # find the best result from all the responses and return that
+        all_results = [result for con in results for result in con["results"]]
+        all_results = sorted(all_results, key=lambda res: res.confidence, reverse=True)
+        return all_results[0] if all_results else None
+
+    return results
+
+
+def search_progressively(query, min_confidence=0.1):
+    """find books based on arbitrary keywords, yielding each connector's results
+    as soon as they're available rather than waiting for the slowest one"""
+    if not query:
+        return
+
+    items = get_search_items(query)
+    connectors = [connector for _, connector in items]
+    cached_results = get_cached_search(connectors, query, min_confidence)
+    yield from cached_results.values()
+    items = [i for i in items if i[1].identifier not in cached_results]
+    if not items:
+        return
+
+    # the event loop is driven from here so that results can be passed on as
+    # they arrive
+    loop = asyncio.new_event_loop()
+    session = loop.run_until_complete(
+        open_search_session(aiohttp.ClientTimeout(total=SEARCH_TIMEOUT))
+    )
+    searches = get_connector_searches(
+        session, query, get_healthy_items(items), min_confidence
+    )
+    pending = {loop.create_task(search) for search in searches}
+    try:
+        while pending:
+            done, pending = loop.run_until_complete(
+                asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            )
+            # the loop isn't running, so redis doesn't hold up the other searches
+            outcomes = [task.result() for task in done]
+            record_outcomes(outcomes)
+            # failed requests will return None, so filter those out
+            results = [outcome.result for outcome in outcomes if outcome.result]
+            cache_search(results, query, min_confidence)
+            yield from results
+    finally:
+        # if the request is abandoned, stop searching
+        for task in pending:
+            task.cancel()
+        if pending:
+            loop.run_until_complete(asyncio.wait(pending))
+        loop.run_until_complete(session.close())
+        loop.close()
+
+
+async def open_search_session(timeout):
+    """the session has to be created in the event loop it's used in"""
+    return http_client.async_session(timeout=timeout)
+
+
+def get_search_items(query):
+    """the search url for each connector that can be searched"""
     items = []
     for connector in get_connectors():
         # get the search url from the connector before sending
@@ -55,21 +204,118 @@ def search(query, min_confidence=0.1, return_first=False):
             logger.info("Request denied to blocked domain: %s", url)
             continue
         items.append((url, connector))
+    return items
 
-    # load as many results as we can
-    results = asyncio.run(async_connector_search(query, items, min_confidence))
-    results = [r for r in results if r]
 
-    if return_first:
-        # find the best result from all the responses and return that
-        all_results = [r for con in results for r in con["results"]]
-        all_results = sorted(all_results, key=lambda r: r.confidence, reverse=True)
-        return all_results[0] if all_results else None
+def get_search_cache_key(identifier, query, min_confidence):
+    """the redis key for one connector's results for a query, ignoring case and
+    spacing"""
+    normalized = " ".join(query.casefold().split())
+    value = f"{identifier}\n{min_confidence}\n{normalized}"
+    return f"{SEARCH_CACHE_KEY}-{hashlib.sha256(value.encode('utf-8')).hexdigest()}"
 
-    # failed requests will return None, so filter those out
+
+def get_cached_search(connectors, query, min_confidence):
+    """results saved for each connector, by identifier. Results that are past
+    SEARCH_CACHE_FRESH are still used, but will be replaced in the background"""
+    keys = [
+        get_search_cache_key(c.identifier, query, min_confidence) for c in connectors
+    ]
+    try:
+        pipeline = r.pipeline(transaction=False)
+        for key in keys:
+            pipeline.hmget(key, "fetched", "results")
+        cached = pipeline.execute()
+    except redis.exceptions.RedisError as err:
+        logger.warning("Unable to load cached search results: %s", err)
+        return {}
+
+    now = time.time()
+    results = {}
+    used = {}
+    for connector, key, (fetched, data) in zip(connectors, keys, cached):
+        if data is None:
+            continue
+        used[key] = now
+        results[connector.identifier] = {
+            "connector": connector,
+            "results": [
+                book_search.SearchResult(connector=connector, **result)
+                for result in json.loads(data)
+            ],
+        }
+        if now - float(fetched) > settings.SEARCH_CACHE_FRESH:
+            refresh_search_cache(connector, key, query, min_confidence)
+
+    if used:
+        try:
+            # keep track of what's been used recently, for evicting the rest
+            r.zadd(SEARCH_CACHE_KEY, used, xx=True)
+        except redis.exceptions.RedisError as err:
+            logger.warning("Unable to update cached search results: %s", err)
     return results
 
 
+def refresh_search_cache(connector, key, query, min_confidence):
+    """re-run a search in the background, unless that's already happening"""
+    try:
+        # the lock outlasts the search, in case the task fails
+        if not r.set(f"{key}-refresh", 1, nx=True, ex=SEARCH_TIMEOUT * 10):
+            return
+    except redis.exceptions.RedisError as err:
+        logger.warning("Unable to refresh cached search results: %s", err)
+        return
+    refresh_search_cache_task.delay(connector.connector.id, query, min_confidence)
+
+
+@app.task(queue=CONNECTORS)
+def refresh_search_cache_task(connector_id, query, min_confidence):
+    """update the cached results of one connector for a query"""
+    connector = registry.load(connector_id)
+    url = connector.get_search_url(query)
+    try:
+        raise_not_valid_url(url)
+    except ConnectorException:
+        return
+    results = run_connector_search(query, [(url, connector)], min_confidence)
+    cache_search(results, query, min_confidence)
+
+
+def cache_search(results, query, min_confidence):
+    """save each connector's search results, dropping the least recently used
+    results once there are too many"""
+    if not results:
+        return
+    now = time.time()
+    try:
+        pipeline = r.pipeline()
+        used = {}
+        for result in results:
+            key = get_search_cache_key(
+                result["connector"].identifier, query, min_confidence
+            )
+            pipeline.hset(
+                key,
+                mapping={
+                    "fetched": now,
+                    "results": json.dumps([res.json() for res in result["results"]]),
+                },
+            )
+            pipeline.expire(key, settings.SEARCH_CACHE_TIMEOUT)
+            pipeline.delete(f"{key}-refresh")
+            used[key] = now
+        pipeline.zadd(SEARCH_CACHE_KEY, used)
+        pipeline.zcard(SEARCH_CACHE_KEY)
+        count = pipeline.execute()[-1]
+
+        extra = count - settings.SEARCH_CACHE_MAX_ENTRIES
+        if extra > 0:
+            oldest = [k for k, _ in r.zpopmin(SEARCH_CACHE_KEY, extra)]
+            r.delete(*oldest)
+    except redis.exceptions.RedisError as err:
+        logger.warning("Unable to cache search results: %s", err)
+
+
 def first_search_result(query, min_confidence=0.1):
     """search until you find a result that fits"""
     # try local search first
@@ -82,8 +328,7 @@ def first_search_result(query, min_confidence=0.1):
 
 def get_connectors():
     """load all connectors"""
-    for info in models.Connector.objects.filter(active=True).order_by("priority").all():
-        yield load_connector(info)
+    yield from registry.get_active()
 
 
 def get_or_create_connector(remote_id):
@@ -93,6 +338,10 @@ def get_or_create_connector(remote_id):
     if not identifier:
         raise ValueError("Invalid remote id")
 
+    connector = registry.find(identifier)
+    if connector:
+        return connector
+
     try:
         connector_info = models.Connector.objects.get(identifier=identifier)
     except models.Connector.DoesNotExist:
@@ -112,8 +361,7 @@ def get_or_create_connector(remote_id):
 @app.task(queue=CONNECTORS)
 def load_more_data(connector_id, book_id):
     """background the work of getting all 10,000 editions of LoTR"""
-    connector_info = models.Connector.objects.get(id=connector_id)
-    connector = load_connector(connector_info)
+    connector = registry.load(connector_id)
     book = models.Book.objects.select_subclasses().get(id=book_id)
     connector.expand_book_data(book)
 
@@ -121,18 +369,92 @@ def load_more_data(connector_id, book_id):
 @app.task(queue=CONNECTORS)
 def create_edition_task(connector_id, work_id, data):
     """separate task for each of the 10,000 editions of LoTR"""
-    connector_info = models.Connector.objects.get(id=connector_id)
-    connector = load_connector(connector_info)
+    connector = registry.load(connector_id)
     work = models.Work.objects.select_subclasses().get(id=work_id)
     connector.create_edition_from_data(work, data)
 
 
 def load_connector(connector_info):
     """instantiate the connector class"""
-    connector = importlib.import_module(
-        f"bookwyrm.connectors.{connector_info.connector_file}"
+    return registry.load(connector_info.id, connector_info=connector_info)
+
+
+class ConnectorRegistry:
+    """connector objects, which are created once for each process and forgotten
+    when any connector is changed, in this process or any other"""
+
+    def __init__(self):
+        self.version = None
+        self.connectors = {}
+        self.active = None
+
+    def refresh(self):
+        """check if connectors have changed since they were loaded"""
+        version = cache.get(CONNECTOR_REGISTRY_KEY)
+        if version != self.version:
+            self.clear()
+            self.version = version
+
+    def clear(self):
+        """forget the connectors in this process"""
+        self.connectors = {}
+        self.active = None
+
+    def load(self, connector_id, connector_info=None):
+        """the connector object for a connector"""
+        self.refresh()
+        connector = self.connectors.get(connector_id)
+        if connector is None:
+            connector_info = connector_info or models.Connector.objects.get(
+                id=connector_id
+            )
+            connector_module = importlib.import_module(
+                f"bookwyrm.connectors.{connector_info.connector_file}"
+            )
+            connector = connector_module.Connector(connector_info.identifier)
+            self.connectors[connector_id] = connector
+        return connector
+
+    def find(self, identifier):
+        """a connector that's already loaded, by identifier"""
+        self.refresh()
+        for connector in self.connectors.values():
+            if connector.identifier == identifier:
+                return connector
+        return None
+
+    def get_active(self):
+        """the active connectors, highest priority first"""
+        self.refresh()
+        if self.active is None:
+            self.active = [
+                self.load(info.id, connector_info=info)
+                for info in models.Connector.objects.filter(active=True).order_by(
+                    "priority"
+                )
+            ]
+        return self.active
+
+
+registry = ConnectorRegistry()
+
+
+@receiver(signals.post_save, sender="bookwyrm.Connector")
+@receiver(signals.post_delete, sender="bookwyrm.Connector")
+# pylint: disable=unused-argument
+def clear_connector_registry(sender, *args, **kwargs):
+    """a connector has been changed"""
+    reload_connectors()
+
+
+def reload_connectors():
+    """connector objects need to be recreated with the new settings"""
+    registry.clear()
+    # other processes find out once the change is saved, so they don't reload
+    # the old settings
+    transaction.on_commit(
+        lambda: cache.set(CONNECTOR_REGISTRY_KEY, uuid.uuid4().hex, None)
     )
-    return connector.Connector(connector_info.identifier)
 
 
 @receiver(signals.post_save, sender="bookwyrm.FederatedServer")
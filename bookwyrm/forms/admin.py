@@ -174,7 +174,7 @@ class IPBlocklistForm(CustomForm):
 class ServerForm(CustomForm):
     class Meta:
         model = models.FederatedServer
-        exclude = ["remote_id"]
+        exclude = ["remote_id", "delivery_failures", "delivery_retry_date"]
 
 
 class AutoModRuleForm(CustomForm):
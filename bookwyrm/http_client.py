@@ -0,0 +1,314 @@
+""" shared, pooled http connections for talking to other servers """
+from collections import defaultdict, namedtuple
+import hashlib
+from http.cookiejar import DefaultCookiePolicy
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import aiohttp
+import redis
+import requests
+from requests.adapters import HTTPAdapter
+
+from bookwyrm import settings
+from bookwyrm.redis_store import r
+
+logger = logging.getLogger(__name__)
+
+STATS_KEY = "http-stats"
+# how long per host stats are kept after the last request to that host
+STATS_TIMEOUT = 60 * 60 * 24 * 7
+# stats are collected in each process and written to redis every so often
+STATS_FLUSH_REQUESTS = 100
+STATS_FLUSH_SECONDS = 10
+
+RESPONSE_CACHE_KEY = "http-cache"
+# how long a cached response is kept without being used
+RESPONSE_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+# the size of each cached response, and of all of them together
+RESPONSE_CACHE_SIZES_KEY = "http-cache-sizes"
+RESPONSE_CACHE_BYTES_KEY = "http-cache-bytes"
+# how many responses are dropped at a time when the cache is too big
+RESPONSE_CACHE_EVICT_BATCH = 10
+
+# a response that can be checked for changes with a conditional request
+CachedResponse = namedtuple("CachedResponse", ("etag", "last_modified", "content"))
+
+
+class RequestStats:
+    """count requests, new connections, and time spent on each host"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = defaultdict(lambda: defaultdict(int))
+        self.pending_count = 0
+        self.last_flush = time.monotonic()
+
+    def record(self, host, reused, elapsed):
+        """note a finished request"""
+        with self.lock:
+            stats = self.pending[host]
+            stats["requests"] += 1
+            stats["reused"] += int(reused)
+            stats["milliseconds"] += int(elapsed * 1000)
+            self.pending_count += 1
+            should_flush = (
+                self.pending_count >= STATS_FLUSH_REQUESTS
+                or time.monotonic() - self.last_flush > STATS_FLUSH_SECONDS
+            )
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        """add what's been collected to the totals in redis"""
+        with self.lock:
+            pending, self.pending = self.pending, defaultdict(lambda: defaultdict(int))
+            self.pending_count = 0
+            self.last_flush = time.monotonic()
+        if not pending:
+            return
+        try:
+            pipeline = r.pipeline(transaction=False)
+            for host, stats in pending.items():
+                key = f"{STATS_KEY}-{host}"
+                for name, value in stats.items():
+                    pipeline.hincrby(key, name, value)
+                pipeline.expire(key, STATS_TIMEOUT)
+                pipeline.sadd(STATS_KEY, host)
+            pipeline.execute()
+        except redis.exceptions.RedisError as err:
+            logger.warning("Unable to save http stats: %s", err)
+
+
+request_stats = RequestStats()
+
+
+def get_host_stats():
+    """requests made to each host by every process, with how often a connection
+    was reused and how long the requests took on average"""
+    hosts = sorted(h.decode("utf-8") for h in r.smembers(STATS_KEY))
+    pipeline = r.pipeline(transaction=False)
+    for host in hosts:
+        pipeline.hgetall(f"{STATS_KEY}-{host}")
+    results = []
+    for host, stats in zip(hosts, pipeline.execute()):
+        if not stats:
+            # these have expired
+            r.srem(STATS_KEY, host)
+            continue
+        requests_count = int(stats.get(b"requests", 0))
+        if not requests_count:
+            continue
+        results.append(
+            {
+                "host": host,
+                "requests": requests_count,
+                "reuse_rate": int(stats.get(b"reused", 0)) / requests_count,
+                "average_milliseconds": int(stats.get(b"milliseconds", 0))
+                / requests_count,
+            }
+        )
+    return results
+
+
+_local = threading.local()
+
+
+def get_session():
+    """a requests session for this thread, which keeps connections open to the
+    hosts it talks to"""
+    session = getattr(_local, "session", None)
+    # connections can't be shared with a forked process
+    if session is None or _local.pid != os.getpid():
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=settings.HTTP_POOL_HOSTS,
+            pool_maxsize=settings.HTTP_POOL_CONNECTIONS_PER_HOST,
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        # the session is shared by every request, so it mustn't pass cookies set
+        # by one server on to requests for another
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        _local.session = session
+        _local.pid = os.getpid()
+    return session
+
+
+def get_connection_pool(session, url):
+    """the session's pool of connections to a url's host, if it has one"""
+    try:
+        return session.get_adapter(url).poolmanager.connection_from_url(url)
+    except (requests.exceptions.RequestException, ValueError):
+        # the request will fail with a requests exception
+        return None
+
+
+def request(method, url, **kwargs):
+    """make a request with the shared session"""
+    session = get_session()
+    pool = get_connection_pool(session, url)
+    if pool is None:
+        return session.request(method, url, **kwargs)
+
+    connections = pool.num_connections
+    start = time.monotonic()
+    try:
+        return session.request(method, url, **kwargs)
+    finally:
+        request_stats.record(
+            urlparse(url).hostname,
+            pool.num_connections == connections,
+            time.monotonic() - start,
+        )
+
+
+def get(url, **kwargs):
+    """make a GET request with the shared session"""
+    return request("GET", url, **kwargs)
+
+
+def get_response_cache_key(url, params=None):
+    """the redis key for a cached response to a request"""
+    url = requests.Request("GET", url, params=params).prepare().url
+    return f"{RESPONSE_CACHE_KEY}-{hashlib.sha256(url.encode('utf-8')).hexdigest()}"
+
+
+def get_cached_response(url, params=None):
+    """the last response to a request, if it was cached"""
+    try:
+        cached = r.hmget(
+            get_response_cache_key(url, params), "etag", "last_modified", "content"
+        )
+    except redis.exceptions.RedisError as err:
+        logger.warning("Unable to load cached response: %s", err)
+        return None
+    if cached[2] is None:
+        return None
+    etag, last_modified = [v.decode("utf-8") if v else None for v in cached[:2]]
+    return CachedResponse(etag, last_modified, cached[2])
+
+
+def get_conditional_headers(cached):
+    """ask the server to only send the response if it has changed"""
+    headers = {}
+    if cached and cached.etag:
+        headers["If-None-Match"] = cached.etag
+    if cached and cached.last_modified:
+        headers["If-Modified-Since"] = cached.last_modified
+    return headers
+
+
+def cache_response(url, response, params=None):
+    """keep a response that can be revalidated, dropping the least recently used
+    responses once they take up too much space"""
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    if not etag and not last_modified:
+        return
+    if "no-store" in response.headers.get("Cache-Control", ""):
+        return
+    size = len(response.content)
+    if size > settings.HTTP_CACHE_MAX_SIZE:
+        return
+
+    key = get_response_cache_key(url, params)
+
+    def replace(pipeline):
+        """write the response, with the size of any copy it's replacing"""
+        previous_size = int(pipeline.hget(RESPONSE_CACHE_SIZES_KEY, key) or 0)
+        pipeline.multi()
+        pipeline.delete(key)
+        pipeline.hset(
+            key,
+            mapping={
+                "etag": etag or "",
+                "last_modified": last_modified or "",
+                "content": response.content,
+            },
+        )
+        pipeline.expire(key, RESPONSE_CACHE_TIMEOUT)
+        pipeline.zadd(RESPONSE_CACHE_KEY, {key: time.time()})
+        pipeline.hset(RESPONSE_CACHE_SIZES_KEY, key, size)
+        pipeline.incrby(RESPONSE_CACHE_BYTES_KEY, size - previous_size)
+
+    try:
+        # every write to a response's size also writes the response, so watching
+        # it is enough to keep the size it replaces from changing underneath us
+        total_size = r.transaction(replace, key)[-1]
+        evict_responses(total_size)
+    except redis.exceptions.RedisError as err:
+        logger.warning("Unable to cache response: %s", err)
+
+
+def touch_cached_response(url, params=None):
+    """a cached response was used, so it's the last to be evicted"""
+    key = get_response_cache_key(url, params)
+    try:
+        pipeline = r.pipeline()
+        # an evicted response isn't added back
+        pipeline.zadd(RESPONSE_CACHE_KEY, {key: time.time()}, xx=True)
+        pipeline.expire(key, RESPONSE_CACHE_TIMEOUT)
+        pipeline.execute()
+    except redis.exceptions.RedisError as err:
+        logger.warning("Unable to update cached response: %s", err)
+
+
+def evict_responses(total_size):
+    """drop the least recently used responses until the rest fit in the cache"""
+    while total_size > settings.HTTP_CACHE_MAX_BYTES:
+        oldest = [
+            k for k, _ in r.zpopmin(RESPONSE_CACHE_KEY, RESPONSE_CACHE_EVICT_BATCH)
+        ]
+        if not oldest:
+            break
+        sizes = r.hmget(RESPONSE_CACHE_SIZES_KEY, *oldest)
+        pipeline = r.pipeline()
+        pipeline.delete(*oldest)
+        pipeline.hdel(RESPONSE_CACHE_SIZES_KEY, *oldest)
+        pipeline.decrby(RESPONSE_CACHE_BYTES_KEY, sum(int(s or 0) for s in sizes))
+        total_size = pipeline.execute()[-1]
+
+
+# pylint: disable=unused-argument
+async def on_request_start(session, context, params):
+    """start timing a request"""
+    context.start = time.monotonic()
+    context.reused = False
+
+
+async def on_connection_reused(session, context, params):
+    """the request didn't need a new connection"""
+    context.reused = True
+
+
+async def on_request_end(session, context, params):
+    """record the finished request"""
+    request_stats.record(
+        params.url.host, context.reused, time.monotonic() - context.start
+    )
+
+
+def get_trace_config():
+    """hooks for collecting stats on aiohttp requests"""
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_connection_reuseconn.append(on_connection_reused)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_end)
+    return trace_config
+
+
+def async_session(limit_per_host=None, **kwargs):
+    """an aiohttp session, which has to be created inside the event loop it's used
+    in, configured like the shared requests session"""
+    connector = aiohttp.TCPConnector(
+        limit_per_host=limit_per_host or settings.HTTP_POOL_CONNECTIONS_PER_HOST,
+        ttl_dns_cache=settings.HTTP_DNS_CACHE_TIMEOUT,
+    )
+    return aiohttp.ClientSession(
+        connector=connector, trace_configs=[get_trace_config()], **kwargs
+    )
@@ -54,9 +54,9 @@ class ListsStream(RedisStore):
             .distinct()
         )
 
-    def populate_lists(self, user):
+    def populate_lists(self, user, pipeline=None):
         """go from zero to a timeline"""
-        self.populate_store(self.stream_id(user))
+        return self.populate_store(self.stream_id(user), pipeline=pipeline)
 
     def get_audience(self, book_list):  # pylint: disable=no-self-use
         """given a list, what users should see it"""
@@ -0,0 +1,71 @@
+""" Measure how quickly activities are parsed and serialized """
+import json
+import pathlib
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from bookwyrm import activitypub
+
+DATA_DIR = pathlib.Path(__file__).parent.parent.parent.joinpath("tests/data")
+
+
+def get_payloads():
+    """representative json for the kinds of activities that are handled most"""
+    note = json.loads(DATA_DIR.joinpath("ap_note.json").read_bytes())
+    review = json.loads(DATA_DIR.joinpath("ap_comment.json").read_bytes())
+    review.update({"type": "Review", "name": "A review", "rating": 4})
+    edition = json.loads(DATA_DIR.joinpath("bw_edition.json").read_bytes())
+    person = json.loads(DATA_DIR.joinpath("ap_user.json").read_bytes())
+    create = {
+        "id": f"{review['id']}/activity",
+        "type": "Create",
+        "actor": review["attributedTo"],
+        "to": review["to"],
+        "cc": review["cc"],
+        "object": review,
+    }
+    return {
+        "Note": note,
+        "Review": review,
+        "Edition": edition,
+        "Person": person,
+        "Create": create,
+    }
+
+
+def run_benchmark(payloads, number):
+    """time parsing and serializing each payload, returning microseconds per call"""
+    results = []
+    for name, payload in payloads.items():
+        activity = activitypub.parse(payload)
+        parse_time = timeit.timeit(
+            lambda p=payload: activitypub.parse(p), number=number
+        )
+        serialize_time = timeit.timeit(activity.serialize, number=number)
+        results.append((name, parse_time * 1e6 / number, serialize_time * 1e6 / number))
+    return results
+
+
+class Command(BaseCommand):
+    """benchmark activity serializers"""
+
+    help = "Measure the time to parse and serialize common activities"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--number",
+            type=int,
+            default=10000,
+            help="How many times to parse and serialize each activity",
+        )
+
+    # pylint: disable=unused-argument
+    def handle(self, *args, **options):
+        """run the benchmark"""
+        for name, parse_time, serialize_time in run_benchmark(
+            get_payloads(), options["number"]
+        ):
+            self.stdout.write(
+                f"{name}: parse {parse_time:.1f} us, serialize {serialize_time:.1f} us"
+            )
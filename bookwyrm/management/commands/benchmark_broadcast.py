@@ -0,0 +1,93 @@
+""" Measure how quickly activities are signed and sent """
+import asyncio
+from collections import namedtuple
+import json
+import time
+
+from aiohttp import web
+from django.core.management.base import BaseCommand
+
+from bookwyrm.models.activitypub_mixin import async_broadcast
+from bookwyrm.signatures import create_key_pair
+
+# just enough of a user to sign requests as them
+BenchmarkKeyPair = namedtuple("BenchmarkKeyPair", ("id", "private_key"))
+BenchmarkSender = namedtuple("BenchmarkSender", ("remote_id", "key_pair"))
+
+
+async def accept(request):
+    """a stub inbox that takes anything"""
+    await request.read()
+    return web.Response(status=202)
+
+
+async def start_stub_hosts(runner, host_count):
+    """listen on a port for each stub server, so that deliveries are spread over
+    many hosts like they would be in a real broadcast"""
+    for _ in range(host_count):
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+    return [address[1] for address in runner.addresses]
+
+
+async def run_benchmark(counts, host_count):
+    """broadcast to local stub servers, returning the sends per second for each
+    number of recipients"""
+    app = web.Application()
+    app.router.add_post("/user/{user_id}/inbox", accept)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    ports = await start_stub_hosts(runner, host_count)
+
+    sender = BenchmarkSender(
+        "https://example.com/user/benchmark",
+        BenchmarkKeyPair(None, create_key_pair()[0]),
+    )
+    data = json.dumps({"type": "Create", "actor": sender.remote_id})
+
+    results = []
+    try:
+        for count in counts:
+            recipients = [
+                f"http://127.0.0.1:{ports[i % len(ports)]}/user/{i}/inbox"
+                for i in range(count)
+            ]
+            start = time.perf_counter()
+            responses = await async_broadcast(recipients, sender, data)
+            elapsed = time.perf_counter() - start
+            sent = len([r for r in responses if r is not None and r.ok])
+            results.append((count, sent, sent / elapsed))
+    finally:
+        await runner.cleanup()
+    return results
+
+
+class Command(BaseCommand):
+    """benchmark broadcasting"""
+
+    help = "Measure sends per second for broadcasts to local stub servers"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--recipients",
+            type=int,
+            nargs="+",
+            default=[1000, 10000],
+            help="How many recipients to broadcast to",
+        )
+        parser.add_argument(
+            "--hosts",
+            type=int,
+            default=100,
+            help="How many stub servers the recipients are spread across",
+        )
+
+    # pylint: disable=unused-argument
+    def handle(self, *args, **options):
+        """run the benchmark"""
+        results = asyncio.run(run_benchmark(options["recipients"], options["hosts"]))
+        for count, sent, rate in results:
+            self.stdout.write(
+                f"{count} recipients on {options['hosts']} hosts: "
+                f"{sent} sent, {rate:.1f} sends/s"
+            )
@@ -0,0 +1,143 @@
+""" Measure how quickly the local book database is searched """
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from bookwyrm import book_search, models
+
+WORDS = [
+    "after",
+    "autumn",
+    "bird",
+    "book",
+    "city",
+    "dark",
+    "dream",
+    "earth",
+    "fire",
+    "garden",
+    "glass",
+    "history",
+    "house",
+    "island",
+    "light",
+    "lost",
+    "moon",
+    "night",
+    "ocean",
+    "river",
+    "road",
+    "secret",
+    "silver",
+    "song",
+    "star",
+    "stone",
+    "story",
+    "summer",
+    "time",
+    "water",
+    "wind",
+    "winter",
+    "wolf",
+    "world",
+]
+
+
+def make_title(rng):
+    """a plausible book title made of a few common words"""
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 5))).title()
+
+
+def seed_catalog(count, editions_per_work, batch_size=5000):
+    """add a lot of editions to search, bypassing the model save methods.
+    These are meant for a development database, not one that federates."""
+    rng = random.Random(0)
+    work_fields = models.Work._meta.local_concrete_fields
+    edition_fields = models.Edition._meta.local_concrete_fields
+    # pylint: disable=protected-access
+    for start in range(0, count, batch_size):
+        editions_count = min(batch_size, count - start)
+        works_count = -(-editions_count // editions_per_work)
+        with transaction.atomic():
+            work_books = models.Book.objects.bulk_create(
+                models.Book(title=make_title(rng)) for _ in range(works_count)
+            )
+            # inherited models can't be bulk created, so add the rows for the
+            # child tables separately
+            models.Work.objects._insert(
+                [models.Work(book_ptr_id=book.id) for book in work_books],
+                fields=work_fields,
+            )
+            parent_works = [
+                work_books[i // editions_per_work].id for i in range(editions_count)
+            ]
+            edition_books = models.Book.objects.bulk_create(
+                models.Book(title=make_title(rng)) for _ in range(editions_count)
+            )
+            models.Edition.objects._insert(
+                [
+                    models.Edition(
+                        book_ptr_id=book.id,
+                        parent_work_id=work_id,
+                        edition_rank=rng.randint(0, 9),
+                    )
+                    for book, work_id in zip(edition_books, parent_works)
+                ],
+                fields=edition_fields,
+            )
+
+
+def run_benchmark(queries, number):
+    """time each query, returning the 50th and 99th percentile in milliseconds"""
+    timings = []
+    for _ in range(number):
+        for query in queries:
+            start = time.perf_counter()
+            book_search.search(query)
+            timings.append((time.perf_counter() - start) * 1000)
+    percentiles = statistics.quantiles(timings, n=100)
+    return percentiles[49], percentiles[98]
+
+
+class Command(BaseCommand):
+    """benchmark searching the local database"""
+
+    help = "Measure the time to search for books by title and author"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="How many editions to add to the database before searching",
+        )
+        parser.add_argument(
+            "--editions-per-work",
+            type=int,
+            default=3,
+            help="How many of the seeded editions belong to each work",
+        )
+        parser.add_argument(
+            "--number",
+            type=int,
+            default=10,
+            help="How many times to run each search",
+        )
+
+    # pylint: disable=unused-argument
+    def handle(self, *args, **options):
+        """run the benchmark"""
+        if options["seed"]:
+            seed_catalog(options["seed"], options["editions_per_work"])
+            self.stdout.write(f"Added {options['seed']} editions")
+
+        rng = random.Random(1)
+        queries = WORDS + [make_title(rng) for _ in range(len(WORDS))]
+        median, slowest = run_benchmark(queries, options["number"])
+        self.stdout.write(
+            f"{len(queries) * options['number']} searches: "
+            f"{median:.1f} ms p50, {slowest:.1f} ms p99"
+        )
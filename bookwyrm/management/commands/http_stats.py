@@ -0,0 +1,21 @@
+""" Show how requests to other servers are going """
+from django.core.management.base import BaseCommand
+
+from bookwyrm.http_client import get_host_stats
+
+
+class Command(BaseCommand):
+    """report on outgoing requests"""
+
+    help = "Show requests made to each server, connection reuse, and latency"
+
+    # pylint: disable=unused-argument
+    def handle(self, *args, **options):
+        """print the stats for each host, busiest first"""
+        stats = sorted(get_host_stats(), key=lambda s: s["requests"], reverse=True)
+        for host in stats:
+            self.stdout.write(
+                f"{host['host']}: {host['requests']} requests, "
+                f"{host['reuse_rate']:.0%} reused connections, "
+                f"{host['average_milliseconds']:.0f} ms average"
+            )
@@ -1,6 +1,15 @@
 """ Re-create user streams """
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import time
+
 from django.core.management.base import BaseCommand
+from django.db import connections
 from bookwyrm import activitystreams, lists_stream, models
+from bookwyrm.redis_store import r
+
+# how many users each unit of work handed to a worker covers
+USERS_PER_CHUNK = 50
 
 
 def populate_streams(stream=None):
@@ -20,6 +29,99 @@ def populate_streams(stream=None):
             activitystreams.populate_stream_task.delay(stream_key, user.id)
 
 
+def get_checkpoint_key(streams):
+    """the redis set of users whose streams have been rebuilt"""
+    return f"populate-streams-{'-'.join(sorted(streams))}-done"
+
+
+def rebuild_streams(stream=None, workers=1, resume=False, batch_size=10000):
+    """build all the streams for all the users in this process, splitting the
+    users up between a pool of workers and recording progress as it goes"""
+    streams = [stream] if stream else list(activitystreams.streams.keys())
+    checkpoint = get_checkpoint_key(streams)
+    if not resume:
+        r.delete(checkpoint)
+    done = {int(user_id) for user_id in r.smembers(checkpoint)}
+
+    user_ids = [
+        user_id
+        for user_id in models.User.objects.filter(local=True, is_active=True)
+        .order_by("id")
+        .values_list("id", flat=True)
+        if user_id not in done
+    ]
+    chunks = [
+        user_ids[i : i + USERS_PER_CHUNK]
+        for i in range(0, len(user_ids), USERS_PER_CHUNK)
+    ]
+    print(f"Populating streams {streams} for {len(user_ids)} users")
+    if done:
+        print(f"Skipping {len(done)} users that were already populated")
+
+    progress = RebuildProgress(len(user_ids))
+    if workers <= 1:
+        for chunk in chunks:
+            progress.update(
+                *populate_user_streams(chunk, streams, checkpoint, batch_size)
+            )
+        return progress
+
+    # the workers are forked, and can't share the database connection
+    connections.close_all()
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("fork")
+    ) as executor:
+        futures = [
+            executor.submit(
+                populate_user_streams, chunk, streams, checkpoint, batch_size
+            )
+            for chunk in chunks
+        ]
+        for future in as_completed(futures):
+            progress.update(*future.result())
+    return progress
+
+
+def populate_user_streams(user_ids, streams, checkpoint, batch_size):
+    """populate every stream for a group of users, returning how many users and
+    statuses were added"""
+    pipeline = r.pipeline(transaction=False)
+    status_count = 0
+    for user in models.User.objects.filter(id__in=user_ids):
+        for stream_key in streams:
+            status_count += activitystreams.streams[stream_key].populate_streams(
+                user, pipeline=pipeline
+            )
+        lists_stream.ListsStream().populate_lists(user, pipeline=pipeline)
+        # the user is only marked as done once its streams are written
+        pipeline.sadd(checkpoint, user.id)
+        if len(pipeline) >= batch_size:
+            pipeline.execute()
+    pipeline.execute()
+    return len(user_ids), status_count
+
+
+class RebuildProgress:
+    """report how far along a rebuild is, and how fast it's going"""
+
+    def __init__(self, total):
+        self.total = total
+        self.users = 0
+        self.statuses = 0
+        self.start = time.monotonic()
+
+    def update(self, users, statuses):
+        """record a finished group of users"""
+        self.users += users
+        self.statuses += statuses
+        elapsed = max(time.monotonic() - self.start, 0.001)
+        print(
+            f"{self.users}/{self.total} users, {self.statuses} statuses "
+            f"({self.users / elapsed:.1f} users/s, "
+            f"{self.statuses / elapsed:.0f} statuses/s)"
+        )
+
+
 class Command(BaseCommand):
     """start all over with user streams"""
 
@@ -31,9 +133,35 @@ class Command(BaseCommand):
             default=None,
             help="Specifies which time of stream to populate",
         )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Populate streams here with this many processes instead of "
+            "queueing a task for each user",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Skip users whose streams were populated by an interrupted run",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=10000,
+            help="How many redis commands to send at once",
+        )
 
     # pylint: disable=no-self-use,unused-argument
     def handle(self, *args, **options):
         """run feed builder"""
         stream = options.get("stream")
-        populate_streams(stream=stream)
+        if not options.get("workers") and not options.get("resume"):
+            populate_streams(stream=stream)
+            return
+        rebuild_streams(
+            stream=stream,
+            workers=options["workers"] or 1,
+            resume=options["resume"],
+            batch_size=options["batch_size"],
+        )
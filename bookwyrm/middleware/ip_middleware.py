@@ -1,6 +1,6 @@
 """ Block IP addresses """
 from django.http import Http404
-from bookwyrm import models
+from bookwyrm.blocklist import blocklist
 
 
 class IPBlocklistMiddleware:
@@ -11,6 +11,6 @@ class IPBlocklistMiddleware:
 
     def __call__(self, request):
         address = request.META.get("REMOTE_ADDR")
-        if models.IPBlocklist.objects.filter(address=address).exists():
+        if blocklist.is_ip_blocked(address):
             raise Http404()
         return self.get_response(request)
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.18 on 2023-04-10 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookwyrm", "0179_populate_sort_title"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="federatedserver",
+            name="delivery_failures",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="federatedserver",
+            name="delivery_retry_date",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,12 +1,14 @@
 """ activitypub model functionality """
 import asyncio
 from base64 import b64encode
-from collections import namedtuple
-from functools import reduce
+from collections import defaultdict, namedtuple
+from functools import partial, reduce
 import json
 import operator
 import logging
+import time
 from typing import List
+from urllib.parse import urlparse
 from uuid import uuid4
 
 import aiohttp
@@ -14,12 +16,19 @@ from Crypto.PublicKey import RSA
 from Crypto.Signature import pkcs1_15
 from Crypto.Hash import SHA256
 from django.apps import apps
+from django.core.cache import cache
 from django.core.paginator import Paginator
 from django.db.models import Q
 from django.utils.http import http_date
 
-from bookwyrm import activitypub
-from bookwyrm.settings import USER_AGENT, PAGE_LENGTH
+from bookwyrm import activitypub, http_client
+from bookwyrm.settings import (
+    USER_AGENT,
+    PAGE_LENGTH,
+    DELIVERY_HOST_CONCURRENCY,
+    DELIVERY_MAX_ATTEMPTS,
+    DELIVERY_RETRY_DELAY,
+)
 from bookwyrm.signatures import make_signature, make_digest
 from bookwyrm.tasks import app, BROADCAST
 from bookwyrm.models.fields import ImageField, ManyToManyField
@@ -30,12 +39,29 @@ logger = logging.getLogger(__name__)
 
 PropertyField = namedtuple("PropertyField", ("set_activity_from_field"))
 
+FOLLOWER_INBOXES_CACHE_TIMEOUT = 60 * 60 * 24
+# how old the date on a broadcast's signatures can get before they're redone
+SIGNATURE_DATE_REFRESH = 60
+
 # pylint: disable=invalid-name
 def set_activity_from_property_field(activity, obj, field):
     """assign a model property value to the activity json"""
     activity[field[1]] = getattr(obj, field[0])
 
 
+def get_deduplication_values(data, fields):
+    """the values in an activity for each deduplication field"""
+    values = {}
+    for field in fields:
+        activitypub_field = (
+            "id" if field.name == "origin_id" else field.get_activitypub_field()
+        )
+        value = data.get(activitypub_field)
+        if value:
+            values[field.name] = value
+    return values
+
+
 class ActivitypubMixin:
     """add this mixin for models that are AP serializable"""
 
@@ -44,45 +70,64 @@ class ActivitypubMixin:
 
     def __init__(self, *args, **kwargs):
         """collect some info on model fields for later use"""
-        self.image_fields = []
-        self.many_to_many_fields = []
-        self.simple_fields = []  # "simple"
-        # sort model fields by type
-        for field in self._meta.get_fields():
+        self.set_activity_fields()
+        super().__init__(*args, **kwargs)
+
+    def set_activity_fields(self):
+        """sort model fields by type"""
+        self.__dict__.update(self.get_activity_fields())
+
+    @classmethod
+    def get_activity_fields(cls):
+        """the model's serializable fields sorted by type, which are worked out
+        once for each model and shared by all of its instances"""
+        # looked up on the class itself, since subclasses have their own fields
+        activity_fields = cls.__dict__.get("_activity_fields")
+        if activity_fields is None:
+            activity_fields = cls.sort_activity_fields()
+            cls._activity_fields = activity_fields
+        return activity_fields
+
+    @classmethod
+    def sort_activity_fields(cls):
+        """sort model fields by type"""
+        image_fields = []
+        many_to_many_fields = []
+        simple_fields = []  # "simple"
+        for field in cls._meta.get_fields():
             if not hasattr(field, "field_to_activity"):
                 continue
 
             if isinstance(field, ImageField):
-                self.image_fields.append(field)
+                image_fields.append(field)
             elif isinstance(field, ManyToManyField):
-                self.many_to_many_fields.append(field)
+                many_to_many_fields.append(field)
             else:
-                self.simple_fields.append(field)
-
-        # a list of allll the serializable fields
-        self.activity_fields = (
-            self.image_fields + self.many_to_many_fields + self.simple_fields
-        )
-        if hasattr(self, "property_fields"):
-            self.activity_fields += [
-                # pylint: disable=cell-var-from-loop
-                PropertyField(lambda a, o: set_activity_from_property_field(a, o, f))
-                for f in self.property_fields
-            ]
-
-        # these are separate to avoid infinite recursion issues
-        self.deserialize_reverse_fields = (
-            self.deserialize_reverse_fields
-            if hasattr(self, "deserialize_reverse_fields")
-            else []
-        )
-        self.serialize_reverse_fields = (
-            self.serialize_reverse_fields
-            if hasattr(self, "serialize_reverse_fields")
-            else []
-        )
-
-        super().__init__(*args, **kwargs)
+                simple_fields.append(field)
+
+        return {
+            # these are shared, so they're tuples to keep them from being changed
+            "image_fields": tuple(image_fields),
+            "many_to_many_fields": tuple(many_to_many_fields),
+            "simple_fields": tuple(simple_fields),
+            # a list of allll the serializable fields
+            "activity_fields": tuple(
+                image_fields
+                + many_to_many_fields
+                + simple_fields
+                + [
+                    PropertyField(partial(set_activity_from_property_field, field=f))
+                    for f in getattr(cls, "property_fields", [])
+                ]
+            ),
+            # these are separate to avoid infinite recursion issues
+            "deserialize_reverse_fields": tuple(
+                getattr(cls, "deserialize_reverse_fields", [])
+            ),
+            "serialize_reverse_fields": tuple(
+                getattr(cls, "serialize_reverse_fields", [])
+            ),
+        }
 
     @classmethod
     def find_existing_by_remote_id(cls, remote_id):
@@ -126,6 +171,58 @@ class ActivitypubMixin:
         # there OUGHT to be only one match
         return match.first()
 
+    @classmethod
+    def find_existing_many(cls, datas):
+        """find_existing for a batch of activities, with one query for all of them
+        instead of one for each activity. Returns the matches by activity id;
+        activities with no match (or no id) are left out"""
+        fields = [
+            field
+            for field in cls._meta.get_fields()
+            if getattr(field, "deduplication_field", False)
+        ]
+        if hasattr(cls, "origin_id"):
+            # kinda janky, but this handles special case for books
+            fields.append(cls._meta.get_field("origin_id"))
+
+        # the activities looking for each value in each field
+        lookups = defaultdict(list)
+        for data in datas:
+            if not data.get("id"):
+                continue
+            for field_name, value in get_deduplication_values(data, fields).items():
+                lookups[(field_name, value)].append(data["id"])
+        if not lookups:
+            return {}
+
+        objects = cls.objects
+        if hasattr(objects, "select_subclasses"):
+            objects = objects.select_subclasses()
+
+        filters = defaultdict(set)
+        for field_name, value in lookups:
+            filters[field_name].add(value)
+        match = objects.filter(
+            reduce(
+                operator.or_,
+                (Q(**{f"{name}__in": values}) for name, values in filters.items()),
+            )
+        )
+        if not match.ordered:
+            # the same order as find_existing's .first()
+            match = match.order_by("pk")
+
+        # like find_existing, each activity gets the first object that matches
+        # any of its fields
+        results = {}
+        for obj in match:
+            for field_name in filters:
+                for activity_id in lookups.get(
+                    (field_name, getattr(obj, field_name)), []
+                ):
+                    results.setdefault(activity_id, obj)
+        return results
+
     def broadcast(self, activity, sender, software=None, queue=BROADCAST):
         """send out an activity"""
         broadcast_task.apply_async(
@@ -156,33 +253,13 @@ class ActivitypubMixin:
 
         # unless it's a dm, all the followers should receive the activity
         if privacy != "direct":
-            # we will send this out to a subset of all remote users
-            queryset = (
-                user_model.viewer_aware_objects(user)
-                .filter(
-                    local=False,
-                )
-                .distinct()
-            )
-            # filter users first by whether they're using the desired software
-            # this lets us send book updates only to other bw servers
-            if software:
-                queryset = queryset.filter(bookwyrm_user=(software == "bookwyrm"))
             # if there's a user, we only want to send to the user's followers
             if user:
-                queryset = queryset.filter(following=user)
-
-            # ideally, we will send to shared inboxes for efficiency
-            shared_inboxes = (
-                queryset.filter(shared_inbox__isnull=False)
-                .values_list("shared_inbox", flat=True)
-                .distinct()
-            )
-            # but not everyone has a shared inbox
-            inboxes = queryset.filter(shared_inbox__isnull=True).values_list(
-                "inbox", flat=True
-            )
-            recipients += list(shared_inboxes) + list(inboxes)
+                recipients += get_follower_inboxes(user, software=software)
+            else:
+                # we will send this out to a subset of all remote users
+                queryset = user_model.viewer_aware_objects(user)
+                recipients += get_inboxes(queryset, software=software)
         return list(set(recipients))
 
     def to_activity_dataclass(self):
@@ -506,75 +583,249 @@ def unfurl_related_field(related_field, sort_field=None):
     return related_field.remote_id
 
 
+def get_inboxes(queryset, software=None):
+    """the inboxes to send to for a set of remote users"""
+    queryset = queryset.filter(local=False).distinct()
+    # filter users first by whether they're using the desired software
+    # this lets us send book updates only to other bw servers
+    if software:
+        queryset = queryset.filter(bookwyrm_user=(software == "bookwyrm"))
+
+    # ideally, we will send to shared inboxes for efficiency
+    shared_inboxes = (
+        queryset.filter(shared_inbox__isnull=False)
+        .values_list("shared_inbox", flat=True)
+        .distinct()
+    )
+    # but not everyone has a shared inbox
+    inboxes = queryset.filter(shared_inbox__isnull=True).values_list("inbox", flat=True)
+    return list(shared_inboxes) + list(inboxes)
+
+
+def get_follower_inboxes(user, software=None):
+    """the inboxes of a user's remote followers, which are cached until the user's
+    followers (or blocks, or followers' inboxes) change"""
+    cache_key = get_follower_inboxes_cache_key(user.id, software)
+    inboxes = cache.get(cache_key)
+    if inboxes is None:
+        user_model = apps.get_model("bookwyrm.User", require_ready=True)
+        queryset = user_model.viewer_aware_objects(user).filter(following=user)
+        inboxes = get_inboxes(queryset, software=software)
+        cache.set(cache_key, inboxes, FOLLOWER_INBOXES_CACHE_TIMEOUT)
+    return inboxes
+
+
+def get_follower_inboxes_cache_key(user_id, software=None):
+    """the cache key for a user's follower inboxes"""
+    if software:
+        software = "bookwyrm" if software == "bookwyrm" else "other"
+    return f"follower-inboxes-{user_id}-{software}"
+
+
+def clear_follower_inboxes(user_ids):
+    """forget the cached follower inboxes for these users"""
+    cache.delete_many(
+        [
+            get_follower_inboxes_cache_key(user_id, software)
+            for user_id in user_ids
+            for software in [None, "bookwyrm", "other"]
+        ]
+    )
+
+
 @app.task(queue=BROADCAST)
-def broadcast_task(sender_id: int, activity: str, recipients: List[str]):
+def broadcast_task(
+    sender_id: int, activity: str, recipients: List[str], attempt: int = 1
+):
     """the celery task for broadcast"""
     user_model = apps.get_model("bookwyrm.User", require_ready=True)
     sender = user_model.objects.select_related("key_pair").get(id=sender_id)
-    asyncio.run(async_broadcast(recipients, sender, activity))
+
+    recipients = postpone_unavailable(sender_id, activity, recipients, attempt)
+    if not recipients:
+        return
+
+    results = asyncio.run(async_broadcast(recipients, sender, activity))
+    failed = record_broadcast_results(recipients, results)
+    retry_broadcast(sender_id, activity, failed, attempt)
+
+
+def postpone_unavailable(sender_id, activity, recipients, attempt):
+    """don't keep trying servers that have been failing, wait for them to come
+    back. Returns the recipients that can be delivered to now"""
+    server_model = apps.get_model("bookwyrm.FederatedServer", require_ready=True)
+    unavailable = server_model.get_unavailable_servers(
+        {get_host(r) for r in recipients}
+    )
+    for host, retry_date in unavailable.items():
+        retry_broadcast(
+            sender_id,
+            activity,
+            [r for r in recipients if get_host(r) == host],
+            attempt,
+            eta=retry_date,
+        )
+    return [r for r in recipients if get_host(r) not in unavailable]
+
+
+def record_broadcast_results(recipients, results):
+    """note which servers are up, and return the deliveries to try again"""
+    server_model = apps.get_model("bookwyrm.FederatedServer", require_ready=True)
+    failed = []
+    delivered_hosts = set()
+    failed_hosts = set()
+    for recipient, response in zip(recipients, results):
+        if should_retry(response):
+            failed.append(recipient)
+            failed_hosts.add(get_host(recipient))
+        else:
+            delivered_hosts.add(get_host(recipient))
+    # a server that got any of the deliveries is up
+    server_model.record_deliveries(delivered_hosts, failed_hosts - delivered_hosts)
+    return failed
+
+
+def retry_broadcast(sender_id, activity, recipients, attempt, eta=None):
+    """try the deliveries again later, backing off each time, until we give up"""
+    if not recipients:
+        return
+    if attempt >= DELIVERY_MAX_ATTEMPTS:
+        logger.info("Giving up on delivering to %s", ", ".join(recipients))
+        return
+    broadcast_task.apply_async(
+        args=(sender_id, activity, recipients),
+        kwargs={"attempt": attempt + 1},
+        countdown=None if eta else DELIVERY_RETRY_DELAY * 2 ** (attempt - 1),
+        eta=eta,
+    )
+
+
+def should_retry(response):
+    """the server couldn't be reached, or had a problem it might get over"""
+    return response is None or response.status >= 500 or response.status == 429
+
+
+def get_host(url):
+    """the server an inbox is on"""
+    return urlparse(url).netloc
+
+
+class DeliveryHost:
+    """the requests being sent to one server"""
+
+    def __init__(self):
+        self.semaphore = asyncio.Semaphore(DELIVERY_HOST_CONCURRENCY)
+        self.unreachable = False
+
+
+class BroadcastSignatures:
+    """the signed headers for one broadcast. Signing is slow, so deliveries to
+    the same inbox share a signature as long as its date is recent, and the
+    sender's parsed key is reused for every signature"""
+
+    def __init__(self, sender, data: str):
+        if not sender.key_pair.private_key:
+            # this shouldn't happen. it would be bad if it happened.
+            raise ValueError("No private key found for sender")
+        self.sender = sender
+        self.digest = make_digest(data)
+        self.date = None
+        self.dated = 0
+        self.signatures = {}
+
+    def get_headers(self, destination: str, use_legacy_key=False):
+        """the date, digest, and signature headers for a delivery"""
+        if self.date is None or time.monotonic() - self.dated > SIGNATURE_DATE_REFRESH:
+            # signatures are only accepted for a few minutes after their date
+            self.date = http_date()
+            self.dated = time.monotonic()
+            self.signatures = {}
+
+        parts = urlparse(destination)
+        key = (parts.netloc, parts.path, use_legacy_key)
+        if key not in self.signatures:
+            self.signatures[key] = make_signature(
+                "post",
+                self.sender,
+                destination,
+                self.date,
+                digest=self.digest,
+                use_legacy_key=use_legacy_key,
+            )
+        return {
+            "Date": self.date,
+            "Digest": self.digest,
+            "Signature": self.signatures[key],
+        }
 
 
 async def async_broadcast(recipients: List[str], sender, data: str):
-    """Send all the broadcasts simultaneously"""
+    """Send all the broadcasts simultaneously, a few at a time to each server"""
+    signatures = BroadcastSignatures(sender, data)
     timeout = aiohttp.ClientTimeout(total=10)
-    async with aiohttp.ClientSession(timeout=timeout) as session:
+    hosts = {}
+    async with http_client.async_session(timeout=timeout) as session:
         tasks = []
         for recipient in recipients:
+            host = hosts.setdefault(get_host(recipient), DeliveryHost())
             tasks.append(
-                asyncio.ensure_future(sign_and_send(session, sender, data, recipient))
+                asyncio.ensure_future(
+                    deliver(session, host, data, recipient, signatures)
+                )
             )
 
         results = await asyncio.gather(*tasks)
         return results
 
 
+async def deliver(session, host, data: str, destination: str, signatures):
+    """send to an inbox, unless its server has already failed to respond"""
+    async with host.semaphore:
+        if host.unreachable:
+            return None
+        response = await sign_and_send(session, signatures, data, destination)
+        if response is None:
+            # no need to wait out the timeout for every inbox on the server
+            host.unreachable = True
+        return response
+
+
 async def sign_and_send(
-    session: aiohttp.ClientSession, sender, data: str, destination: str, **kwargs
+    session: aiohttp.ClientSession,
+    signatures: BroadcastSignatures,
+    data: str,
+    destination: str,
+    **kwargs,
 ):
     """Sign the messages and send them in an asynchronous bundle"""
-    now = http_date()
-
-    if not sender.key_pair.private_key:
-        # this shouldn't happen. it would be bad if it happened.
-        raise ValueError("No private key found for sender")
-
-    digest = make_digest(data)
-    signature = make_signature(
-        "post",
-        sender,
-        destination,
-        now,
-        digest=digest,
-        use_legacy_key=kwargs.get("use_legacy_key"),
-    )
-
     headers = {
-        "Date": now,
-        "Digest": digest,
-        "Signature": signature,
+        **signatures.get_headers(
+            destination, use_legacy_key=kwargs.get("use_legacy_key", False)
+        ),
         "Content-Type": "application/activity+json; charset=utf-8",
         "User-Agent": USER_AGENT,
     }
 
     try:
         async with session.post(destination, data=data, headers=headers) as response:
-            if not response.ok:
-                logger.exception(
-                    "Failed to send broadcast to %s: %s", destination, response.reason
-                )
-                if kwargs.get("use_legacy_key") is not True:
-                    logger.info("Trying again with legacy keyId header value")
-                    asyncio.ensure_future(
-                        sign_and_send(
-                            session, sender, data, destination, use_legacy_key=True
-                        )
-                    )
-
-            return response
+            if response.ok:
+                return response
+            logger.exception(
+                "Failed to send broadcast to %s: %s", destination, response.reason
+            )
     except asyncio.TimeoutError:
         logger.info("Connection timed out for url: %s", destination)
+        return None
     except aiohttp.ClientError as err:
         logger.exception(err)
+        return None
+
+    if kwargs.get("use_legacy_key") is True:
+        return response
+    logger.info("Trying again with legacy keyId header value")
+    return await sign_and_send(
+        session, signatures, data, destination, use_legacy_key=True
+    )
 
 
 # pylint: disable=unused-argument
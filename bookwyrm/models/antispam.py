@@ -5,9 +5,11 @@ import operator
 from django.apps import apps
 from django.core.exceptions import PermissionDenied
 from django.db import models, transaction
-from django.db.models import Q
+from django.db.models import Q, signals
+from django.dispatch import receiver
 from django.utils.translation import gettext_lazy as _
 
+from bookwyrm.blocklist import bump_version
 from bookwyrm.tasks import app, MISC
 from .base_model import BookWyrmModel
 from .user import User
@@ -56,6 +58,15 @@ class IPBlocklist(AdminModel):
         ordering = ("-created_date",)
 
 
+@receiver(signals.post_save, sender=IPBlocklist)
+@receiver(signals.post_delete, sender=IPBlocklist)
+# pylint: disable=unused-argument
+def update_blocklist(sender, instance, *args, **kwargs):
+    """the blocked ip addresses have changed"""
+    # other processes reload the blocklist once the change is saved
+    transaction.on_commit(bump_version)
+
+
 class AutoMod(AdminModel):
     """rules to automatically flag suspicious activity"""
 
@@ -1,12 +1,22 @@
 """ connections to external ActivityPub servers """
-from urllib.parse import urlparse
+from datetime import timedelta
 
 from django.apps import apps
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, signals
+from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from bookwyrm.settings import DELIVERY_FAILURE_THRESHOLD, DELIVERY_RETRY_DELAY
+from bookwyrm.blocklist import blocklist, bump_version
+from bookwyrm.connectors import connector_manager
+from .activitypub_mixin import clear_follower_inboxes
 from .base_model import BookWyrmModel
 
+# the longest a server that keeps failing will go without deliveries
+MAX_DELIVERY_BACKOFF = timedelta(days=1)
+
 FederationStatus = [
     ("federated", _("Federated")),
     ("blocked", _("Blocked")),
@@ -24,6 +34,9 @@ class FederatedServer(BookWyrmModel):
     application_type = models.CharField(max_length=255, null=True, blank=True)
     application_version = models.CharField(max_length=255, null=True, blank=True)
     notes = models.TextField(null=True, blank=True)
+    # consecutive broadcasts that couldn't be delivered, and when to try again
+    delivery_failures = models.IntegerField(default=0)
+    delivery_retry_date = models.DateTimeField(null=True, blank=True)
 
     def block(self):
         """block a server"""
@@ -34,13 +47,16 @@ class FederatedServer(BookWyrmModel):
         self.user_set.filter(is_active=True).update(
             is_active=False, deactivation_reason="domain_block"
         )
+        self.clear_follower_inboxes()
 
         # check for related connectors
         if self.application_type == "bookwyrm":
             connector_model = apps.get_model("bookwyrm.Connector", require_ready=True)
-            connector_model.objects.filter(
+            if connector_model.objects.filter(
                 identifier=self.server_name, active=True
-            ).update(active=False, deactivation_reason="domain_block")
+            ).update(active=False, deactivation_reason="domain_block"):
+                # update() doesn't send post_save, which reloads the connectors
+                connector_manager.reload_connectors()
 
     def unblock(self):
         """unblock a server"""
@@ -50,19 +66,72 @@ class FederatedServer(BookWyrmModel):
         self.user_set.filter(deactivation_reason="domain_block").update(
             is_active=True, deactivation_reason=None
         )
+        self.clear_follower_inboxes()
 
         # check for related connectors
         if self.application_type == "bookwyrm":
             connector_model = apps.get_model("bookwyrm.Connector", require_ready=True)
-            connector_model.objects.filter(
+            if connector_model.objects.filter(
                 identifier=self.server_name,
                 active=False,
                 deactivation_reason="domain_block",
-            ).update(active=True, deactivation_reason=None)
+            ).update(active=True, deactivation_reason=None):
+                connector_manager.reload_connectors()
+
+    def clear_follower_inboxes(self):
+        """this server's users may now be in or out of local users' followers"""
+        user_model = apps.get_model("bookwyrm.User", require_ready=True)
+        clear_follower_inboxes(
+            user_model.objects.filter(
+                local=True, followers__federated_server=self
+            ).values_list("id", flat=True)
+        )
 
     @classmethod
     def is_blocked(cls, url):
         """look up if a domain is blocked"""
-        url = urlparse(url)
-        domain = url.netloc
-        return cls.objects.filter(server_name=domain, status="blocked").exists()
+        return blocklist.is_domain_blocked(url)
+
+    @classmethod
+    def get_unavailable_servers(cls, server_names):
+        """which of these servers deliveries are being held back from, and until
+        when"""
+        return dict(
+            cls.objects.filter(
+                server_name__in=server_names, delivery_retry_date__gt=timezone.now()
+            ).values_list("server_name", "delivery_retry_date")
+        )
+
+    @classmethod
+    def record_deliveries(cls, succeeded, failed):
+        """keep track of which servers are unreachable, backing off from servers
+        that have failed too many times in a row"""
+        cls.objects.filter(server_name__in=succeeded).exclude(
+            delivery_failures=0, delivery_retry_date__isnull=True
+        ).update(delivery_failures=0, delivery_retry_date=None)
+
+        cls.objects.filter(server_name__in=failed).update(
+            delivery_failures=F("delivery_failures") + 1
+        )
+        for server in cls.objects.filter(
+            server_name__in=failed, delivery_failures__gte=DELIVERY_FAILURE_THRESHOLD
+        ):
+            server.delivery_retry_date = timezone.now() + server.get_delivery_backoff()
+            server.save(update_fields=["delivery_retry_date"])
+
+    def get_delivery_backoff(self):
+        """how long to hold off on deliveries, doubling with each failure"""
+        exponent = max(self.delivery_failures - DELIVERY_FAILURE_THRESHOLD, 0)
+        # cap the exponent so this doesn't overflow timedelta
+        backoff = timedelta(seconds=DELIVERY_RETRY_DELAY * 2 ** min(exponent, 20))
+        return min(backoff, MAX_DELIVERY_BACKOFF)
+
+
+@receiver(signals.post_save, sender=FederatedServer)
+@receiver(signals.post_delete, sender=FederatedServer)
+# pylint: disable=unused-argument
+def update_blocklist(sender, instance, *args, update_fields=None, **kwargs):
+    """a server may have been blocked or unblocked"""
+    if update_fields is None or "status" in update_fields:
+        # other processes reload the blocklist once the change is saved
+        transaction.on_commit(bump_version)
@@ -339,20 +339,32 @@ class ManyToManyField(ActivitypubFieldMixin, models.ManyToManyField):
         if not isinstance(value, list):
             # If this is a link, we currently aren't doing anything with it
             return None
-        items = []
+        remote_ids = []
         for remote_id in value:
             try:
                 validate_remote_id(remote_id)
             except ValidationError:
                 continue
-            items.append(
-                activitypub.resolve_remote_id(
-                    remote_id,
-                    model=self.related_model,
-                    allow_external_connections=allow_external_connections,
-                )
+            remote_ids.append(remote_id)
+        return self.resolve_remote_ids(
+            remote_ids, allow_external_connections=allow_external_connections
+        )
+
+    def resolve_remote_ids(self, remote_ids, allow_external_connections=True):
+        """look up the related objects, with one query for the ones that are
+        already in the database"""
+        existing = self.related_model.find_existing_many(
+            [{"id": remote_id} for remote_id in remote_ids]
+        )
+        return [
+            existing.get(remote_id)
+            or activitypub.resolve_remote_id(
+                remote_id,
+                model=self.related_model,
+                allow_external_connections=allow_external_connections,
             )
-        return items
+            for remote_id in remote_ids
+        ]
 
 
 class TagField(ManyToManyField):
@@ -386,6 +398,7 @@ class TagField(ManyToManyField):
             else:
                 return None
         items = []
+        remote_ids = []
         for link_json in value:
             link = activitypub.Link(**link_json)
             tag_type = link.type if link.type != "Mention" else "Person"
@@ -403,14 +416,15 @@ class TagField(ManyToManyField):
                 items.append(hashtag)
             else:
                 # for other tag types we fetch them remotely
-                items.append(
-                    activitypub.resolve_remote_id(
-                        link.href,
-                        model=self.related_model,
-                        allow_external_connections=allow_external_connections,
-                    )
-                )
-        return items
+                items.append(link.href)
+                remote_ids.append(link.href)
+        resolved = iter(
+            self.resolve_remote_ids(
+                remote_ids, allow_external_connections=allow_external_connections
+            )
+        )
+        # keep the tags in the order they are in the activity
+        return [next(resolved) if isinstance(i, str) else i for i in items]
 
 
 class ClearableFileInputWithWarning(ClearableFileInput):
@@ -1,11 +1,12 @@
 """ defines relationships between users """
 from django.core.cache import cache
 from django.db import models, transaction, IntegrityError
-from django.db.models import Q
+from django.db.models import Q, signals
+from django.dispatch import receiver
 
 from bookwyrm import activitypub
 from .activitypub_mixin import ActivitypubMixin, ActivityMixin
-from .activitypub_mixin import generate_activity
+from .activitypub_mixin import clear_follower_inboxes, generate_activity
 from .base_model import BookWyrmModel
 from . import fields
 
@@ -219,3 +220,27 @@ def clear_cache(user_subject, user_object):
             f"cached-relationship-{user_object.id}-{user_subject.id}",
         ]
     )
+
+
+@receiver(signals.post_save, sender=UserFollows)
+@receiver(signals.post_delete, sender=UserFollows)
+@receiver(signals.post_save, sender=UserBlocks)
+@receiver(signals.post_delete, sender=UserBlocks)
+# pylint: disable=unused-argument
+def clear_follower_inboxes_on_change(sender, instance, *args, **kwargs):
+    """the users' followers may have changed"""
+    clear_follower_inboxes([instance.user_subject_id, instance.user_object_id])
+
+
+@receiver(signals.m2m_changed, sender=UserFollows)
+@receiver(signals.m2m_changed, sender=UserBlocks)
+# pylint: disable=unused-argument
+def clear_follower_inboxes_on_m2m_change(sender, instance, action, pk_set, **kwargs):
+    """users were added to or removed from followers or blocks directly"""
+    if action in ["post_add", "post_remove"]:
+        clear_follower_inboxes([instance.id, *pk_set])
+    elif action == "pre_clear":
+        relationships = sender.objects.filter(
+            Q(user_subject=instance) | Q(user_object=instance)
+        ).values_list("user_subject", "user_object")
+        clear_follower_inboxes({i for pair in relationships for i in pair})
@@ -454,16 +454,23 @@ class Boost(ActivityMixin, Status):
 
         super().save(*args, **kwargs)
 
-    def __init__(self, *args, **kwargs):
+    @classmethod
+    def sort_activity_fields(cls):
         """the user field is "actor" here instead of "attributedTo" """
-        super().__init__(*args, **kwargs)
+        activity_fields = super().sort_activity_fields()
 
         reserve_fields = ["user", "boosted_status", "published_date", "privacy"]
-        self.simple_fields = [f for f in self.simple_fields if f.name in reserve_fields]
-        self.activity_fields = self.simple_fields
-        self.many_to_many_fields = []
-        self.image_fields = []
-        self.deserialize_reverse_fields = []
+        simple_fields = tuple(
+            f for f in activity_fields["simple_fields"] if f.name in reserve_fields
+        )
+        return {
+            **activity_fields,
+            "simple_fields": simple_fields,
+            "activity_fields": simple_fields,
+            "many_to_many_fields": (),
+            "image_fields": (),
+            "deserialize_reverse_fields": (),
+        }
 
 
 # pylint: disable=unused-argument
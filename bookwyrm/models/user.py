@@ -1,7 +1,10 @@
 """ database schema for user data """
+import asyncio
+import logging
 import re
-from urllib.parse import urlparse
+from urllib.parse import parse_qs, urlparse
 
+import aiohttp
 from django.apps import apps
 from django.contrib.auth.models import AbstractUser
 from django.contrib.postgres.fields import ArrayField, CICharField
@@ -13,20 +16,34 @@ from django.utils.translation import gettext_lazy as _
 from model_utils import FieldTracker
 import pytz
 
-from bookwyrm import activitypub
+from bookwyrm import activitypub, http_client
 from bookwyrm.connectors import get_data, ConnectorException
 from bookwyrm.models.shelf import Shelf
-from bookwyrm.models.status import Status
+from bookwyrm.models.status import Review, Status
 from bookwyrm.preview_images import generate_user_preview_image_task
-from bookwyrm.settings import DOMAIN, ENABLE_PREVIEW_IMAGES, USE_HTTPS, LANGUAGES
+from bookwyrm.settings import (
+    DOMAIN,
+    ENABLE_PREVIEW_IMAGES,
+    USE_HTTPS,
+    LANGUAGES,
+    OUTBOX_BACKFILL_PAGES,
+    OUTBOX_BACKFILL_CONCURRENCY,
+    QUERY_TIMEOUT,
+    USER_AGENT,
+)
 from bookwyrm.signatures import create_key_pair
 from bookwyrm.tasks import app, MISC
 from bookwyrm.utils import regex
 from .activitypub_mixin import OrderedCollectionPageMixin, ActivitypubMixin
+from .activitypub_mixin import clear_follower_inboxes
 from .base_model import BookWyrmModel, DeactivationReason, new_access_code
 from .federated_server import FederatedServer
 from . import fields
 
+logger = logging.getLogger(__name__)
+
+# how many of a remote user's reviews are saved in each task
+REVIEWS_PER_BATCH = 50
 
 FeedFilterChoices = [
     ("review", _("Reviews")),
@@ -334,6 +351,15 @@ class User(OrderedCollectionPageMixin, AbstractUser):
                 self.deactivation_date = timezone.now()
 
             super().save(*args, **kwargs)
+            update_fields = kwargs.get("update_fields")
+            if not self.local and (
+                update_fields is None
+                or set(update_fields) & {"inbox", "shared_inbox", "is_active"}
+            ):
+                # the inboxes of the users this user follows may have changed
+                clear_follower_inboxes(
+                    self.following.filter(local=True).values_list("id", flat=True)
+                )
             return
 
         # this is a new remote user, we need to set their remote server field
@@ -533,14 +559,95 @@ def get_or_create_remote_server(
 @app.task(queue=MISC)
 def get_remote_reviews(outbox):
     """ingest reviews by a new remote bookwyrm user"""
-    outbox_page = outbox + "?page=true&type=Review"
-    data = get_data(outbox_page)
-
-    # TODO: pagination?
-    for activity in data["orderedItems"]:
-        if not activity["type"] == "Review":
-            continue
-        activitypub.Review(**activity).to_model()
+    reviews = get_outbox_reviews(outbox)
+
+    # there's no need to load reviews we already have
+    existing = Review.find_existing_many(reviews)
+    reviews = [activity for activity in reviews if activity["id"] not in existing]
+    for i in range(0, len(reviews), REVIEWS_PER_BATCH):
+        save_remote_reviews.delay(reviews[i : i + REVIEWS_PER_BATCH])
+
+
+@app.task(queue=MISC)
+def save_remote_reviews(reviews):
+    """save a batch of reviews from a remote user's outbox"""
+    for activity in reviews:
+        try:
+            # a review that can't be saved doesn't undo the others
+            with transaction.atomic():
+                activitypub.Review(**activity).to_model()
+        except (activitypub.ActivitySerializerError, ConnectorException) as err:
+            logger.info("Unable to save review %s: %s", activity.get("id"), err)
+
+
+def get_outbox_reviews(outbox):
+    """the reviews in the first few pages of a remote outbox"""
+    collection = get_data(f"{outbox}?type=Review")
+
+    # the pages are numbered, so they can be loaded all at once
+    page_count = get_page_number(collection.get("last"))
+    if page_count:
+        urls = [
+            f"{outbox}?page={page}&type=Review"
+            for page in range(1, min(page_count, OUTBOX_BACKFILL_PAGES) + 1)
+        ]
+        pages = asyncio.run(get_outbox_pages(urls))
+    else:
+        pages = []
+        page = collection.get("first")
+        while page and len(pages) < OUTBOX_BACKFILL_PAGES:
+            if isinstance(page, str):
+                try:
+                    page = get_data(page)
+                except ConnectorException:
+                    break
+            pages.append(page)
+            page = page.get("next")
+
+    return [
+        activity
+        for page in pages
+        for activity in page.get("orderedItems", [])
+        if isinstance(activity, dict) and activity.get("type") == "Review"
+    ]
+
+
+def get_page_number(url):
+    """the page number in an outbox page url"""
+    if not isinstance(url, str):
+        return None
+    try:
+        return int(parse_qs(urlparse(url).query)["page"][0])
+    except (KeyError, ValueError):
+        return None
+
+
+async def get_outbox_pages(urls):
+    """load outbox pages from one server, a few at a time"""
+    timeout = aiohttp.ClientTimeout(total=QUERY_TIMEOUT)
+    headers = {
+        "Accept": "application/activity+json",
+        "User-Agent": USER_AGENT,
+    }
+    async with http_client.async_session(
+        headers=headers,
+        timeout=timeout,
+        limit_per_host=OUTBOX_BACKFILL_CONCURRENCY,
+    ) as session:
+        return await asyncio.gather(*[get_outbox_page(session, url) for url in urls])
+
+
+async def get_outbox_page(session, url):
+    """load one outbox page, or an empty page if that doesn't work"""
+    try:
+        async with session.get(url) as response:
+            if not response.ok:
+                logger.info("Unable to load %s: %s", url, response.status)
+                return {}
+            return await response.json(content_type=None)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as err:
+        logger.info("Unable to load %s: %s", url, err)
+        return {}
 
 
 # pylint: disable=unused-argument
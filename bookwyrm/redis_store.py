@@ -6,27 +6,63 @@ from bookwyrm import settings
 
 r = redis.from_url(settings.REDIS_ACTIVITY_URL)
 
+# how many objects are loaded from the database at a time when populating a store
+POPULATE_BATCH_SIZE = 500
+
 
 class RedisStore(ABC):
     """sets of ranked, related objects, like statuses for a user's feed"""
 
     max_length = settings.MAX_STREAM_LENGTH
 
+    # secondary stores kept alongside each store, each holding a subset of it
+    index_keys = []
+
     def get_value(self, obj):
         """the object and rank"""
         return {obj.id: self.get_rank(obj)}
 
-    def add_object_to_stores(self, obj, stores, execute=True):
-        """add an object to a given set of stores"""
+    def get_index_keys(self, objs):  # pylint: disable=no-self-use
+        """which of the secondary stores each of a batch of objects also belongs
+        in, by id, or None if there aren't any secondary stores"""
+        return dict.fromkeys(obj.id for obj in objs)
+
+    def index_complete_id(self, store):  # pylint: disable=no-self-use
+        """the redis key marking that every object in a store is also in its
+        secondary stores, which is true once it's been populated"""
+        return f"{store}-indexed"
+
+    def index_store_id(self, store, index_key):  # pylint: disable=no-self-use
+        """the redis key for one of the secondary stores of a store"""
+        return f"{store}-{index_key}"
+
+    def get_indexed_stores(self, store, index_key=None):
+        """a store, and the secondary store an object belongs in (if any)"""
+        if index_key is None:
+            return [store]
+        return [store, self.index_store_id(store, index_key)]
+
+    def get_all_indexed_stores(self, store):
+        """a store and all of its secondary stores"""
+        return [store] + [self.index_store_id(store, k) for k in self.index_keys]
+
+    # pylint: disable=too-many-arguments
+    def add_object_to_stores(
+        self, obj, stores, execute=True, pipeline=None, index_keys=None
+    ):
+        """add an object to a given set of stores, using the secondary stores from
+        get_index_keys if they've already been worked out"""
         value = self.get_value(obj)
+        index_key = (index_keys or self.get_index_keys([obj]))[obj.id]
         # we want to do this as a bulk operation, hence "pipeline"
-        pipeline = r.pipeline()
+        pipeline = pipeline or r.pipeline()
         for store in stores:
-            # add the status to the feed
-            pipeline.zadd(store, value)
-            # trim the store
-            if self.max_length:
-                pipeline.zremrangebyrank(store, 0, -1 * self.max_length)
+            for indexed_store in self.get_indexed_stores(store, index_key):
+                # add the status to the feed
+                pipeline.zadd(indexed_store, value)
+                # trim the store
+                if self.max_length:
+                    pipeline.zremrangebyrank(indexed_store, 0, -1 * self.max_length)
         if not execute:
             return pipeline
         # and go!
@@ -42,41 +78,83 @@ class RedisStore(ABC):
             obj_id = obj.id
         pipeline = r.pipeline()
         for store in stores:
-            pipeline.zrem(store, -1, obj_id)
+            for indexed_store in self.get_all_indexed_stores(store):
+                pipeline.zrem(indexed_store, -1, obj_id)
         pipeline.execute()
 
     def bulk_add_objects_to_store(self, objs, store):
         """add a list of objects to a given store"""
         pipeline = r.pipeline()
-        for obj in objs[: self.max_length]:
-            pipeline.zadd(store, self.get_value(obj))
+        objs = objs[: self.max_length]
+        self.add_objects_to_pipeline(pipeline, objs, store)
         if objs and self.max_length:
-            pipeline.zremrangebyrank(store, 0, -1 * self.max_length)
+            for indexed_store in self.get_all_indexed_stores(store):
+                pipeline.zremrangebyrank(indexed_store, 0, -1 * self.max_length)
         pipeline.execute()
 
+    def add_objects_to_pipeline(self, pipeline, objs, store):
+        """add a batch of objects to a store and its secondary stores"""
+        index_keys = self.get_index_keys(objs)
+        for obj in objs:
+            value = self.get_value(obj)
+            for indexed_store in self.get_indexed_stores(store, index_keys[obj.id]):
+                pipeline.zadd(indexed_store, value)
+
     def bulk_remove_objects_from_store(self, objs, store):
         """remove a list of objects from a given store"""
         pipeline = r.pipeline()
+        stores = self.get_all_indexed_stores(store)
         for obj in objs[: self.max_length]:
-            pipeline.zrem(store, -1, obj.id)
+            for indexed_store in stores:
+                pipeline.zrem(indexed_store, -1, obj.id)
         pipeline.execute()
 
     def get_store(self, store, **kwargs):  # pylint: disable=no-self-use
         """load the values in a store"""
         return r.zrevrange(store, 0, -1, **kwargs)
 
-    def populate_store(self, store):
-        """go from zero to a store"""
-        pipeline = r.pipeline()
+    def get_store_page(
+        self, store, max_score=None, offset=0, count=None
+    ):  # pylint: disable=no-self-use
+        """load values and their ranks in a store, highest first, starting at the
+        given offset among the values ranked max_score or lower"""
+        max_score = "+inf" if max_score is None else repr(max_score)
+        return r.zrevrangebyscore(
+            store,
+            max_score,
+            "-inf",
+            start=offset,
+            num=-1 if count is None else count,
+            withscores=True,
+        )
+
+    def populate_store(self, store, pipeline=None):
+        """go from zero to a store, returning how many objects were added"""
+        execute = pipeline is None
+        pipeline = pipeline or r.pipeline()
         queryset = self.get_objects_for_store(store)
 
-        for obj in queryset[: self.max_length]:
-            pipeline.zadd(store, self.get_value(obj))
+        count = 0
+        # stream the objects from the database rather than loading them all
+        batch = []
+        for obj in queryset[: self.max_length].iterator():
+            batch.append(obj)
+            if len(batch) == POPULATE_BATCH_SIZE:
+                self.add_objects_to_pipeline(pipeline, batch, store)
+                count += len(batch)
+                batch = []
+        self.add_objects_to_pipeline(pipeline, batch, store)
+        count += len(batch)
 
         # only trim the store if objects were added
-        if queryset.exists() and self.max_length:
-            pipeline.zremrangebyrank(store, 0, -1 * self.max_length)
-        pipeline.execute()
+        if count and self.max_length:
+            for indexed_store in self.get_all_indexed_stores(store):
+                pipeline.zremrangebyrank(indexed_store, 0, -1 * self.max_length)
+        if self.index_keys:
+            pipeline.set(self.index_complete_id(store), 1)
+        if execute:
+            pipeline.execute()
+        return count
 
     @abstractmethod
     def get_objects_for_store(self, store):
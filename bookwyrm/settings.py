@@ -216,6 +216,10 @@ REDIS_ACTIVITY_URL = env(
     f"redis://:{REDIS_ACTIVITY_PASSWORD}@{REDIS_ACTIVITY_HOST}:{REDIS_ACTIVITY_PORT}/{REDIS_ACTIVITY_DB_INDEX}",
 )
 MAX_STREAM_LENGTH = env.int("MAX_STREAM_LENGTH", 200)
+# Add new statuses to streams in batches of up to this many (0 means no batching),
+# waiting at most STREAM_BATCH_WINDOW seconds for a batch to fill up
+STREAM_BATCH_SIZE = env.int("STREAM_BATCH_SIZE", 0)
+STREAM_BATCH_WINDOW = env.int("STREAM_BATCH_WINDOW", 2)
 
 STREAMS = [
     {"key": "home", "name": _("Home Timeline"), "shortname": _("Home")},
@@ -227,6 +231,12 @@ STREAMS = [
 SEARCH_TIMEOUT = env.int("SEARCH_TIMEOUT", 8)
 # timeout for a query to an individual connector
 QUERY_TIMEOUT = env.int("INTERACTIVE_QUERY_TIMEOUT", env.int("QUERY_TIMEOUT", 5))
+# connectors' search results are re-used for this many seconds, and after that
+# are shown while they're updated in the background, until SEARCH_CACHE_TIMEOUT
+SEARCH_CACHE_FRESH = env.int("SEARCH_CACHE_FRESH", 60 * 60)
+SEARCH_CACHE_TIMEOUT = env.int("SEARCH_CACHE_TIMEOUT", 60 * 60 * 24)
+# how many searches to keep results for, dropping the least recently used
+SEARCH_CACHE_MAX_ENTRIES = env.int("SEARCH_CACHE_MAX_ENTRIES", 10000)
 
 # Redis cache backend
 if env.bool("USE_DUMMY_CACHE", False):
@@ -328,6 +338,37 @@ USE_TZ = True
 agent = requests.utils.default_user_agent()
 USER_AGENT = f"{agent} (BookWyrm/{VERSION}; +https://{DOMAIN}/)"
 
+# How many requests to send to one server at a time
+DELIVERY_HOST_CONCURRENCY = env.int("DELIVERY_HOST_CONCURRENCY", 5)
+# Failed deliveries are retried after DELIVERY_RETRY_DELAY seconds, doubling each
+# time, up to DELIVERY_MAX_ATTEMPTS tries
+DELIVERY_MAX_ATTEMPTS = env.int("DELIVERY_MAX_ATTEMPTS", 5)
+DELIVERY_RETRY_DELAY = env.int("DELIVERY_RETRY_DELAY", 60)
+# Stop delivering to a server for a while after this many failures in a row
+DELIVERY_FAILURE_THRESHOLD = env.int("DELIVERY_FAILURE_THRESHOLD", 5)
+# Verify incoming activities in the inbox_ingest queue instead of in the web
+# request, asking senders to retry later once INBOX_INGEST_LIMIT activities are
+# waiting, or a server has sent INBOX_INGEST_HOST_LIMIT in the last minute
+INBOX_INGEST = env.bool("INBOX_INGEST", False)
+INBOX_INGEST_LIMIT = env.int("INBOX_INGEST_LIMIT", 10000)
+INBOX_INGEST_HOST_LIMIT = env.int("INBOX_INGEST_HOST_LIMIT", 500)
+# Skip activities that arrive again within this many seconds (0 to disable)
+INBOX_DUPLICATE_WINDOW = env.int("INBOX_DUPLICATE_WINDOW", 60 * 60)
+# How many pages of reviews to load from a new remote BookWyrm user's outbox, and
+# how many to request at a time
+OUTBOX_BACKFILL_PAGES = env.int("OUTBOX_BACKFILL_PAGES", 10)
+OUTBOX_BACKFILL_CONCURRENCY = env.int("OUTBOX_BACKFILL_CONCURRENCY", 3)
+# Connections to other servers are kept open for reuse, for up to HTTP_POOL_HOSTS
+# servers at a time in each process
+HTTP_POOL_HOSTS = env.int("HTTP_POOL_HOSTS", 50)
+HTTP_POOL_CONNECTIONS_PER_HOST = env.int("HTTP_POOL_CONNECTIONS_PER_HOST", 10)
+HTTP_DNS_CACHE_TIMEOUT = env.int("HTTP_DNS_CACHE_TIMEOUT", 300)
+# Remote data with an ETag or Last-Modified header is cached, and only downloaded
+# again if it's changed; responses up to HTTP_CACHE_MAX_SIZE bytes each, and
+# HTTP_CACHE_MAX_BYTES altogether
+HTTP_CACHE_MAX_BYTES = env.int("HTTP_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+HTTP_CACHE_MAX_SIZE = env.int("HTTP_CACHE_MAX_SIZE", 512 * 1024)
+
 # Imagekit generated thumbnails
 ENABLE_THUMBNAIL_GENERATION = env.bool("ENABLE_THUMBNAIL_GENERATION", False)
 IMAGEKIT_CACHEFILE_DIR = "thumbnails"
@@ -1,4 +1,5 @@
 """ signs activitypub activities """
+from collections import OrderedDict
 import hashlib
 from urllib.parse import urlparse
 import datetime
@@ -10,6 +11,8 @@ from Crypto.Signature import pkcs1_15  # pylint: disable=no-name-in-module
 from Crypto.Hash import SHA256
 
 MAX_SIGNATURE_AGE = 300
+# how many parsed keys to hold on to in each process
+KEY_CACHE_SIZE = 1024
 
 
 def create_key_pair():
@@ -22,6 +25,37 @@ def create_key_pair():
     return private_key, public_key
 
 
+class SignerCache:
+    """a bounded, least recently used cache of signers for parsed rsa keys"""
+
+    def __init__(self, max_size=KEY_CACHE_SIZE):
+        self.max_size = max_size
+        self.signers = OrderedDict()
+
+    def get_signer(self, key_id, key):
+        """a signer for a pem encoded key, which is only parsed the first time it's
+        seen; the key's fingerprint is part of the cache key so rotated keys miss"""
+        cache_key = (key_id, hashlib.sha256(key.encode("utf8")).hexdigest())
+        signer = self.signers.get(cache_key)
+        if signer is not None:
+            self.signers.move_to_end(cache_key)
+            return signer
+
+        signer = pkcs1_15.new(RSA.import_key(key))
+        self.signers[cache_key] = signer
+        if len(self.signers) > self.max_size:
+            self.signers.popitem(last=False)
+        return signer
+
+    def clear(self):
+        """forget all the parsed keys"""
+        self.signers.clear()
+
+
+private_signers = SignerCache()
+public_signers = SignerCache()
+
+
 def make_signature(method, sender, destination, date, **kwargs):
     """uses a private key to sign an outgoing message"""
     inbox_parts = urlparse(destination)
@@ -37,7 +71,7 @@ def make_signature(method, sender, destination, date, **kwargs):
         headers = "(request-target) host date digest"
 
     message_to_sign = "\n".join(signature_headers)
-    signer = pkcs1_15.new(RSA.import_key(sender.key_pair.private_key))
+    signer = private_signers.get_signer(sender.key_pair.id, sender.key_pair.private_key)
     signed_message = signer.sign(SHA256.new(message_to_sign.encode("utf8")))
     # For legacy reasons we need to use an incorrect keyId for older Bookwyrm versions
     key_id = (
@@ -103,11 +137,10 @@ class Signature:
 
         return cls(key_id, headers, signature)
 
-    def verify(self, public_key, request):
+    def verify(self, public_key, request, check_age=True):
         """verify rsa signature"""
-        if http_date_age(request.headers["date"]) > MAX_SIGNATURE_AGE:
+        if check_age and http_date_age(request.headers["date"]) > MAX_SIGNATURE_AGE:
             raise ValueError(f"Request too old: {request.headers['date']}")
-        public_key = RSA.import_key(public_key)
 
         comparison_string = []
         for signed_header_name in self.headers.split(" "):
@@ -121,7 +154,7 @@ class Signature:
                 )
         comparison_string = "\n".join(comparison_string)
 
-        signer = pkcs1_15.new(public_key)
+        signer = public_signers.get_signer(self.key_id, public_key)
         digest = SHA256.new()
         digest.update(comparison_string.encode())
 
@@ -0,0 +1,146 @@
+""" statuses stored in the django cache, ready to display in feeds """
+from django.apps import apps
+from django.core.cache import cache
+from django.dispatch import receiver
+from django.db.models import signals
+from django.db.models.fields.files import FieldFile
+
+from bookwyrm import models
+
+# statuses are cleared from the cache when they change, but the users and books
+# cached along with them aren't
+STATUS_CACHE_TIMEOUT = 60 * 15
+
+# the fields of related objects that are needed to display a status. Only these
+# are cached, so that nothing private (like a user's email address) is shared
+# with every feed; any others are loaded from the database if they're used
+STATUS_CACHE_RELATED = {
+    "user": [
+        "id",
+        "remote_id",
+        "username",
+        "localname",
+        "name",
+        "avatar",
+        "local",
+        "is_active",
+    ],
+    "reply_parent": [
+        "id",
+        "remote_id",
+        "user_id",
+        "privacy",
+        "content_warning",
+        "deleted",
+    ],
+    "book": [
+        "id",
+        "book_ptr_id",
+        "remote_id",
+        "title",
+        "subtitle",
+        "cover",
+        "pages",
+        "parent_work_id",
+    ],
+}
+# mentions are cached as ids, and loaded for a whole page of statuses at once
+STATUS_CACHE_MENTIONS = ["mention_books", "mention_users"]
+
+
+def get_status_cache_key(status_id, updated_date):
+    """the cache key for a status loaded for display in feeds"""
+    return f"feed-status-{status_id}-{updated_date.timestamp()}"
+
+
+def get_cache_values(obj, attnames):
+    """the database values of some of a model instance's fields"""
+    values = {}
+    for attname in attnames:
+        value = getattr(obj, attname)
+        if isinstance(value, FieldFile):
+            value = value.name
+        values[attname] = value
+    return values
+
+
+def model_from_cache(model, values):
+    """rebuild a model instance from its cached values"""
+    # pylint: disable=protected-access
+    # django expects the values in the same order as the model's fields
+    attnames = [f.attname for f in model._meta.concrete_fields if f.attname in values]
+    return model.from_db(None, attnames, [values[a] for a in attnames])
+
+
+def status_to_cache(status):
+    """the values needed to display a status, without the model instances"""
+    # pylint: disable=protected-access
+    data = {
+        "model": status._meta.label_lower,
+        "fields": get_cache_values(
+            status, [f.attname for f in status._meta.concrete_fields]
+        ),
+        "related": {},
+        "mentions": {
+            name: [o.id for o in getattr(status, name).all()]
+            for name in STATUS_CACHE_MENTIONS
+        },
+    }
+    for name, attnames in STATUS_CACHE_RELATED.items():
+        # only some types of status have a book
+        if not hasattr(status, f"{name}_id"):
+            continue
+        related = getattr(status, name)
+        data["related"][name] = get_cache_values(related, attnames) if related else None
+    return data
+
+
+def status_from_cache(data):
+    """a status with its related objects already loaded, except for mentions"""
+    status = model_from_cache(apps.get_model(data["model"]), data["fields"])
+    # pylint: disable=protected-access
+    for name, values in data["related"].items():
+        field = status._meta.get_field(name)
+        field.set_cached_value(
+            status, model_from_cache(field.related_model, values) if values else None
+        )
+    return status
+
+
+def statuses_from_cache(datas):
+    """statuses loaded from the cache, with the objects they mention looked up
+    all together, as if they came from get_statuses_by_id"""
+    statuses = [status_from_cache(data) for data in datas]
+    # pylint: disable=protected-access
+    for status in statuses:
+        status._prefetched_objects_cache = {}
+    for name in STATUS_CACHE_MENTIONS:
+        ids = {i for data in datas for i in data["mentions"][name]}
+        model = models.Status._meta.get_field(name).related_model
+        objects = model.objects.in_bulk(ids) if ids else {}
+        for status, data in zip(statuses, datas):
+            queryset = getattr(status, name).all()
+            queryset._result_cache = [
+                objects[i] for i in data["mentions"][name] if i in objects
+            ]
+            queryset._prefetch_done = True
+            status._prefetched_objects_cache[name] = queryset
+    return statuses
+
+
+@receiver([signals.post_save, signals.post_delete], sender=models.Status)
+@receiver([signals.post_save, signals.post_delete], sender=models.GeneratedNote)
+@receiver([signals.post_save, signals.post_delete], sender=models.Comment)
+@receiver([signals.post_save, signals.post_delete], sender=models.Quotation)
+@receiver([signals.post_save, signals.post_delete], sender=models.Review)
+@receiver([signals.post_save, signals.post_delete], sender=models.ReviewRating)
+@receiver([signals.post_save, signals.post_delete], sender=models.Boost)
+@receiver(signals.m2m_changed, sender=models.Status.mention_books.through)
+@receiver(signals.m2m_changed, sender=models.Status.mention_users.through)
+# pylint: disable=unused-argument
+def clear_status_cache(sender, instance, *args, **kwargs):
+    """statuses that have changed without a new updated date (like their
+    mentions) need to be loaded fresh for feeds"""
+    if not isinstance(instance, models.Status):
+        return
+    cache.delete(get_status_cache_key(instance.id, instance.updated_date))
@@ -22,6 +22,7 @@ EMAIL = "email"
 CONNECTORS = "connectors"
 LISTS = "lists"
 INBOX = "inbox"
+INBOX_INGEST = "inbox_ingest"
 IMPORTS = "imports"
 IMPORT_TRIGGERED = "import_triggered"
 BROADCAST = "broadcast"
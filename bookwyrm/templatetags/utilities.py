@@ -23,6 +23,17 @@ def join(*args):
     return "_".join(str(a) for a in args)
 
 
+@register.simple_tag(takes_context=True)
+def query_string(context, **kwargs):
+    """the current query string, with values replaced, or removed if they're None"""
+    query = context["request"].GET.copy()
+    for key, value in kwargs.items():
+        query.pop(key, None)
+        if value is not None:
+            query[key] = value
+    return query.urlencode()
+
+
 @register.filter(name="username")
 def get_user_identifier(user):
     """use localname for local users, username for remote"""
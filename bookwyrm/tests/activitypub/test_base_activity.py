@@ -88,6 +88,38 @@ class BaseActivity(TestCase):
         self.assertEqual(instance.id, "a")
         self.assertEqual(instance.type, "TestObject")
 
+    def test_get_field_plan(self, *_):
+        """each dataclass works out its own fields once"""
+        plan = activitypub.Review.get_field_plan()
+        self.assertIs(activitypub.Review.get_field_plan(), plan)
+        self.assertIsNot(activitypub.Comment.get_field_plan(), plan)
+
+        fields = {field.name: field for field in plan}
+        self.assertTrue(fields["inReplyToBook"].required)
+        self.assertFalse(fields["name"].required)
+        self.assertEqual(fields["type"].default, "Review")
+        self.assertFalse(fields["tag"].is_activity)
+        fields = {field.name: field for field in activitypub.Create.get_field_plan()}
+        self.assertTrue(fields["object"].is_activity)
+
+    def test_serialize_nested(self, *_):
+        """activities within activities are serialized too"""
+        instance = activitypub.Create(
+            id="a",
+            actor="b",
+            to=[],
+            cc=[],
+            object=ActivityObject(id="c", type="d"),
+            signature=None,
+        )
+        instance.to = [ActivityObject(id="e", type="f"), "g"]
+        serialized = instance.serialize(omit=("cc",))
+        self.assertEqual(serialized["object"]["id"], "c")
+        self.assertEqual(serialized["to"][0]["id"], "e")
+        self.assertEqual(serialized["to"][1], "g")
+        self.assertFalse("cc" in serialized)
+        self.assertFalse("signature" in serialized)
+
     def test_serialize(self, *_):
         """simple function for converting dataclass to dict"""
         instance = ActivityObject(id="a", type="b")
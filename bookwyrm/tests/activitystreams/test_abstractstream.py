@@ -1,12 +1,14 @@
 """ testing activitystreams """
 from datetime import datetime
 from unittest.mock import patch
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.utils import timezone
 
 from bookwyrm import activitystreams, models
 
 
+# pylint: disable=too-many-public-methods
 @patch("bookwyrm.models.activitypub_mixin.broadcast_task.apply_async")
 @patch("bookwyrm.activitystreams.add_status_task.delay")
 @patch("bookwyrm.activitystreams.add_book_statuses_task.delay")
@@ -111,6 +113,236 @@ class Activitystreams(TestCase):
         self.assertEqual(result.last(), status)
         self.assertIsInstance(result.first(), models.Comment)
 
+    def test_get_feed_filter_type(self, *_):
+        """which feed filter applies to a status"""
+        status = models.Status.objects.create(user=self.remote_user, content="hi")
+        self.assertEqual(activitystreams.get_feed_filter_type(status), "other")
+
+        review = models.ReviewRating.objects.create(
+            user=self.remote_user, book=self.book, rating=3
+        )
+        self.assertEqual(activitystreams.get_feed_filter_type(review), "review")
+
+        note = models.GeneratedNote.objects.create(user=self.remote_user, content="hi")
+        self.assertEqual(activitystreams.get_feed_filter_type(note), "everything")
+
+        with patch("bookwyrm.activitystreams.handle_boost_task.delay"):
+            boost = models.Boost.objects.create(
+                user=self.local_user, boosted_status=review
+            )
+        # boosted statuses are loaded all at once
+        with self.assertNumQueries(1):
+            index_keys = self.test_stream.get_index_keys([status, boost, note])
+        self.assertEqual(
+            index_keys, {status.id: "other", boost.id: "review", note.id: "everything"}
+        )
+
+    def test_add_object_to_stores_status_type(self, *_):
+        """statuses are also added to the store for their status type"""
+        status = models.Comment.objects.create(
+            user=self.remote_user, content="hi", book=self.book
+        )
+        with patch("bookwyrm.redis_store.r.pipeline") as redis_mock:
+            self.test_stream.add_object_to_stores(status, ["1-test"])
+        stores = [c[0][0] for c in redis_mock.return_value.zadd.call_args_list]
+        self.assertEqual(stores, ["1-test", "1-test-comment"])
+
+        # the status type can be worked out ahead of time
+        with patch("bookwyrm.redis_store.r.pipeline") as redis_mock:
+            with self.assertNumQueries(0):
+                self.test_stream.add_object_to_stores(
+                    status, ["1-test"], index_keys={status.id: "review"}
+                )
+        stores = [c[0][0] for c in redis_mock.return_value.zadd.call_args_list]
+        self.assertEqual(stores, ["1-test", "1-test-review"])
+
+    def test_get_filtered_store(self, *_):
+        """combine the status type stores a user wants to see"""
+        stream_id = f"{self.local_user.id}-test"
+        store = self.test_stream.get_filtered_store(
+            self.local_user.id, ["review", "comment", "quotation", "everything"]
+        )
+        self.assertEqual(store, stream_id)
+
+        with patch("bookwyrm.activitystreams.r.pipeline") as redis_mock:
+            redis_mock.return_value.execute.return_value = [1, 3, True]
+            store = self.test_stream.get_filtered_store(
+                self.local_user.id, ["review", "comment"]
+            )
+        self.assertEqual(store, f"{stream_id}-filtered-review-comment-other")
+        self.assertEqual(
+            redis_mock.return_value.zunionstore.call_args[0],
+            (
+                store,
+                [
+                    f"{stream_id}-review",
+                    f"{stream_id}-comment",
+                    f"{stream_id}-other",
+                ],
+            ),
+        )
+
+        # the stream was populated before it had type stores, so even if some new
+        # statuses are in them, they're incomplete
+        with patch("bookwyrm.activitystreams.r.pipeline") as redis_mock:
+            redis_mock.return_value.execute.return_value = [0, 1, True]
+            store = self.test_stream.get_filtered_store(
+                self.local_user.id, ["review", "comment"]
+            )
+        self.assertIsNone(store)
+
+    def test_get_filtered_store_reuse(self, *_):
+        """later pages use the store that was combined for the first page"""
+        stream_id = f"{self.local_user.id}-test"
+        with patch("bookwyrm.activitystreams.r.pipeline") as redis_mock:
+            redis_mock.return_value.execute.return_value = [1, True]
+            store = self.test_stream.get_filtered_store(
+                self.local_user.id, ["review", "comment"], reuse=True
+            )
+        self.assertEqual(store, f"{stream_id}-filtered-review-comment-other")
+        self.assertFalse(redis_mock.return_value.zunionstore.called)
+        redis_mock.return_value.expire.assert_called_once_with(
+            store, activitystreams.FILTERED_STORE_TIMEOUT
+        )
+
+        # it has expired, so it's combined again
+        with patch("bookwyrm.activitystreams.r.pipeline") as redis_mock:
+            redis_mock.return_value.execute.side_effect = [[1, False], [1, 3, True]]
+            store = self.test_stream.get_filtered_store(
+                self.local_user.id, ["review", "comment"], reuse=True
+            )
+        self.assertEqual(store, f"{stream_id}-filtered-review-comment-other")
+        self.assertEqual(redis_mock.return_value.zunionstore.call_count, 1)
+
+    def test_get_activity_page_filtered(self, *_):
+        """only the first page of a filtered feed combines the type stores"""
+        with patch(
+            "bookwyrm.activitystreams.ActivityStream.get_filtered_store",
+            return_value=None,
+        ) as store_mock, patch("bookwyrm.activitystreams.r"), patch(
+            "bookwyrm.activitystreams.ActivityStream.get_store_page", return_value=[]
+        ):
+            self.test_stream.get_activity_page(
+                self.local_user, allowed_types=["review"]
+            )
+            self.assertFalse(store_mock.call_args[1]["reuse"])
+            self.test_stream.get_activity_page(
+                self.local_user, cursor=(1.0, 1), allowed_types=["review"]
+            )
+            self.assertTrue(store_mock.call_args[1]["reuse"])
+
+    def test_populate_store_indexed(self, *_):
+        """a populated stream's type stores are complete"""
+        comment = models.Comment.objects.create(
+            user=self.remote_user, content="hi", book=self.book
+        )
+        stream_id = f"{self.local_user.id}-test"
+        with patch("bookwyrm.redis_store.r.pipeline") as redis_mock:
+            self.test_stream.populate_store(stream_id)
+        pipeline = redis_mock.return_value
+        pipeline.zadd.assert_any_call(
+            f"{stream_id}-comment", {comment.id: comment.published_date.timestamp()}
+        )
+        pipeline.set.assert_called_once_with(f"{stream_id}-indexed", 1)
+
+    def test_get_activity_page(self, *_):
+        """load a page of statuses from the redis ranks"""
+        statuses = [
+            models.Status.objects.create(user=self.remote_user, content=f"{i}")
+            for i in range(5)
+        ]
+        # statuses can have the same rank, like imports from the same day
+        values = [
+            (str(status.id).encode(), score)
+            for status, score in zip(statuses, [100.0, 99.0, 99.0, 99.0, 98.0])
+        ]
+
+        def get_store_page(_store, max_score=None, offset=0, count=None):
+            """mock ZREVRANGEBYSCORE"""
+            remaining = [v for v in values if max_score is None or v[1] <= max_score]
+            return remaining[offset : offset + count]
+
+        with patch("bookwyrm.activitystreams.r.set"), patch(
+            "bookwyrm.activitystreams.r.delete"
+        ), patch(
+            "bookwyrm.activitystreams.ActivityStream.get_store_page"
+        ) as redis_mock:
+            redis_mock.side_effect = get_store_page
+            page = self.test_stream.get_activity_page(self.local_user, page_length=2)
+            self.assertEqual(list(page), statuses[:2])
+            self.assertFalse(page.has_previous())
+            self.assertTrue(page.has_next())
+            self.assertEqual(page.next_cursor, "99.0:1")
+
+            # skip everything that's filtered out
+            page = self.test_stream.get_activity_page(
+                self.local_user,
+                cursor=activitystreams.parse_cursor(page.next_cursor),
+                page_length=2,
+                status_filter=lambda qs: qs.exclude(id=statuses[3].id),
+            )
+            self.assertEqual(list(page), [statuses[2], statuses[4]])
+            self.assertTrue(page.has_previous())
+            self.assertFalse(page.has_next())
+
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_get_cached_statuses(self, *_):
+        """statuses are loaded from the shared cache when they're in it"""
+        status = models.Status.objects.create(user=self.remote_user, content="hi")
+        comment = models.Comment.objects.create(
+            user=self.remote_user, content="hi", book=self.book
+        )
+        statuses = self.test_stream.get_cached_statuses([status.id, comment.id])
+        self.assertEqual(statuses, {status.id: status, comment.id: comment})
+        self.assertIsInstance(statuses[comment.id], models.Comment)
+
+        # only the updated dates are loaded from the database
+        with self.assertNumQueries(1):
+            statuses = self.test_stream.get_cached_statuses([status.id, comment.id])
+            self.assertEqual(statuses, {status.id: status, comment.id: comment})
+            self.assertIsInstance(statuses[comment.id], models.Comment)
+            self.assertEqual(statuses[comment.id].book.title, self.book.title)
+            self.assertEqual(
+                statuses[comment.id].user.display_name, self.remote_user.display_name
+            )
+            self.assertEqual(list(statuses[comment.id].mention_users.all()), [])
+            self.assertIsNone(statuses[comment.id].reply_parent)
+
+        # private fields aren't shared with every feed
+        data = cache.get(
+            activitystreams.get_status_cache_key(comment.id, comment.updated_date)
+        )
+        self.assertNotIn("password", data["related"]["user"])
+        self.assertNotIn("email", data["related"]["user"])
+
+        # a status that's been edited since it was cached is loaded again
+        comment.content = "hello"
+        comment.save()
+        statuses = self.test_stream.get_cached_statuses([status.id, comment.id])
+        self.assertEqual(statuses[comment.id].content, "hello")
+
+        # as are statuses with new mentions
+        status.mention_users.add(self.local_user)
+        statuses = self.test_stream.get_cached_statuses([status.id, comment.id])
+        self.assertEqual(
+            list(statuses[status.id].mention_users.all()), [self.local_user]
+        )
+        self.assertEqual(
+            cache.get(
+                activitystreams.get_status_cache_key(status.id, status.updated_date)
+            )["mentions"]["mention_users"],
+            [self.local_user.id],
+        )
+        # the mentions are loaded for the whole page at once
+        with self.assertNumQueries(2):
+            statuses = self.test_stream.get_cached_statuses([status.id, comment.id])
+            self.assertEqual(
+                list(statuses[status.id].mention_users.all()), [self.local_user]
+            )
+        cache.clear()
+
     def test_abstractstream_get_audience(self, *_):
         """get a list of users that should see a status"""
         status = models.Status.objects.create(
@@ -196,3 +428,44 @@ class Activitystreams(TestCase):
         self.assertFalse(self.local_user.id in users)
         self.assertFalse(self.another_user.id in users)
         self.assertFalse(self.remote_user.id in users)
+
+    def test_abstractstream_get_audience_blocked(self, *_):
+        """users who block or are blocked by the author don't see statuses"""
+        self.local_user.blocks.add(self.remote_user)
+        status = models.Status.objects.create(
+            user=self.remote_user, content="hi", privacy="public"
+        )
+        users = self.test_stream.get_audience(status)
+        self.assertFalse(self.local_user.id in users)
+        self.assertTrue(self.another_user.id in users)
+
+    def test_abstractstream_get_audience_followers_reply(self, *_):
+        """replies to followers-only statuses need both authors to be followed"""
+        self.remote_user.followers.add(self.local_user)
+        parent = models.Status.objects.create(
+            user=self.another_user, content="hi", privacy="followers"
+        )
+        status = models.Status.objects.create(
+            user=self.remote_user, content="hi", privacy="public", reply_parent=parent
+        )
+        users = self.test_stream.get_audience(status)
+        self.assertFalse(self.local_user.id in users)
+        self.assertTrue(self.another_user.id in users)
+
+        self.another_user.followers.add(self.local_user)
+        users = self.test_stream.get_audience(status)
+        self.assertTrue(self.local_user.id in users)
+
+    def test_status_audience_shared(self, *_):
+        """the candidate audience is only loaded once for every stream"""
+        self.remote_user.followers.add(self.local_user)
+        status = models.Status.objects.create(
+            user=self.remote_user, content="hi", privacy="followers"
+        )
+        audience = activitystreams.StatusAudience(status)
+        users = self.test_stream.get_audience(status, audience=audience)
+        self.assertEqual(users, [self.local_user.id])
+
+        with self.assertNumQueries(0):
+            users = activitystreams.HomeStream().get_audience(status, audience=audience)
+        self.assertEqual(users, [self.local_user.id])
@@ -66,6 +66,23 @@ class ActivitystreamsSignals(TestCase):
         self.assertEqual(args["args"][0], status.id)
         self.assertEqual(args["queue"], "streams")
 
+    @patch("bookwyrm.activitystreams.settings.STREAM_BATCH_SIZE", 10)
+    def test_add_status_on_create_created_batched(self, *_):
+        """new statuses are queued up to be added in a batch"""
+        status = models.Status.objects.create(
+            user=self.remote_user, content="hi", privacy="public"
+        )
+        with patch(
+            "bookwyrm.activitystreams.add_status_task.apply_async"
+        ) as mock, patch(
+            "bookwyrm.activitystreams.queue_status_for_batch"
+        ) as batch_mock:
+            activitystreams.add_status_on_create_command(models.Status, status, True)
+        self.assertFalse(mock.called)
+        self.assertEqual(batch_mock.call_count, 1)
+        self.assertEqual(batch_mock.call_args[0][0], status.id)
+        self.assertTrue(batch_mock.call_args[1]["increment_unread"])
+
     def test_add_status_on_create_created_low_priority(self, *_):
         """a new statuses has entered"""
         # created later than publication
@@ -84,11 +84,68 @@ class Activitystreams(TestCase):
 
     def test_add_status_task(self):
         """add a status to all streams"""
-        with patch("bookwyrm.activitystreams.ActivityStream.add_status") as mock:
+        with patch("bookwyrm.activitystreams.ActivityStream.add_status") as mock, patch(
+            "bookwyrm.activitystreams.ActivityStream.get_index_keys",
+            return_value={self.status.id: "other"},
+        ) as index_mock:
             activitystreams.add_status_task(self.status.id)
         self.assertEqual(mock.call_count, 3)
         args = mock.call_args[0]
         self.assertEqual(args[0], self.status)
+        # the status type store is worked out once for every stream
+        self.assertEqual(index_mock.call_count, 1)
+        self.assertEqual(mock.call_args[1]["index_keys"], {self.status.id: "other"})
+
+    @patch("bookwyrm.activitystreams.settings.STREAM_BATCH_SIZE", 10)
+    def test_queue_status_for_batch(self):
+        """schedule a batch when the first status is queued"""
+        with patch("bookwyrm.activitystreams.r") as redis_mock, patch(
+            "bookwyrm.activitystreams.add_status_batch_task.apply_async"
+        ) as mock:
+            redis_mock.rpush.return_value = 1
+            redis_mock.set.return_value = True
+            activitystreams.queue_status_for_batch(self.status.id, True)
+        self.assertEqual(mock.call_count, 1)
+        self.assertEqual(
+            redis_mock.rpush.call_args[0], ("add-status-batch", f"{self.status.id}:1")
+        )
+
+        # already scheduled
+        with patch("bookwyrm.activitystreams.r") as redis_mock, patch(
+            "bookwyrm.activitystreams.add_status_batch_task.apply_async"
+        ) as mock:
+            redis_mock.rpush.return_value = 2
+            redis_mock.set.return_value = None
+            activitystreams.queue_status_for_batch(self.status.id, True)
+        self.assertFalse(mock.called)
+
+        # the batch is full
+        with patch("bookwyrm.activitystreams.r") as redis_mock, patch(
+            "bookwyrm.activitystreams.add_status_batch_task.delay"
+        ) as mock:
+            redis_mock.rpush.return_value = 10
+            activitystreams.queue_status_for_batch(self.status.id, True)
+        self.assertEqual(mock.call_count, 1)
+
+    @patch("bookwyrm.activitystreams.settings.STREAM_BATCH_SIZE", 10)
+    def test_add_status_batch_task(self):
+        """add queued statuses to all streams with one pipeline"""
+        with patch("bookwyrm.activitystreams.r") as redis_mock, patch(
+            "bookwyrm.activitystreams.ActivityStream.add_status"
+        ) as mock:
+            redis_mock.pipeline.return_value.execute.return_value = [
+                [f"{self.status.id}:0".encode(), f"{self.status.id}:1".encode()],
+                True,
+            ]
+            redis_mock.llen.return_value = 0
+            activitystreams.add_status_batch_task()
+        # one status added to three streams
+        self.assertEqual(mock.call_count, 3)
+        args = mock.call_args
+        self.assertEqual(args[0][0], self.status)
+        self.assertTrue(args[1]["increment_unread"])
+        self.assertEqual(args[1]["pipeline"], redis_mock.pipeline.return_value)
+        self.assertEqual(args[1]["index_keys"], {self.status.id: "other"})
 
     def test_remove_user_statuses_task(self):
         """remove all statuses by a user from another users' feeds"""
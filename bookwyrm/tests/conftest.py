@@ -0,0 +1,10 @@
+""" setup shared by all the tests """
+import pytest
+
+from bookwyrm.connectors.connector_manager import registry
+
+
+@pytest.fixture(autouse=True)
+def clear_connector_registry():
+    """connectors loaded by another test may be from a rolled back transaction"""
+    registry.clear()
@@ -3,7 +3,7 @@ from unittest.mock import patch
 from django.test import TestCase
 import responses
 
-from bookwyrm import models
+from bookwyrm import http_client, models
 from bookwyrm.connectors import abstract_connector, ConnectorException
 from bookwyrm.connectors.abstract_connector import Mapping, get_data
 from bookwyrm.settings import DOMAIN
@@ -166,3 +166,33 @@ class AbstractConnector(TestCase):
 
         with self.assertRaises(ConnectorException):
             get_data("http://127.0.0.1/image/jpg")
+
+    @responses.activate
+    def test_get_data_cached(self):
+        """data that hasn't changed isn't downloaded again"""
+        responses.add(
+            responses.GET,
+            "https://example.com/book/1",
+            json={"id": "https://example.com/book/1"},
+            headers={"ETag": '"abc"'},
+        )
+        with patch(
+            "bookwyrm.http_client.get_cached_response", return_value=None
+        ), patch("bookwyrm.http_client.cache_response") as cache_mock:
+            result = get_data("https://example.com/book/1")
+        self.assertEqual(result, {"id": "https://example.com/book/1"})
+        self.assertEqual(cache_mock.call_count, 1)
+        self.assertFalse("If-None-Match" in responses.calls[0].request.headers)
+
+        responses.replace(responses.GET, "https://example.com/book/1", status=304)
+        cached = http_client.CachedResponse('"abc"', None, b'{"id": "cached"}')
+        with patch(
+            "bookwyrm.http_client.get_cached_response", return_value=cached
+        ), patch("bookwyrm.http_client.cache_response") as cache_mock, patch(
+            "bookwyrm.http_client.touch_cached_response"
+        ) as touch_mock:
+            result = get_data("https://example.com/book/1")
+        self.assertEqual(result, {"id": "cached"})
+        self.assertFalse(cache_mock.called)
+        touch_mock.assert_called_once_with("https://example.com/book/1", params=None)
+        self.assertEqual(responses.calls[1].request.headers["If-None-Match"], '"abc"')
@@ -0,0 +1,119 @@
+""" keeping track of how well connectors are working """
+import asyncio
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from bookwyrm import models
+from bookwyrm.connectors import connector_health, connector_manager
+from bookwyrm.settings import SEARCH_TIMEOUT
+
+
+class ConnectorHealth(TestCase):
+    """latency and errors for each connector"""
+
+    def setUp(self):
+        """a connector to search"""
+        models.Connector.objects.create(
+            identifier="example.com",
+            connector_file="bookwyrm_connector",
+            base_url="https://example.com",
+            books_url="https://example.com/books",
+            covers_url="https://example.com/covers",
+            search_url="https://example.com/search?q=",
+        )
+
+    def test_get_health(self):
+        """stats come from the most recent searches"""
+        with patch("bookwyrm.connectors.connector_health.r") as redis_mock:
+            redis_mock.pipeline.return_value.execute.return_value = [
+                [b"1:100"] * 8 + [b"0:8000"] * 2,
+                [b"1:100"],
+                [],
+            ]
+            health = connector_health.get_health(["fast", "new", "unknown"])
+
+        self.assertEqual(health["fast"].searches, 10)
+        self.assertEqual(health["fast"].error_rate, 0.2)
+        self.assertEqual(health["fast"].latency, 0.1)
+        self.assertEqual(health["fast"].timeout, connector_health.MIN_TIMEOUT)
+        # not enough searches to go by
+        self.assertEqual(health["new"].latency, 0.1)
+        self.assertEqual(health["new"].timeout, SEARCH_TIMEOUT)
+        self.assertEqual(health["unknown"].searches, 0)
+        self.assertIsNone(health["unknown"].latency)
+
+    def test_is_healthy(self):
+        """failing connectors are only tried now and then"""
+        failing = connector_health.ConnectorHealth(10, 0.9, None, SEARCH_TIMEOUT)
+        with patch("bookwyrm.connectors.connector_health.r") as redis_mock:
+            healthy = connector_health.ConnectorHealth(10, 0.1, 0.1, 2)
+            self.assertTrue(connector_health.is_healthy("example.com", healthy))
+            self.assertFalse(redis_mock.set.called)
+
+            redis_mock.set.return_value = True
+            self.assertTrue(connector_health.is_healthy("example.com", failing))
+            redis_mock.set.return_value = None
+            self.assertFalse(connector_health.is_healthy("example.com", failing))
+
+    def test_record_searches(self):
+        """searches are saved together"""
+        with patch("bookwyrm.connectors.connector_health.r") as redis_mock:
+            connector_health.record_searches([])
+            self.assertFalse(redis_mock.pipeline.called)
+
+            connector_health.record_searches(
+                [("example.com", True, 0.25), ("other.com", False, 8)]
+            )
+        pipeline = redis_mock.pipeline.return_value
+        self.assertEqual(
+            [call[0] for call in pipeline.lpush.call_args_list],
+            [
+                ("connector-health-example.com", "1:250"),
+                ("connector-health-other.com", "0:8000"),
+            ],
+        )
+        self.assertEqual(pipeline.execute.call_count, 1)
+
+    def test_search_connector_timeout(self):
+        """a connector is given as long as it usually takes"""
+        connector = next(connector_manager.get_connectors())
+
+        async def get_results(*_):
+            """this connector is slow today"""
+            await asyncio.sleep(1)
+
+        with patch.object(connector, "get_results", get_results):
+            outcome = asyncio.run(
+                connector_manager.search_connector(
+                    connector, None, "https://example.com", 0.1, "hi", 0.01
+                )
+            )
+        self.assertEqual(outcome.identifier, "example.com")
+        self.assertIsNone(outcome.result)
+        self.assertLess(outcome.elapsed, 1)
+
+    def test_run_connector_search(self):
+        """health is read before the searches and saved after them"""
+        connector = next(connector_manager.get_connectors())
+        items = [("https://example.com/search?q=hi", connector)]
+
+        async def get_results(*_):
+            """a search that works"""
+            return {"connector": connector, "results": []}
+
+        with patch.object(connector, "get_results", get_results), patch(
+            "bookwyrm.connectors.connector_health.get_health",
+            return_value={
+                "example.com": connector_health.ConnectorHealth(10, 0, 0.1, 2)
+            },
+        ), patch(
+            "bookwyrm.connectors.connector_health.record_searches"
+        ) as record_mock, patch(
+            "bookwyrm.http_client.async_session"
+        ):
+            results = connector_manager.run_connector_search("hi", items, 0.1)
+
+        self.assertEqual(results, [{"connector": connector, "results": []}])
+        self.assertEqual(record_mock.call_count, 1)
+        self.assertEqual(record_mock.call_args[0][0][0][:2], ("example.com", True))
@@ -1,8 +1,14 @@
 """ interface between the app and various connectors """
+import asyncio
+import json
+import time
+from unittest.mock import patch
+
 from django.test import TestCase
 import responses
 
 from bookwyrm import models
+from bookwyrm.book_search import SearchResult
 from bookwyrm.connectors import connector_manager
 from bookwyrm.connectors.bookwyrm_connector import Connector as BookWyrmConnector
 
@@ -79,3 +85,150 @@ class ConnectorManager(TestCase):
         """load a connector object from the database entry"""
         connector = connector_manager.load_connector(self.remote_connector)
         self.assertEqual(connector.identifier, "test_connector_remote")
+
+    def test_search_cached(self):
+        """repeated searches use saved results, and update them when they're old"""
+        connector = connector_manager.load_connector(self.remote_connector)
+        searches = []
+
+        # pylint: disable=unused-argument
+        async def search_connectors(query, items, min_confidence):
+            """pretend to search the connectors"""
+            searches.append(query)
+            result = {
+                "connector": connector,
+                "results": [
+                    SearchResult(
+                        title="Example Edition",
+                        key="http://fake.ciom/book/1",
+                        connector=connector,
+                    )
+                ],
+            }
+            return [connector_manager.SearchOutcome(connector.identifier, result, 1)]
+
+        with patch("bookwyrm.connectors.connector_manager.r") as redis_mock, patch(
+            "bookwyrm.connectors.connector_manager.async_connector_search",
+            search_connectors,
+        ):
+            redis_mock.pipeline.return_value.execute.side_effect = [
+                [[None, None]],
+                [1, 1, 1, 1, 1],
+            ]
+            results = connector_manager.search("Example")
+        self.assertEqual(searches, ["Example"])
+        self.assertEqual(results[0]["results"][0].title, "Example Edition")
+        mapping = redis_mock.pipeline.return_value.hset.call_args[1]["mapping"]
+        cached_results = mapping["results"]
+        self.assertEqual(json.loads(cached_results)[0]["title"], "Example Edition")
+
+        with patch("bookwyrm.connectors.connector_manager.r") as redis_mock, patch(
+            "bookwyrm.connectors.connector_manager.async_connector_search",
+            search_connectors,
+        ), patch(
+            "bookwyrm.connectors.connector_manager.refresh_search_cache_task.delay"
+        ) as refresh_mock:
+            redis_mock.pipeline.return_value.execute.return_value = [
+                [str(time.time()).encode("utf-8"), cached_results.encode("utf-8")]
+            ]
+            results = connector_manager.search(" example  ")
+            self.assertFalse(refresh_mock.called)
+
+            # stale results are used while they're refreshed
+            redis_mock.pipeline.return_value.execute.return_value = [
+                [b"0", cached_results.encode("utf-8")]
+            ]
+            stale_results = connector_manager.search("Example")
+        self.assertEqual(searches, ["Example"])
+        self.assertEqual(results[0]["results"][0].title, "Example Edition")
+        self.assertEqual(results[0]["connector"].identifier, "test_connector_remote")
+        self.assertEqual(stale_results[0]["results"][0].title, "Example Edition")
+        refresh_mock.assert_called_once_with(self.remote_connector.id, "Example", 0.1)
+
+    def test_search_cache_key(self):
+        """differences in case and spacing are the same search"""
+        self.assertEqual(
+            connector_manager.get_search_cache_key("example.com", "Hi There", 0.1),
+            connector_manager.get_search_cache_key("example.com", " hi  there", 0.1),
+        )
+        self.assertNotEqual(
+            connector_manager.get_search_cache_key("example.com", "Hi There", 0.1),
+            connector_manager.get_search_cache_key("other.com", "Hi There", 0.1),
+        )
+
+    def test_cache_search_evicts(self):
+        """the least recently used results are dropped"""
+        connector = connector_manager.load_connector(self.remote_connector)
+        results = [{"connector": connector, "results": []}]
+        with patch("bookwyrm.connectors.connector_manager.r") as redis_mock, patch(
+            "bookwyrm.connectors.connector_manager.settings.SEARCH_CACHE_MAX_ENTRIES",
+            1,
+        ):
+            redis_mock.pipeline.return_value.execute.return_value = [1, 1, 1, 1, 2]
+            redis_mock.zpopmin.return_value = [(b"search-cache-1", 1)]
+            connector_manager.cache_search(results, "Example", 0.1)
+        redis_mock.zpopmin.assert_called_once_with(
+            connector_manager.SEARCH_CACHE_KEY, 1
+        )
+        redis_mock.delete.assert_called_once_with(b"search-cache-1")
+
+    def test_search_progressively(self):
+        """results are passed on as soon as each connector responds"""
+        models.Connector.objects.create(
+            identifier="slow_connector",
+            priority=2,
+            connector_file="bookwyrm_connector",
+            base_url="http://slow.ciom/",
+            books_url="http://slow.ciom/",
+            search_url="http://slow.ciom/search/",
+            covers_url="http://covers.slow.ciom/",
+        )
+
+        # pylint: disable=unused-argument
+        async def get_results(connector, session, url, min_confidence, query):
+            """the higher priority connector is slower"""
+            if connector.identifier == "test_connector_remote":
+                await asyncio.sleep(0.1)
+            return {"connector": connector, "results": []}
+
+        with patch(
+            "bookwyrm.connectors.connector_manager.get_cached_search", return_value={}
+        ), patch("bookwyrm.connectors.connector_manager.cache_search"), patch(
+            "bookwyrm.connectors.bookwyrm_connector.Connector.get_results",
+            get_results,
+        ), patch(
+            "bookwyrm.connectors.connector_health.record_searches"
+        ) as record_mock:
+            results = connector_manager.search_progressively("Example")
+            self.assertEqual(next(results)["connector"].identifier, "slow_connector")
+            self.assertEqual(
+                next(results)["connector"].identifier, "test_connector_remote"
+            )
+            self.assertIsNone(next(results, None))
+        # each connector's health is saved once its search is done
+        self.assertEqual(
+            [call[0][0][0][0] for call in record_mock.call_args_list],
+            ["slow_connector", "test_connector_remote"],
+        )
+
+    def test_connector_registry(self):
+        """connectors are only loaded again once they've changed"""
+        connector = list(connector_manager.get_connectors())[0]
+        with self.assertNumQueries(0):
+            self.assertEqual(list(connector_manager.get_connectors()), [connector])
+            self.assertIs(
+                connector_manager.load_connector(self.remote_connector), connector
+            )
+            self.assertIs(
+                connector_manager.get_or_create_connector(
+                    "http://test_connector_remote/book/1"
+                ),
+                connector,
+            )
+
+        self.remote_connector.active = False
+        self.remote_connector.save()
+        self.assertEqual(list(connector_manager.get_connectors()), [])
+        self.assertIsNot(
+            connector_manager.load_connector(self.remote_connector), connector
+        )
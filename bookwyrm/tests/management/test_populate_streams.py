@@ -3,7 +3,10 @@ from unittest.mock import patch
 from django.test import TestCase
 
 from bookwyrm import models
-from bookwyrm.management.commands.populate_streams import populate_streams
+from bookwyrm.management.commands.populate_streams import (
+    populate_streams,
+    rebuild_streams,
+)
 
 
 @patch("bookwyrm.models.activitypub_mixin.broadcast_task.apply_async")
@@ -60,3 +63,40 @@ class Activitystreams(TestCase):
             populate_streams()
         self.assertEqual(redis_mock.call_count, 6)  # 2 users x 3 streams
         self.assertEqual(list_mock.call_count, 2)  # 2 users
+
+    def test_rebuild_streams(self, _):
+        """populate the streams here, recording which users are done"""
+        with patch("bookwyrm.activitystreams.add_status_task.delay"):
+            models.Comment.objects.create(
+                user=self.local_user, content="hi", book=self.book
+            )
+
+        with patch("bookwyrm.management.commands.populate_streams.r") as redis_mock:
+            redis_mock.smembers.return_value = set()
+            pipeline = redis_mock.pipeline.return_value
+            pipeline.__len__.return_value = 0
+            progress = rebuild_streams()
+
+        self.assertEqual(progress.users, 2)
+        # the comment is in the local user's home, local and books streams
+        self.assertEqual(progress.statuses, 3)
+        self.assertTrue(redis_mock.delete.called)
+        self.assertEqual(pipeline.sadd.call_count, 2)
+        self.assertEqual(pipeline.execute.call_count, 1)
+
+    def test_rebuild_streams_resume(self, _):
+        """users that are already done are skipped"""
+        with patch(
+            "bookwyrm.management.commands.populate_streams.r"
+        ) as redis_mock, patch(
+            "bookwyrm.activitystreams.HomeStream.populate_streams"
+        ) as mock:
+            redis_mock.smembers.return_value = {str(self.local_user.id).encode()}
+            redis_mock.pipeline.return_value.__len__.return_value = 0
+            mock.return_value = 0
+            progress = rebuild_streams(stream="home", resume=True)
+
+        self.assertFalse(redis_mock.delete.called)
+        self.assertEqual(progress.users, 1)
+        self.assertEqual(mock.call_count, 1)
+        self.assertEqual(mock.call_args[0][0], self.another_user)
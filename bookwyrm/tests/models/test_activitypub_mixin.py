@@ -2,9 +2,12 @@
 from unittest.mock import patch
 from collections import namedtuple
 from dataclasses import dataclass
+from datetime import timedelta
 import re
 from django import db
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
 
 from bookwyrm.activitypub.base_activity import ActivityObject
 from bookwyrm import models
@@ -12,6 +15,7 @@ from bookwyrm.models import base_model
 from bookwyrm.models.activitypub_mixin import (
     ActivitypubMixin,
     ActivityMixin,
+    BroadcastSignatures,
     broadcast_task,
     ObjectMixin,
     OrderedCollectionMixin,
@@ -77,6 +81,33 @@ class ActivitypubMixins(TestCase):
         self.assertEqual(activity["id"], "https://www.example.com/test")
         self.assertEqual(activity["type"], "Test")
 
+    def test_get_activity_fields(self, *_):
+        """fields are sorted once for each model, and shared by its instances"""
+        activity_fields = models.Review.get_activity_fields()
+        self.assertIs(models.Review.get_activity_fields(), activity_fields)
+        self.assertIsNot(models.Comment.get_activity_fields(), activity_fields)
+
+        review = models.Review()
+        self.assertIs(review.activity_fields, activity_fields["activity_fields"])
+        self.assertIs(models.Review().simple_fields, review.simple_fields)
+        self.assertTrue(any(field.name == "rating" for field in review.simple_fields))
+        self.assertFalse(
+            any(field.name == "rating" for field in models.Comment().simple_fields)
+        )
+
+        boost = models.Boost()
+        self.assertEqual(
+            {field.name for field in boost.activity_fields},
+            {"user", "boosted_status", "published_date", "privacy"},
+        )
+        self.assertEqual(boost.image_fields, ())
+
+        # property fields are serialized too
+        self.assertEqual(
+            self.local_user.to_activity()["following"],
+            self.local_user.following_link,
+        )
+
     def test_find_existing_by_remote_id(self, *_):
         """attempt to match a remote id to an object in the db"""
         # uses a different remote id scheme
@@ -119,6 +150,61 @@ class ActivitypubMixins(TestCase):
         result = models.Edition.find_existing({"openlibraryKey": "OL1234"})
         self.assertEqual(result, book)
 
+    def test_find_existing_many(self, *_):
+        """match a batch of activities with one query"""
+        book = models.Edition.objects.create(
+            title="Test edition", remote_id="http://book.com/book"
+        )
+        another_book = models.Edition.objects.create(
+            title="Another edition", openlibrary_key="OL1234"
+        )
+
+        with self.assertNumQueries(1):
+            result = models.Edition.find_existing_many(
+                [
+                    {"id": book.remote_id},
+                    {"id": "http://book.com/book"},
+                    {"id": "https://example.com/book/2", "openlibraryKey": "OL1234"},
+                    {"id": "https://example.com/book/3"},
+                    {"openlibraryKey": "OL1234"},
+                ]
+            )
+        self.assertEqual(
+            result,
+            {
+                book.remote_id: book,
+                "http://book.com/book": book,
+                "https://example.com/book/2": another_book,
+            },
+        )
+
+        models.Comment.objects.create(
+            user=self.local_user,
+            content="test status",
+            book=book,
+            remote_id="https://comment.net",
+        )
+        result = models.Status.find_existing_many([{"id": "https://comment.net"}])
+        self.assertIsInstance(result["https://comment.net"], models.Comment)
+
+    def test_find_existing_many_precedence(self, *_):
+        """an activity matching several objects gets the same one as find_existing"""
+        first_book = models.Edition.objects.create(
+            title="Test edition", openlibrary_key="OL1234"
+        )
+        models.Edition.objects.create(
+            title="Another edition", remote_id="http://book.com/book"
+        )
+        for data in [
+            {"id": "http://book.com/book", "openlibraryKey": "OL1234"},
+            {"openlibraryKey": "OL1234", "id": "http://book.com/book"},
+        ]:
+            self.assertEqual(models.Edition.find_existing(data), first_book)
+            self.assertEqual(
+                models.Edition.find_existing_many([data]),
+                {"http://book.com/book": first_book},
+            )
+
     def test_get_recipients_public_object(self, *_):
         """determines the recipients for an object's broadcast"""
         MockSelf = namedtuple("Self", ("privacy"))
@@ -145,6 +231,38 @@ class ActivitypubMixins(TestCase):
         self.assertEqual(len(recipients), 1)
         self.assertEqual(recipients[0], self.remote_user.inbox)
 
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_get_recipients_cached(self, *_):
+        """follower inboxes are cached until the followers change"""
+        MockSelf = namedtuple("Self", ("privacy", "user"))
+        mock_self = MockSelf("public", self.local_user)
+        self.local_user.followers.add(self.remote_user)
+
+        recipients = ActivitypubMixin.get_recipients(mock_self)
+        self.assertEqual(recipients, [self.remote_user.inbox])
+        with self.assertNumQueries(0):
+            recipients = ActivitypubMixin.get_recipients(mock_self)
+        self.assertEqual(recipients, [self.remote_user.inbox])
+
+        self.local_user.followers.remove(self.remote_user)
+        self.assertEqual(ActivitypubMixin.get_recipients(mock_self), [])
+
+        models.UserFollows.objects.create(
+            user_subject=self.remote_user, user_object=self.local_user
+        )
+        self.assertEqual(
+            ActivitypubMixin.get_recipients(mock_self), [self.remote_user.inbox]
+        )
+
+        self.remote_user.shared_inbox = "https://example.com/inbox"
+        self.remote_user.save(broadcast=False, update_fields=["shared_inbox"])
+        self.assertEqual(
+            ActivitypubMixin.get_recipients(mock_self), ["https://example.com/inbox"]
+        )
+        cache.clear()
+
     def test_get_recipients_public_user_object_with_mention(self, *_):
         """determines the recipients for a user's object broadcast"""
         MockSelf = namedtuple("Self", ("privacy", "user"))
@@ -433,3 +551,59 @@ class ActivitypubMixins(TestCase):
             broadcast_task(self.local_user.id, {}, recipients)
         self.assertTrue(mock.called)
         self.assertEqual(mock.call_count, 1)
+
+    def test_broadcast_signatures(self, *_):
+        """deliveries to the same inbox share a signature"""
+        signatures = BroadcastSignatures(self.local_user, "{}")
+        with patch("bookwyrm.models.activitypub_mixin.make_signature") as mock:
+            mock.side_effect = lambda *args, **kwargs: str(mock.call_count)
+            first = signatures.get_headers("https://example.com/user/inbox")
+            again = signatures.get_headers("https://example.com/user/inbox")
+            other = signatures.get_headers("https://example.com/inbox")
+            legacy = signatures.get_headers(
+                "https://example.com/inbox", use_legacy_key=True
+            )
+        self.assertEqual(mock.call_count, 3)
+        self.assertEqual(first, again)
+        self.assertNotEqual(first["Signature"], other["Signature"])
+        self.assertNotEqual(other["Signature"], legacy["Signature"])
+        self.assertEqual(first["Date"], other["Date"])
+
+    def test_broadcast_task_retry(self, broadcast_mock, _):
+        """failed deliveries are tried again later"""
+        server = models.FederatedServer.objects.create(server_name="down.example")
+        recipients = [
+            "https://instance.example/user/inbox",
+            "https://down.example/user/inbox",
+        ]
+        responses = [namedtuple("Response", ("status"))(202), None]
+        with patch(
+            "bookwyrm.models.activitypub_mixin.asyncio.run", return_value=responses
+        ):
+            broadcast_task(self.local_user.id, {}, recipients)
+
+        self.assertEqual(broadcast_mock.call_count, 1)
+        kwargs = broadcast_mock.call_args[1]
+        self.assertEqual(kwargs["args"][2], ["https://down.example/user/inbox"])
+        self.assertEqual(kwargs["kwargs"], {"attempt": 2})
+        server.refresh_from_db()
+        self.assertEqual(server.delivery_failures, 1)
+
+    def test_broadcast_task_unavailable_server(self, broadcast_mock, _):
+        """deliveries to a server that's been failing wait until it's retried"""
+        server = models.FederatedServer.objects.create(
+            server_name="down.example",
+            delivery_failures=5,
+            delivery_retry_date=timezone.now() + timedelta(hours=1),
+        )
+        recipients = ["https://down.example/user/inbox"]
+        with patch("bookwyrm.models.activitypub_mixin.asyncio.run") as mock:
+            broadcast_task(self.local_user.id, {}, recipients)
+        self.assertFalse(mock.called)
+        self.assertEqual(broadcast_mock.call_count, 1)
+        self.assertEqual(broadcast_mock.call_args[1]["eta"], server.delivery_retry_date)
+
+        # out of attempts
+        broadcast_mock.reset_mock()
+        broadcast_task(self.local_user.id, {}, recipients, attempt=5)
+        self.assertFalse(broadcast_mock.called)
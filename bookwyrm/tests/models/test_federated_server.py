@@ -3,6 +3,7 @@ from unittest.mock import patch
 from django.test import TestCase
 
 from bookwyrm import models
+from bookwyrm.connectors import connector_manager
 
 
 class FederatedServer(TestCase):
@@ -65,3 +66,60 @@ class FederatedServer(TestCase):
         self.inactive_remote_user.refresh_from_db()
         self.assertFalse(self.inactive_remote_user.is_active)
         self.assertEqual(self.inactive_remote_user.deactivation_reason, "self_deletion")
+
+    @patch("bookwyrm.suggested_users.bulk_add_instance_task.delay")
+    @patch("bookwyrm.suggested_users.bulk_remove_instance_task.delay")
+    def test_block_unblock_connector(self, *_):
+        """a blocked bookwyrm server's connector isn't searched"""
+        server = models.FederatedServer.objects.create(
+            server_name="books.server", application_type="bookwyrm"
+        )
+        self.assertEqual(
+            [c.identifier for c in connector_manager.get_connectors()],
+            ["books.server"],
+        )
+
+        with patch(
+            "bookwyrm.connectors.connector_manager.reload_connectors",
+            wraps=connector_manager.reload_connectors,
+        ) as reload_mock:
+            server.block()
+            self.assertEqual(list(connector_manager.get_connectors()), [])
+
+            server.unblock()
+            self.assertEqual(
+                [c.identifier for c in connector_manager.get_connectors()],
+                ["books.server"],
+            )
+        # the registry is reloaded once for each change
+        self.assertEqual(reload_mock.call_count, 2)
+
+    @patch("bookwyrm.models.federated_server.DELIVERY_FAILURE_THRESHOLD", 2)
+    @patch("bookwyrm.models.federated_server.DELIVERY_RETRY_DELAY", 60)
+    def test_record_deliveries(self):
+        """stop delivering to a server that keeps failing"""
+        models.FederatedServer.record_deliveries([], ["test.server"])
+        self.server.refresh_from_db()
+        self.assertEqual(self.server.delivery_failures, 1)
+        self.assertIsNone(self.server.delivery_retry_date)
+        self.assertEqual(
+            models.FederatedServer.get_unavailable_servers(["test.server"]), {}
+        )
+
+        models.FederatedServer.record_deliveries([], ["test.server"])
+        self.server.refresh_from_db()
+        self.assertEqual(self.server.delivery_failures, 2)
+        self.assertIsNotNone(self.server.delivery_retry_date)
+        self.assertEqual(
+            models.FederatedServer.get_unavailable_servers(["test.server"]),
+            {"test.server": self.server.delivery_retry_date},
+        )
+
+        # the backoff doubles with each failure
+        self.server.delivery_failures = 4
+        self.assertEqual(self.server.get_delivery_backoff().total_seconds(), 240)
+
+        models.FederatedServer.record_deliveries(["test.server"], [])
+        self.server.refresh_from_db()
+        self.assertEqual(self.server.delivery_failures, 0)
+        self.assertIsNone(self.server.delivery_retry_date)
@@ -388,6 +388,24 @@ class ModelFields(TestCase):
         self.assertEqual(len(value), 1)
         self.assertIsInstance(value[0], User)
 
+    def test_many_to_many_field_from_activity_existing(self, *_):
+        """related objects that are already in the database are found together"""
+        instance = fields.ManyToManyField(User)
+        users = [
+            User.objects.create_user(
+                f"{name}@example.com",
+                f"{name}@example.com",
+                "password",
+                local=True,
+                localname=name,
+            )
+            for name in ["mouse", "rat", "cat"]
+        ]
+
+        with self.assertNumQueries(1):
+            value = instance.field_from_activity([user.remote_id for user in users])
+        self.assertEqual(value, users)
+
     def test_tag_field(self, *_):
         """a special type of many to many field"""
         instance = fields.TagField("User")
@@ -409,7 +427,26 @@ class ModelFields(TestCase):
 
     def test_tag_field_from_activity(self, *_):
         """loadin' a list of items from Links"""
-        # TODO
+        instance = fields.TagField(User)
+        users = [
+            User.objects.create_user(
+                f"{name}@example.com",
+                f"{name}@example.com",
+                "password",
+                local=True,
+                localname=name,
+            )
+            for name in ["mouse", "rat", "cat"]
+        ]
+        tags = [
+            {"href": user.remote_id, "name": f"@{user.username}", "type": "Mention"}
+            for user in reversed(users)
+        ]
+        tags.insert(1, {"href": "https://e.b/tag", "name": "#a", "type": "Hashtag"})
+
+        with self.assertNumQueries(1):
+            value = instance.field_from_activity(tags)
+        self.assertEqual(value, list(reversed(users)))
 
     @patch("bookwyrm.models.activitypub_mixin.ObjectMixin.broadcast")
     @patch("bookwyrm.suggested_users.remove_user_task.delay")
@@ -266,3 +266,86 @@ class User(TestCase):
         results = models.User.admins()
         self.assertEqual(results.count(), 1)
         self.assertEqual(results.first(), self.user)
+
+    @responses.activate
+    def test_get_remote_reviews(self):
+        """load the pages of a remote outbox, skipping reviews we already have"""
+        outbox = "https://example.com/user/rat/outbox"
+        responses.add(
+            responses.GET,
+            f"{outbox}?type=Review",
+            json={
+                "id": outbox,
+                "type": "OrderedCollection",
+                "totalItems": 3,
+                "first": f"{outbox}?page=1",
+                "last": f"{outbox}?page=2",
+            },
+        )
+        book = models.Edition.objects.create(title="Test Edition")
+        with patch("bookwyrm.activitystreams.add_status_task.delay"), patch(
+            "bookwyrm.models.activitypub_mixin.broadcast_task.apply_async"
+        ):
+            existing = models.Review.objects.create(
+                user=self.user, book=book, remote_id="https://example.com/review/1"
+            )
+        pages = [
+            {
+                "orderedItems": [
+                    {"id": existing.remote_id, "type": "Review"},
+                    {"id": "https://example.com/review/2", "type": "Review"},
+                ]
+            },
+            {
+                "orderedItems": [
+                    {"id": "https://example.com/comment/3", "type": "Comment"},
+                    {"id": "https://example.com/review/4", "type": "Review"},
+                ]
+            },
+        ]
+
+        with patch(
+            "bookwyrm.models.user.get_outbox_pages", return_value=pages
+        ) as pages_mock, patch(
+            "bookwyrm.models.user.save_remote_reviews.delay"
+        ) as save_mock:
+            models.user.get_remote_reviews(outbox)
+
+        self.assertEqual(
+            pages_mock.call_args[0][0],
+            [f"{outbox}?page=1&type=Review", f"{outbox}?page=2&type=Review"],
+        )
+        self.assertEqual(save_mock.call_count, 1)
+        self.assertEqual(
+            [review["id"] for review in save_mock.call_args[0][0]],
+            ["https://example.com/review/2", "https://example.com/review/4"],
+        )
+
+    @responses.activate
+    def test_get_remote_reviews_next_pages(self):
+        """follow next links when the pages aren't numbered"""
+        outbox = "https://example.com/user/rat/outbox"
+        responses.add(
+            responses.GET,
+            f"{outbox}?type=Review",
+            json={"id": outbox, "type": "OrderedCollection", "first": f"{outbox}/1"},
+        )
+        for page in range(1, 20):
+            responses.add(
+                responses.GET,
+                f"{outbox}/{page}",
+                json={
+                    "orderedItems": [
+                        {"id": f"https://example.com/review/{page}", "type": "Review"}
+                    ],
+                    "next": f"{outbox}/{page + 1}",
+                },
+            )
+
+        with patch("bookwyrm.models.user.OUTBOX_BACKFILL_PAGES", 3), patch(
+            "bookwyrm.models.user.save_remote_reviews.delay"
+        ) as save_mock:
+            models.user.get_remote_reviews(outbox)
+
+        self.assertEqual(len(responses.calls), 4)
+        self.assertEqual(len(save_mock.call_args[0][0]), 3)
@@ -0,0 +1,58 @@
+""" testing the in-memory blocklist """
+from unittest.mock import patch
+from django.test import TestCase
+
+from bookwyrm import models
+from bookwyrm.blocklist import BlocklistIndex
+
+
+@patch("bookwyrm.blocklist.r")
+class Blocklist(TestCase):
+    """blocked domains and ip addresses"""
+
+    def setUp(self):
+        """some things to block"""
+        with patch("bookwyrm.blocklist.r"):
+            models.FederatedServer.objects.create(
+                server_name="blocked.example", status="blocked"
+            )
+            models.FederatedServer.objects.create(server_name="fine.example")
+            models.IPBlocklist.objects.create(address="192.168.0.1")
+            models.IPBlocklist.objects.create(address="10.0.0.0/8")
+            models.IPBlocklist.objects.create(address="2001:db8::/32")
+            models.IPBlocklist.objects.create(address="not an ip")
+        self.blocklist = BlocklistIndex()
+
+    def test_is_domain_blocked(self, redis_mock):
+        """look up blocked servers"""
+        redis_mock.get.return_value = b"1"
+        self.assertTrue(self.blocklist.is_domain_blocked("https://blocked.example/u"))
+        self.assertFalse(self.blocklist.is_domain_blocked("https://fine.example/u"))
+        self.assertFalse(self.blocklist.is_domain_blocked("https://new.example/u"))
+
+    def test_is_ip_blocked(self, redis_mock):
+        """look up addresses and ranges"""
+        redis_mock.get.return_value = b"1"
+        self.assertTrue(self.blocklist.is_ip_blocked("192.168.0.1"))
+        self.assertFalse(self.blocklist.is_ip_blocked("192.168.0.2"))
+        self.assertTrue(self.blocklist.is_ip_blocked("10.1.2.3"))
+        self.assertFalse(self.blocklist.is_ip_blocked("11.1.2.3"))
+        self.assertTrue(self.blocklist.is_ip_blocked("2001:db8::1"))
+        self.assertFalse(self.blocklist.is_ip_blocked("2001:db9::1"))
+        self.assertTrue(self.blocklist.is_ip_blocked("not an ip"))
+        self.assertFalse(self.blocklist.is_ip_blocked(None))
+
+    def test_refresh(self, redis_mock):
+        """the blocklist is only loaded again when the version changes"""
+        redis_mock.get.return_value = b"1"
+        self.blocklist.refresh()
+        with self.assertNumQueries(0):
+            self.assertFalse(self.blocklist.is_domain_blocked("https://fine.example"))
+
+        server = models.FederatedServer.objects.get(server_name="fine.example")
+        with self.captureOnCommitCallbacks(execute=True):
+            server.block()
+        self.assertTrue(redis_mock.incr.called)
+
+        redis_mock.get.return_value = b"2"
+        self.assertTrue(self.blocklist.is_domain_blocked("https://fine.example"))
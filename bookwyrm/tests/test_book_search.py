@@ -80,6 +80,18 @@ class BookSearch(TestCase):
         self.assertEqual(len(results), 1)
         self.assertEqual(results[0], self.second_edition)
 
+    def test_search_title_author_best_edition(self):
+        """one query finds the best edition of each work"""
+        other_work = models.Work.objects.create(title="Other Example Work")
+        other_edition = models.Edition.objects.create(
+            title="Other Example", parent_work=other_work, pages=100
+        )
+        models.Edition.objects.create(title="Other Example", parent_work=other_work)
+        with self.assertNumQueries(1):
+            results = book_search.search_title_author("Example", min_confidence=0)
+        self.assertEqual(len(results), 2)
+        self.assertEqual(set(results), {self.first_edition, other_edition})
+
     def test_search_title_author_return_first(self):
         """search by unique identifiers"""
         results = book_search.search_title_author(
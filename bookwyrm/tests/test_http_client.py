@@ -0,0 +1,170 @@
+""" shared http connections """
+from unittest.mock import ANY, patch
+
+from django.test import TestCase
+import requests
+import responses
+
+from bookwyrm import http_client
+
+
+class HttpClient(TestCase):
+    """pooled requests and their stats"""
+
+    def test_get_session(self):
+        """each process keeps its session"""
+        session = http_client.get_session()
+        self.assertIs(http_client.get_session(), session)
+
+        with patch("bookwyrm.http_client.os.getpid", return_value=-1):
+            forked_session = http_client.get_session()
+        self.assertIsNot(forked_session, session)
+
+    @responses.activate
+    def test_get(self):
+        """requests are timed for each host"""
+        responses.add(responses.GET, "https://example.com/hi", json={"hi": "there"})
+        with patch("bookwyrm.http_client.request_stats.record") as record_mock:
+            response = http_client.get("https://example.com/hi")
+        self.assertEqual(response.json(), {"hi": "there"})
+        self.assertEqual(record_mock.call_args[0][0], "example.com")
+
+    @responses.activate
+    def test_get_ignores_cookies(self):
+        """cookies from one server aren't sent along with later requests"""
+        responses.add(
+            responses.GET,
+            "https://example.com/hi",
+            json={"hi": "there"},
+            headers={"Set-Cookie": "session=abc"},
+        )
+        with patch("bookwyrm.http_client.request_stats.record"):
+            http_client.get("https://example.com/hi")
+        self.assertEqual(len(http_client.get_session().cookies), 0)
+
+    def test_get_invalid_url(self):
+        """bad urls raise the usual requests exceptions"""
+        for url in ["https://", "http:///inbox", "example.com"]:
+            with self.assertRaises(requests.exceptions.RequestException):
+                http_client.get(url)
+
+    def test_request_stats(self):
+        """stats are saved in batches"""
+        stats = http_client.RequestStats()
+        with patch("bookwyrm.http_client.r") as redis_mock:
+            stats.record("example.com", True, 0.1)
+            stats.record("example.com", False, 0.3)
+            self.assertFalse(redis_mock.pipeline.called)
+
+            stats.flush()
+        pipeline = redis_mock.pipeline.return_value
+        self.assertEqual(pipeline.execute.call_count, 1)
+        increments = {
+            call[0][1]: call[0][2] for call in pipeline.hincrby.call_args_list
+        }
+        self.assertEqual(increments, {"requests": 2, "reused": 1, "milliseconds": 400})
+        self.assertEqual(stats.pending_count, 0)
+
+    def test_get_host_stats(self):
+        """reuse rate and latency for each host"""
+        with patch("bookwyrm.http_client.r") as redis_mock:
+            redis_mock.smembers.return_value = {b"example.com", b"old.example.com"}
+            redis_mock.pipeline.return_value.execute.return_value = [
+                {b"requests": b"4", b"reused": b"3", b"milliseconds": b"200"},
+                {},
+            ]
+            result = http_client.get_host_stats()
+        self.assertEqual(
+            result,
+            [
+                {
+                    "host": "example.com",
+                    "requests": 4,
+                    "reuse_rate": 0.75,
+                    "average_milliseconds": 50,
+                }
+            ],
+        )
+        redis_mock.srem.assert_called_once_with(
+            http_client.STATS_KEY, "old.example.com"
+        )
+
+    def test_cache_response(self):
+        """responses that can be revalidated are cached, up to a limit"""
+        response = requests.Response()
+        response._content = b'{"hi": "there"}'  # pylint: disable=protected-access
+        with patch("bookwyrm.http_client.r") as redis_mock:
+            # nothing to check for changes with
+            http_client.cache_response("https://example.com/hi", response)
+            self.assertFalse(redis_mock.pipeline.called)
+
+            response.headers["ETag"] = '"abc"'
+            pipeline = redis_mock.pipeline.return_value
+            pipeline.hget.return_value = b"5"
+            # run the transaction's function on the mock pipeline
+            redis_mock.transaction.side_effect = lambda func, *_: (
+                func(pipeline) or pipeline.execute()
+            )
+            pipeline.execute.side_effect = [
+                [1, 1, 1, 1, 1, 60],
+                [2, 2, 45],
+                [1, 1, 15],
+            ]
+            redis_mock.zpopmin.side_effect = [
+                [(b"http-cache-1", 1)],
+                [(b"http-cache-2", 2)],
+            ]
+            redis_mock.hmget.side_effect = [[b"15"], [b"30"]]
+            with patch("bookwyrm.http_client.settings.HTTP_CACHE_MAX_BYTES", 20):
+                http_client.cache_response("https://example.com/hi", response)
+
+        redis_mock.transaction.assert_called_once_with(
+            ANY, http_client.get_response_cache_key("https://example.com/hi")
+        )
+        pipeline.hget.assert_called_once_with(
+            http_client.RESPONSE_CACHE_SIZES_KEY,
+            http_client.get_response_cache_key("https://example.com/hi"),
+        )
+        mapping = pipeline.hset.call_args_list[0][1]["mapping"]
+        self.assertEqual(mapping["etag"], '"abc"')
+        self.assertEqual(mapping["content"], b'{"hi": "there"}')
+        # the size of the copy it replaced is subtracted
+        pipeline.incrby.assert_called_once_with(
+            http_client.RESPONSE_CACHE_BYTES_KEY, 10
+        )
+        # the oldest responses are dropped until the cache is small enough
+        self.assertEqual(redis_mock.zpopmin.call_count, 2)
+        pipeline.delete.assert_called_with(b"http-cache-2")
+        pipeline.decrby.assert_called_with(http_client.RESPONSE_CACHE_BYTES_KEY, 30)
+
+    def test_touch_cached_response(self):
+        """using a cached response moves it to the back of the eviction queue"""
+        key = http_client.get_response_cache_key("https://example.com/hi")
+        with patch("bookwyrm.http_client.r") as redis_mock, patch(
+            "bookwyrm.http_client.time.time", return_value=100
+        ):
+            http_client.touch_cached_response("https://example.com/hi")
+
+        pipeline = redis_mock.pipeline.return_value
+        self.assertEqual(pipeline.execute.call_count, 1)
+        pipeline.zadd.assert_called_once_with(
+            http_client.RESPONSE_CACHE_KEY, {key: 100}, xx=True
+        )
+        pipeline.expire.assert_called_once_with(key, http_client.RESPONSE_CACHE_TIMEOUT)
+
+    def test_get_cached_response(self):
+        """load a cached response and make headers for revalidating it"""
+        with patch("bookwyrm.http_client.r") as redis_mock:
+            redis_mock.hmget.return_value = [None, None, None]
+            self.assertIsNone(http_client.get_cached_response("https://example.com"))
+
+            redis_mock.hmget.return_value = [b'"abc"', b"", b"hi"]
+            cached = http_client.get_cached_response("https://example.com")
+        self.assertEqual(cached, http_client.CachedResponse('"abc"', None, b"hi"))
+        self.assertEqual(
+            http_client.get_conditional_headers(cached), {"If-None-Match": '"abc"'}
+        )
+        self.assertEqual(
+            http_client.get_response_cache_key("https://example.com", {"a": "b"}),
+            http_client.get_response_cache_key("https://example.com/?a=b"),
+        )
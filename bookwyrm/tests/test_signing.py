@@ -10,13 +10,19 @@ import responses
 
 import pytest
 
-from django.test import TestCase, Client
+from django.core.cache import cache
+from django.test import TestCase, Client, override_settings
 from django.utils.http import http_date
 
 from bookwyrm import models
 from bookwyrm.activitypub import Follow
 from bookwyrm.settings import DOMAIN
-from bookwyrm.signatures import create_key_pair, make_signature, make_digest
+from bookwyrm.signatures import (
+    create_key_pair,
+    make_signature,
+    make_digest,
+    SignerCache,
+)
 
 
 def get_follow_activity(follower, followee):
@@ -28,7 +34,7 @@ def get_follow_activity(follower, followee):
     ).serialize()
 
 
-KeyPair = namedtuple("KeyPair", ("private_key", "public_key"))
+KeyPair = namedtuple("KeyPair", ("private_key", "public_key", "id"), defaults=(None,))
 Sender = namedtuple("Sender", ("remote_id", "key_pair"))
 
 
@@ -195,6 +201,54 @@ class Signature(TestCase):
         response = self.send_test_request(sender=self.fake_remote)
         self.assertEqual(response.status_code, 401)
 
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    @responses.activate
+    def test_nonexistent_signer_cached(self):
+        """an actor that can't be found isn't looked up again right away"""
+        cache.clear()
+        responses.add(
+            responses.GET,
+            self.fake_remote.remote_id,
+            json={"error": "not found"},
+            status=404,
+        )
+
+        response = self.send_test_request(sender=self.fake_remote)
+        self.assertEqual(response.status_code, 401)
+        response = self.send_test_request(sender=self.fake_remote)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(len(responses.calls), 1)
+
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_actor_key_cached(self):
+        """a known actor's key is looked up once, and bad signatures can't make
+        us look up the actor over and over"""
+        cache.clear()
+        with patch(
+            "bookwyrm.activitypub.resolve_remote_id", return_value=self.mouse
+        ) as resolve_mock, patch("bookwyrm.views.inbox.sometimes_async_activity_task"):
+            response = self.send_test_request(sender=self.mouse)
+            self.assertEqual(response.status_code, 200)
+            response = self.send_test_request(sender=self.mouse)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(resolve_mock.call_count, 1)
+
+            for _ in range(3):
+                response = self.send_test_request(
+                    sender=Sender(
+                        self.mouse.remote_id,
+                        KeyPair(self.cat.key_pair.private_key, None, "hi"),
+                    )
+                )
+                self.assertEqual(response.status_code, 401)
+            # one attempt to look for a new key, and no more
+            self.assertEqual(resolve_mock.call_count, 2)
+            self.assertTrue(resolve_mock.call_args[1]["refresh"])
+
     @pytest.mark.integration
     def test_changed_data(self):
         """Message data must match the digest header."""
@@ -221,3 +275,22 @@ class Signature(TestCase):
                 self.mouse, date=http_date(time.time() - 301)
             )
             self.assertEqual(response.status_code, 401)
+
+    def test_signer_cache(self):
+        """keys are parsed once, and rotated keys are parsed again"""
+        signer_cache = SignerCache(max_size=2)
+        private_key, _ = create_key_pair()
+        with patch("bookwyrm.signatures.RSA.import_key") as import_key:
+            signer = signer_cache.get_signer(1, private_key)
+            self.assertEqual(signer_cache.get_signer(1, private_key), signer)
+            self.assertEqual(import_key.call_count, 1)
+
+            # a new key for the same key pair
+            signer_cache.get_signer(1, create_key_pair()[0])
+            self.assertEqual(import_key.call_count, 2)
+
+            # the least recently used key is dropped
+            signer_cache.get_signer(2, private_key)
+            self.assertEqual(len(signer_cache.signers), 2)
+            signer_cache.get_signer(1, private_key)
+            self.assertEqual(import_key.call_count, 4)
@@ -1,12 +1,15 @@
 """ tests incoming activities"""
+import hashlib
 import json
 import pathlib
 from unittest.mock import patch
 
+import redis
 from django.core.exceptions import PermissionDenied
 from django.http import HttpResponseNotAllowed, HttpResponseNotFound
 from django.test import TestCase, Client
 from django.test.client import RequestFactory
+from django.utils.http import http_date
 
 from bookwyrm import models, views
 
@@ -126,6 +129,159 @@ class Inbox(TestCase):
                 )
         self.assertEqual(result.status_code, 200)
 
+    def test_inbox_duplicate(self):
+        """the same activity delivered twice is only handled once"""
+        body = json.dumps(self.create_json)
+        with patch("bookwyrm.views.inbox.has_valid_signature") as mock_valid, patch(
+            "bookwyrm.views.inbox.r"
+        ) as redis_mock, patch(
+            "bookwyrm.views.inbox.sometimes_async_activity_task"
+        ) as mock:
+            mock_valid.return_value = True
+            redis_mock.pipeline.return_value.execute.return_value = [
+                True,
+                hashlib.sha256(body.encode("utf-8")).digest(),
+            ]
+            result = self.client.post("/inbox", body, content_type="application/json")
+            self.assertEqual(result.status_code, 200)
+            self.assertEqual(mock.call_count, 1)
+
+            redis_mock.pipeline.return_value.execute.return_value = [
+                None,
+                hashlib.sha256(body.encode("utf-8")).digest(),
+            ]
+            result = self.client.post(
+                "/user/mouse/inbox", body, content_type="application/json"
+            )
+            self.assertEqual(result.status_code, 200)
+            self.assertEqual(mock.call_count, 1)
+
+            # same id, different contents
+            redis_mock.pipeline.return_value.execute.return_value = [None, b"hi"]
+            result = self.client.post("/inbox", body, content_type="application/json")
+            self.assertEqual(mock.call_count, 2)
+
+        key = redis_mock.pipeline.return_value.set.call_args[0][0]
+        self.assertEqual(key, f"inbox-seen-{self.create_json['id']}")
+
+    @patch("bookwyrm.views.inbox.settings.INBOX_INGEST", True)
+    def test_inbox_ingest(self):
+        """the signature is checked in a task"""
+        now = http_date()
+        with patch("bookwyrm.views.inbox.r") as redis_mock, patch(
+            "bookwyrm.views.inbox.broker"
+        ) as broker_mock, patch(
+            "bookwyrm.views.inbox.ingest_activity_task.apply_async"
+        ) as mock, patch(
+            "bookwyrm.views.inbox.has_valid_signature"
+        ) as mock_valid:
+            broker_mock.llen.return_value = 0
+            redis_mock.get.return_value = None
+            result = self.client.post(
+                "/inbox",
+                json.dumps(self.create_json),
+                content_type="application/json",
+                HTTP_DATE=now,
+                HTTP_SIGNATURE='keyId="hi",headers="date",signature="aGk="',
+            )
+        self.assertEqual(result.status_code, 202)
+        self.assertFalse(mock_valid.called)
+        # activities aren't counted until they're verified
+        self.assertFalse(redis_mock.pipeline.called)
+        self.assertEqual(mock.call_count, 1)
+        path, headers, body = mock.call_args[1]["args"]
+        self.assertEqual(path, "/inbox")
+        self.assertEqual(headers["Date"], now)
+        self.assertEqual(json.loads(body), self.create_json)
+
+    @patch("bookwyrm.views.inbox.settings.INBOX_INGEST", True)
+    @patch("bookwyrm.views.inbox.settings.INBOX_INGEST_LIMIT", 10)
+    @patch("bookwyrm.views.inbox.settings.INBOX_INGEST_HOST_LIMIT", 2)
+    def test_inbox_ingest_backed_up(self):
+        """senders are asked to try again later"""
+        headers = {
+            "HTTP_DATE": http_date(),
+            "HTTP_SIGNATURE": 'keyId="hi",headers="date",signature="aGk="',
+        }
+        with patch("bookwyrm.views.inbox.r") as redis_mock, patch(
+            "bookwyrm.views.inbox.broker"
+        ) as broker_mock, patch(
+            "bookwyrm.views.inbox.ingest_activity_task.apply_async"
+        ) as mock:
+            broker_mock.llen.return_value = 5
+            redis_mock.get.return_value = b"2"
+            result = self.client.post(
+                "/inbox",
+                json.dumps(self.create_json),
+                content_type="application/json",
+                **headers,
+            )
+            self.assertEqual(result.status_code, 429)
+            self.assertEqual(result["Retry-After"], "60")
+
+            broker_mock.llen.return_value = 10
+            redis_mock.get.return_value = None
+            result = self.client.post(
+                "/inbox",
+                json.dumps(self.create_json),
+                content_type="application/json",
+                **headers,
+            )
+            self.assertEqual(result.status_code, 503)
+
+            # the broker can't be reached
+            broker_mock.llen.side_effect = redis.exceptions.ConnectionError()
+            result = self.client.post(
+                "/inbox",
+                json.dumps(self.create_json),
+                content_type="application/json",
+                **headers,
+            )
+            self.assertEqual(result.status_code, 202)
+        self.assertEqual(mock.call_count, 1)
+        broker_mock.llen.assert_called_with("inbox_ingest")
+
+    def test_ingest_activity_task(self):
+        """verify the signature and handle the activity"""
+        body = json.dumps(self.create_json)
+        with patch("bookwyrm.views.inbox.r") as redis_mock, patch(
+            "bookwyrm.views.inbox.has_valid_signature"
+        ) as mock_valid, patch("bookwyrm.views.inbox.activity_task") as mock:
+            redis_mock.pipeline.return_value.execute.return_value = [True, b""]
+            mock_valid.return_value = False
+            views.inbox.ingest_activity_task("/inbox", {"Date": "hi"}, body)
+            self.assertFalse(mock.called)
+            # forged activities don't count against the server they claim to be from
+            self.assertFalse(redis_mock.pipeline.return_value.incr.called)
+
+            mock_valid.return_value = True
+            views.inbox.ingest_activity_task("/inbox", {"Date": "hi"}, body)
+            self.assertEqual(mock.call_count, 1)
+        redis_mock.pipeline.return_value.incr.assert_called_once_with(
+            "inbox-ingest-host-"
+        )
+        # the window isn't extended by each activity
+        redis_mock.pipeline.return_value.set.assert_any_call(
+            "inbox-ingest-host-", 0, nx=True, ex=60
+        )
+
+        request = mock_valid.call_args[0][0]
+        self.assertEqual(request.headers["date"], "hi")
+        self.assertEqual(request.body, body.encode("utf-8"))
+        self.assertFalse(mock_valid.call_args[1]["check_age"])
+
+    def test_activity_task_failed(self):
+        """an activity that couldn't be handled isn't skipped when it's sent again"""
+        with patch("bookwyrm.views.inbox.r") as redis_mock, patch(
+            "bookwyrm.activitypub.verbs.Create.action"
+        ) as mock:
+            mock.side_effect = ValueError()
+            with self.assertRaises(ValueError):
+                views.inbox.activity_task(self.create_json)
+        redis_mock.delete.assert_called_once_with(
+            f"inbox-seen-{self.create_json['id']}"
+        )
+
     def test_is_blocked_user_agent(self):
         """check for blocked servers"""
         request = self.factory.post(
@@ -6,7 +6,7 @@ from django.template.response import TemplateResponse
 from django.test import TestCase
 from django.test.client import RequestFactory
 
-from bookwyrm import models
+from bookwyrm import activitystreams, models
 from bookwyrm import views
 from bookwyrm.tests.validate_html import validate_html
 
@@ -37,7 +37,10 @@ class LandingViews(TestCase):
         view = views.Home.as_view()
         request = self.factory.get("")
         request.user = self.local_user
-        with patch("bookwyrm.activitystreams.ActivityStream.get_activity_stream"):
+        with patch(
+            "bookwyrm.activitystreams.ActivityStream.get_activity_page",
+            return_value=activitystreams.StreamPage([]),
+        ):
             result = view(request)
         self.assertEqual(result.status_code, 200)
         validate_html(result.render())
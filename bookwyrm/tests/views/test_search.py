@@ -53,6 +53,44 @@ class Views(TestCase):
         self.assertEqual(data[0]["title"], "Test Book")
         self.assertEqual(data[0]["key"], f"https://{DOMAIN}/book/{self.book.id}")
 
+    def test_search_stream(self):
+        """local results are sent first, then each connector's"""
+        request = self.factory.get("", {"q": "Test Book"})
+        request.user = AnonymousUser()
+        response = views.search_stream(request)
+        lines = [json.loads(line) for line in response.streaming_content]
+        self.assertEqual(len(lines), 1)
+        self.assertIsNone(lines[0]["connector"])
+        self.assertEqual(lines[0]["results"][0]["title"], "Test Book")
+
+        connector = models.Connector.objects.create(
+            identifier="example.com",
+            connector_file="openlibrary",
+            base_url="https://example.com",
+            books_url="https://example.com/books",
+            covers_url="https://example.com/covers",
+            search_url="https://example.com/search?q=",
+        )
+        search_result = SearchResult(
+            key="http://www.example.com/book/1",
+            title="Test Book",
+            author="Author Name",
+            year="2000",
+            connector=connector,
+        )
+        request.user = self.local_user
+        with patch(
+            "bookwyrm.connectors.connector_manager.search_progressively"
+        ) as remote_search:
+            remote_search.return_value = iter(
+                [{"connector": connector, "results": [search_result]}]
+            )
+            response = views.search_stream(request)
+            lines = [json.loads(line) for line in response.streaming_content]
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[1]["connector"]["identifier"], "example.com")
+        self.assertEqual(lines[1]["results"][0]["key"], "http://www.example.com/book/1")
+
     def test_search_no_query(self):
         """just the search page"""
         view = views.Search.as_view()
@@ -394,6 +394,7 @@ urlpatterns = [
     # search
     re_path(r"^search.json/?$", views.Search.as_view(), name="search"),
     re_path(r"^search/?$", views.Search.as_view(), name="search"),
+    re_path(r"^search/stream/?$", views.search_stream, name="search-stream"),
     # imports
     re_path(r"^import/?$", views.Import.as_view(), name="import"),
     re_path(
@@ -1,8 +1,7 @@
 """ISNI author checking utilities"""
 import xml.etree.ElementTree as ET
-import requests
 
-from bookwyrm import activitypub, models
+from bookwyrm import activitypub, http_client, models
 
 
 def request_isni_data(search_index, search_term, max_records=5):
@@ -19,7 +18,9 @@ def request_isni_data(search_index, search_term, max_records=5):
         "recordPacking": "xml",
         "sortKeys": "RLV,pica,0,,",
     }
-    result = requests.get("http://isni.oclc.org/sru/", params=query_params, timeout=15)
+    result = http_client.get(
+        "http://isni.oclc.org/sru/", params=query_params, timeout=15
+    )
     # the OCLC ISNI server asserts the payload is encoded
     # in latin1, but we know better
     result.encoding = "utf-8"
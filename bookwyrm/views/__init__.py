@@ -145,7 +145,7 @@ from .rss_feed import (
     RssQuotesOnlyFeed,
     RssCommentsOnlyFeed,
 )
-from .search import Search
+from .search import Search, search_stream
 from .setup import InstanceConfig, CreateAdmin
 from .status import CreateStatus, EditStatus, DeleteStatus, update_progress
 from .status import edit_readthrough
@@ -23,6 +23,7 @@ from bookwyrm.tasks import (
     CONNECTORS,
     LISTS,
     INBOX,
+    INBOX_INGEST,
     IMPORTS,
     IMPORT_TRIGGERED,
     BROADCAST,
@@ -64,6 +65,7 @@ class CeleryStatus(View):
                 CONNECTORS: r.llen(CONNECTORS),
                 LISTS: r.llen(LISTS),
                 INBOX: r.llen(INBOX),
+                INBOX_INGEST: r.llen(INBOX_INGEST),
                 IMPORTS: r.llen(IMPORTS),
                 IMPORT_TRIGGERED: r.llen(IMPORT_TRIGGERED),
                 BROADCAST: r.llen(BROADCAST),
@@ -120,6 +122,7 @@ class ClearCeleryForm(forms.Form):
             (CONNECTORS, "Connectors"),
             (LISTS, "Lists"),
             (INBOX, "Inbox"),
+            (INBOX_INGEST, "Inbox verification"),
             (IMPORTS, "Imports"),
             (IMPORT_TRIGGERED, "Import triggered"),
             (BROADCAST, "Broadcasts"),
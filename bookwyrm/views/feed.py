@@ -1,4 +1,5 @@
 """ non-interactive pages """
+from functools import partial
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
 from django.db.models import Q
@@ -41,14 +42,18 @@ class Feed(View):
         tab = [s for s in STREAMS if s["key"] == tab]
         tab = tab[0] if tab else STREAMS[0]
 
-        activities = activitystreams.streams[tab["key"]].get_activity_stream(
-            request.user
-        )
-        filtered_activities = filter_stream_by_status_type(
-            activities,
+        # pages start after the last status on the previous page
+        cursor = activitystreams.parse_cursor(request.GET.get("cursor"))
+        activities = activitystreams.streams[tab["key"]].get_activity_page(
+            request.user,
+            cursor=cursor,
             allowed_types=request.user.feed_status_types,
+            # in case the stream's status type stores aren't populated
+            status_filter=partial(
+                filter_stream_by_status_type,
+                allowed_types=request.user.feed_status_types,
+            ),
         )
-        paginated = Paginator(filtered_activities, PAGE_LENGTH)
 
         suggestions = suggested_users.get_suggestions(request.user)
 
@@ -56,7 +61,7 @@ class Feed(View):
             **feed_page_data(request.user),
             **{
                 "user": request.user,
-                "activities": paginated.get_page(request.GET.get("page")),
+                "activities": activities,
                 "suggested_users": suggestions,
                 "tab": tab,
                 "streams": STREAMS,
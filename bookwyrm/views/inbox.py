@@ -1,10 +1,17 @@
 """ incoming activities """
+from collections import namedtuple
+import hashlib
 import json
 import re
 import logging
+import time
+from urllib.parse import urlparse
 
+import redis
 import requests
+from requests.structures import CaseInsensitiveDict
 
+from django.core.cache import cache
 from django.http import HttpResponse, Http404
 from django.core.exceptions import BadRequest, PermissionDenied
 from django.shortcuts import get_object_or_404
@@ -12,13 +19,43 @@ from django.utils.decorators import method_decorator
 from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 
-from bookwyrm import activitypub, models
-from bookwyrm.tasks import app, INBOX
-from bookwyrm.signatures import Signature
+from celerywyrm.settings import REDIS_BROKER_URL
+from bookwyrm import activitypub, models, settings
+from bookwyrm.redis_store import r
+from bookwyrm.tasks import app, INBOX, INBOX_INGEST
+from bookwyrm.signatures import Signature, http_date_age, MAX_SIGNATURE_AGE
 from bookwyrm.utils import regex
 
 logger = logging.getLogger(__name__)
 
+# the celery broker, to see how many activities are waiting to be verified
+broker = redis.from_url(REDIS_BROKER_URL)
+
+# counts of verified activities received from each server, which start over
+# every INGEST_HOST_WINDOW seconds
+INGEST_HOST_KEY = "inbox-ingest-host"
+INGEST_HOST_WINDOW = 60
+# seconds senders are asked to wait when there are too many activities waiting
+INGEST_RETRY_AFTER = 60
+
+# activities that have been received recently, with a digest of their contents
+DUPLICATE_KEY = "inbox-seen"
+
+# how long a remote actor's public key is cached, and how old it can get before
+# it's fetched again in the background
+ACTOR_KEY_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+ACTOR_KEY_REFRESH_AGE = 60 * 60 * 24
+# how long to remember that an actor couldn't be found, instead of looking again
+ACTOR_KEY_MISSING_TIMEOUT = 60 * 10
+# the least time between fetching an actor again to look for a new key
+ACTOR_KEY_REFETCH_INTERVAL = 60
+
+# a public key, the actor it belongs to, and when it was looked up
+ActorKey = namedtuple("ActorKey", ("actor", "public_key", "fetched"))
+
+# the parts of a request needed to verify its signature in a task
+QueuedRequest = namedtuple("QueuedRequest", ("path", "headers", "body"))
+
 
 @method_decorator(csrf_exempt, name="dispatch")
 # pylint: disable=no-self-use
@@ -50,19 +87,133 @@ class Inbox(View):
         ):
             raise Http404()
 
+        if settings.INBOX_INGEST:
+            return queue_activity(request, activity_json)
+
         # verify the signature
         if not has_valid_signature(request, activity_json):
-            if activity_json["type"] == "Delete":
-                # Pretend that unauth'd deletes succeed. Auth may be failing
-                # because the resource or owner of the resource might have
-                # been deleted.
-                return HttpResponse()
-            return HttpResponse(status=401)
+            return unauthorized_response(activity_json)
+
+        if is_duplicate_activity(activity_json, request.body):
+            return HttpResponse()
 
         sometimes_async_activity_task(activity_json)
         return HttpResponse()
 
 
+def unauthorized_response(activity_json):
+    """the response to an activity that isn't signed correctly"""
+    if activity_json["type"] == "Delete":
+        # Pretend that unauth'd deletes succeed. Auth may be failing
+        # because the resource or owner of the resource might have
+        # been deleted.
+        return HttpResponse()
+    return HttpResponse(status=401)
+
+
+def queue_activity(request, activity_json):
+    """do the quick checks on the signature, and leave verifying it to a task"""
+    try:
+        Signature.parse(request)
+        if http_date_age(request.headers["date"]) > MAX_SIGNATURE_AGE:
+            raise ValueError(f"Request too old: {request.headers['date']}")
+        body = request.body.decode("utf-8")
+    except (KeyError, ValueError):
+        return unauthorized_response(activity_json)
+
+    # let the sender know to try again later if we're backed up
+    if get_ingest_backlog() >= settings.INBOX_INGEST_LIMIT:
+        return retry_later_response(503)
+    if get_host_activity(get_host(activity_json)) >= settings.INBOX_INGEST_HOST_LIMIT:
+        return retry_later_response(429)
+
+    ingest_activity_task.apply_async(args=(request.path, dict(request.headers), body))
+    return HttpResponse(status=202)
+
+
+def retry_later_response(status):
+    """ask the sender to try again in a bit"""
+    response = HttpResponse(status=status)
+    response["Retry-After"] = INGEST_RETRY_AFTER
+    return response
+
+
+def get_host(activity_json):
+    """the server an activity was sent from"""
+    return urlparse(activity_json.get("actor") or "").netloc
+
+
+def get_ingest_backlog():
+    """how many activities are waiting to be verified"""
+    try:
+        return broker.llen(INBOX_INGEST)
+    except redis.exceptions.RedisError as err:
+        logger.warning("Unable to check the inbox ingest queue: %s", err)
+        return 0
+
+
+def get_host_activity(host):
+    """how many verified activities a server has sent in the current window.
+    Only verified activities are counted, so that nobody else can use up a
+    server's share by sending activities in its name"""
+    try:
+        return int(r.get(f"{INGEST_HOST_KEY}-{host}") or 0)
+    except redis.exceptions.RedisError as err:
+        logger.warning("Unable to check activity from %s: %s", host, err)
+        return 0
+
+
+def count_host_activity(host):
+    """a server has sent a verified activity"""
+    key = f"{INGEST_HOST_KEY}-{host}"
+    try:
+        pipeline = r.pipeline()
+        # the expiry is only set when the window starts, not on every activity
+        pipeline.set(key, 0, nx=True, ex=INGEST_HOST_WINDOW)
+        pipeline.incr(key)
+        pipeline.execute()
+    except redis.exceptions.RedisError as err:
+        logger.warning("Unable to count activity from %s: %s", host, err)
+
+
+def is_duplicate_activity(activity_json, body):
+    """has this exact activity already been received, from any inbox, in the last
+    little while; it's recorded as received if it hasn't, and forgotten again if
+    handling it fails"""
+    activity_id = activity_json.get("id")
+    if not settings.INBOX_DUPLICATE_WINDOW or not activity_id:
+        return False
+
+    key = f"{DUPLICATE_KEY}-{activity_id}"
+    digest = hashlib.sha256(body).digest()
+    try:
+        pipeline = r.pipeline()
+        pipeline.set(key, digest, nx=True, ex=settings.INBOX_DUPLICATE_WINDOW)
+        pipeline.get(key)
+        is_new, seen_digest = pipeline.execute()
+    except redis.exceptions.RedisError as err:
+        logger.warning("Unable to check for duplicate activities: %s", err)
+        return False
+
+    # an activity with the same id but different contents is handled as usual
+    if is_new or seen_digest != digest:
+        return False
+    logger.debug("Skipping duplicate activity %s", activity_id)
+    return True
+
+
+def forget_activity(activity_json):
+    """an activity couldn't be handled, so it shouldn't be skipped as a duplicate
+    when the sender tries it again"""
+    activity_id = activity_json.get("id")
+    if not settings.INBOX_DUPLICATE_WINDOW or not activity_id:
+        return
+    try:
+        r.delete(f"{DUPLICATE_KEY}-{activity_id}")
+    except redis.exceptions.RedisError as err:
+        logger.warning("Unable to forget activity %s: %s", activity_id, err)
+
+
 def raise_is_blocked_user_agent(request):
     """check if a request is from a blocked server based on user agent"""
     # check user agent
@@ -100,53 +251,145 @@ def raise_is_blocked_activity(activity_json):
 def sometimes_async_activity_task(activity_json):
     """Sometimes we can effectively respond to a request without queuing a new task,
     and whenever that is possible, we should do it."""
-    activity = activitypub.parse(activity_json)
-
-    # try resolving this activity without making any http requests
     try:
-        activity.action(allow_external_connections=False)
-    except activitypub.ActivitySerializerError:
-        # if that doesn't work, run it asynchronously
-        activity_task.apply_async(args=(activity_json,))
+        activity = activitypub.parse(activity_json)
+
+        # try resolving this activity without making any http requests
+        try:
+            activity.action(allow_external_connections=False)
+        except activitypub.ActivitySerializerError:
+            # if that doesn't work, run it asynchronously
+            activity_task.apply_async(args=(activity_json,))
+    except Exception:
+        forget_activity(activity_json)
+        raise
 
 
 @app.task(queue=INBOX)
 def activity_task(activity_json):
     """do something with this json we think is legit"""
-    # lets see if the activitypub module can make sense of this json
-    activity = activitypub.parse(activity_json)
+    try:
+        # lets see if the activitypub module can make sense of this json
+        activity = activitypub.parse(activity_json)
 
-    # cool that worked, now we should do the action described by the type
-    # (create, update, delete, etc)
-    activity.action()
+        # cool that worked, now we should do the action described by the type
+        # (create, update, delete, etc)
+        activity.action()
+    except Exception:
+        forget_activity(activity_json)
+        raise
 
 
-def has_valid_signature(request, activity):
+@app.task(queue=INBOX_INGEST)
+def ingest_activity_task(path, headers, body):
+    """verify an activity that was accepted without checking its signature, and
+    then do something with it"""
+    activity_json = json.loads(body)
+    request = QueuedRequest(path, CaseInsensitiveDict(headers), body.encode("utf-8"))
+    # the age of the signature was checked when the activity was received
+    if not has_valid_signature(request, activity_json, check_age=False):
+        logger.info("Invalid signature for activity %s", activity_json.get("id"))
+        return
+    count_host_activity(get_host(activity_json))
+    if not is_duplicate_activity(activity_json, request.body):
+        activity_task(activity_json)
+
+
+def has_valid_signature(request, activity, check_age=True):
     """verify incoming signature"""
     try:
         signature = Signature.parse(request)
-        remote_user = activitypub.resolve_remote_id(
-            activity.get("actor"), model=models.User
-        )
-        if not remote_user:
+        actor = activity.get("actor")
+        actor_key = get_actor_key(signature.key_id, actor)
+        if not actor_key:
             return False
 
-        if signature.key_id != remote_user.key_pair.remote_id:
-            if (
-                signature.key_id != f"{remote_user.remote_id}#main-key"
-            ):  # legacy Bookwyrm
-                raise ValueError("Wrong actor created signature.")
-
         try:
-            signature.verify(remote_user.key_pair.public_key, request)
+            signature.verify(actor_key.public_key, request, check_age)
         except ValueError:
-            old_key = remote_user.key_pair.public_key
-            remote_user = activitypub.resolve_remote_id(
-                remote_user.remote_id, model=models.User, refresh=True
-            )
-            if remote_user.key_pair.public_key == old_key:
+            new_key = refetch_actor_key(signature.key_id, actor)
+            if not new_key or new_key.public_key == actor_key.public_key:
                 raise  # Key unchanged.
-            signature.verify(remote_user.key_pair.public_key, request)
+            signature.verify(new_key.public_key, request, check_age)
     except (ValueError, requests.exceptions.HTTPError):
         return False
     return True
+
+
+def get_actor_key(key_id, actor):
+    """the public key for a signature's key id, which is cached so that it isn't
+    looked up for every activity, and not looked up at all for a while if the actor
+    couldn't be found"""
+    key_cache_key = get_actor_key_cache_key(key_id)
+    missing_cache_key = get_missing_actor_cache_key(actor)
+    cached = cache.get_many([key_cache_key, missing_cache_key])
+    if missing_cache_key in cached:
+        return None
+
+    actor_key = cached.get(key_cache_key)
+    if actor_key is None:
+        return load_actor_key(key_id, actor)
+
+    if actor_key.actor != actor:
+        raise ValueError("Wrong actor created signature.")
+    if time.time() - actor_key.fetched > ACTOR_KEY_REFRESH_AGE and cache.add(
+        get_actor_refetch_cache_key(actor), True, ACTOR_KEY_REFETCH_INTERVAL
+    ):
+        refresh_actor_key_task.delay(key_id, actor)
+    return actor_key
+
+
+def refetch_actor_key(key_id, actor):
+    """look the actor up again in case their key has changed, but only once in a
+    while, so that bad signatures can't be used to make us send requests"""
+    if not cache.add(
+        get_actor_refetch_cache_key(actor), True, ACTOR_KEY_REFETCH_INTERVAL
+    ):
+        return None
+    return load_actor_key(key_id, actor, refresh=True)
+
+
+def load_actor_key(key_id, actor, refresh=False):
+    """find the actor and cache their public key"""
+    try:
+        remote_user = activitypub.resolve_remote_id(
+            actor, model=models.User, refresh=refresh
+        )
+    except requests.exceptions.HTTPError:
+        remote_user = None
+    if not remote_user or not remote_user.key_pair:
+        cache.set(get_missing_actor_cache_key(actor), True, ACTOR_KEY_MISSING_TIMEOUT)
+        return None
+
+    if key_id != remote_user.key_pair.remote_id:
+        if key_id != f"{remote_user.remote_id}#main-key":  # legacy Bookwyrm
+            raise ValueError("Wrong actor created signature.")
+
+    actor_key = ActorKey(actor, remote_user.key_pair.public_key, time.time())
+    cache.set(get_actor_key_cache_key(key_id), actor_key, ACTOR_KEY_CACHE_TIMEOUT)
+    return actor_key
+
+
+def get_actor_key_cache_key(key_id):
+    """the cache key for the public key with this id"""
+    return f"actor-key-{key_id}"
+
+
+def get_missing_actor_cache_key(actor):
+    """the cache key that marks an actor as not found"""
+    return f"actor-key-missing-{actor}"
+
+
+def get_actor_refetch_cache_key(actor):
+    """the cache key that marks an actor as recently looked up"""
+    return f"actor-key-refetch-{actor}"
+
+
+@app.task(queue=INBOX)
+def refresh_actor_key_task(key_id, actor):
+    """check for a new key for an actor whose cached key is getting old"""
+    try:
+        load_actor_key(key_id, actor, refresh=True)
+    except ValueError:
+        logger.info("Key %s no longer belongs to %s", key_id, actor)
+        cache.delete(get_actor_key_cache_key(key_id))
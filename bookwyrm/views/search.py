@@ -1,12 +1,14 @@
 """ search views"""
+import json
 import re
 
 from django.contrib.postgres.search import TrigramSimilarity
 from django.core.paginator import Paginator
 from django.db.models.functions import Greatest
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.template.response import TemplateResponse
 from django.views import View
+from django.views.decorators.http import require_GET
 
 from csp.decorators import csp_update
 
@@ -60,6 +62,51 @@ def api_book_search(request):
     )
 
 
+@require_GET
+def search_stream(request):
+    """Return books as they're found, one line of json for each source: first
+    local results, then each connector's as soon as that connector responds"""
+    query = request.GET.get("q")
+    query = isbn_check(query)
+    min_confidence = request.GET.get("min_confidence", 0)
+
+    def stream_results():
+        """local results don't wait for remote ones"""
+        book_results = search(query, min_confidence=min_confidence)
+        yield format_stream_line(
+            None, [format_search_result(r) for r in book_results[:10]]
+        )
+        # only logged in users can search remote sources
+        if not request.user.is_authenticated:
+            return
+        for result_set in connector_manager.search_progressively(
+            query, min_confidence=min_confidence
+        ):
+            yield format_stream_line(
+                result_set["connector"],
+                [r.json() for r in result_set["results"]],
+            )
+
+    response = StreamingHttpResponse(
+        stream_results(), content_type="application/x-ndjson"
+    )
+    # don't let a proxy hold the results until they're all in
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def format_stream_line(connector, results):
+    """one source's results, as a line of json"""
+    source = None
+    if connector:
+        source = {
+            "identifier": connector.identifier,
+            "name": connector.name,
+            "base_url": connector.base_url,
+        }
+    return json.dumps({"connector": source, "results": results}) + "\n"
+
+
 def book_search(request):
     """the real business is elsewhere"""
     query = request.GET.get("q")